@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Migration script to add the geohash column and index to locations
+Run this script once on existing databases; it also computes the geohash of
+every location that has coordinates
+"""
+
+from app import app, db
+from map_clusters import backfill_geohashes
+from sqlalchemy import text
+
+def add_location_geohash():
+    """Add the geohash column, its (company_id, geohash) index and backfill it"""
+    with app.app_context():
+        try:
+            # Check if column already exists
+            result = db.session.execute(text("""
+                SELECT column_name 
+                FROM information_schema.columns 
+                WHERE table_name = 'locations' AND column_name = 'geohash'
+            """))
+            
+            if result.fetchone():
+                print("✅ geohash column already exists in locations table")
+            else:
+                db.session.execute(text("""
+                    ALTER TABLE locations 
+                    ADD COLUMN geohash VARCHAR(12)
+                """))
+                db.session.commit()
+                print("✅ Successfully added geohash column to locations table")
+            
+            db.session.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_locations_company_geohash "
+                "ON locations (company_id, geohash)"
+            ))
+            db.session.commit()
+            print("✅ Location geohash index created")
+            
+            updated = backfill_geohashes()
+            print(f"✅ Computed the geohash of {updated} locations")
+            
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Error adding geohash column: {str(e)}")
+            raise
+
+if __name__ == "__main__":
+    add_location_geohash()
@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+"""
+Migration script to add the due-schedule index to maintenance_schedules
+Run this script once on existing databases; new databases get the index from db.create_all()
+"""
+
+from app import app, db
+from sqlalchemy import text
+
+def add_maintenance_schedule_due_index():
+    """Create the (is_active, next_due) index used by flask generate-pm-work-orders"""
+    with app.app_context():
+        try:
+            db.session.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_maintenance_schedules_active_next_due "
+                "ON maintenance_schedules (is_active, next_due)"
+            ))
+            db.session.commit()
+            print("✅ Maintenance schedule due index created")
+            
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Error creating index: {str(e)}")
+            raise
+
+if __name__ == "__main__":
+    add_maintenance_schedule_due_index()
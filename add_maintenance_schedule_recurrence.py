@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Migration script to add recurrence_options to maintenance_schedules
+Run this script once on existing databases; it also pins monthly/yearly schedules
+to the day (and month) of their current next due date so they stop drifting
+"""
+
+import json
+
+from app import app, db
+from models import MaintenanceSchedule
+from recurrence import rule_for
+from sqlalchemy import text
+
+def add_maintenance_schedule_recurrence():
+    """Add the recurrence_options column and backfill the day rules"""
+    with app.app_context():
+        try:
+            # Check if column already exists
+            result = db.session.execute(text("""
+                SELECT column_name 
+                FROM information_schema.columns 
+                WHERE table_name = 'maintenance_schedules' AND column_name = 'recurrence_options'
+            """))
+            
+            if result.fetchone():
+                print("✅ recurrence_options column already exists in maintenance_schedules table")
+            else:
+                db.session.execute(text("""
+                    ALTER TABLE maintenance_schedules 
+                    ADD COLUMN recurrence_options TEXT
+                """))
+                db.session.commit()
+                print("✅ Successfully added recurrence_options column to maintenance_schedules table")
+            
+            updated = 0
+            schedules = MaintenanceSchedule.query.filter(
+                MaintenanceSchedule.frequency.in_(['monthly', 'yearly']),
+                MaintenanceSchedule.recurrence_options == None,
+                MaintenanceSchedule.next_due != None
+            )
+            for schedule in schedules.yield_per(1000):
+                rule = rule_for(schedule)
+                if rule is not None:
+                    schedule.recurrence_options = json.dumps(rule.with_defaults(schedule.next_due).options())
+                    updated += 1
+            db.session.commit()
+            print(f"✅ Pinned the day rule of {updated} monthly/yearly schedules")
+            
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Error adding recurrence_options column: {str(e)}")
+            raise
+
+if __name__ == "__main__":
+    add_maintenance_schedule_recurrence()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Migration script to add the media_blobs table and move existing media into
+the content-addressed store
+Run this script once on existing databases; it copies every referenced file
+under static/uploads into static/uploads/blobs (identical files are stored
+once), rewrites the media paths of work order and comment media (run
+add_work_order_media.py first), work order requests and WhatsApp messages,
+and removes the old files after each batch is committed
+"""
+
+import os
+import shutil
+import uuid
+
+from app import app, db
+from media_store import media_store
+from models import MediaBlob, WorkOrderMedia, WorkOrderRequest, WhatsAppMessage
+from sqlalchemy import select, update
+
+BATCH_SIZE = 500
+
+MEDIA_COLUMNS = (
+    (WorkOrderMedia, ('path',)),
+    (WorkOrderRequest, ('images', 'videos', 'voice_notes')),
+    (WhatsAppMessage, ('media_url',)),
+)
+
+def store_legacy_file(path, stored):
+    """Blob path for the legacy file at ``path`` (None when it is missing); adds one reference"""
+    if path in stored:
+        db.session.execute(update(MediaBlob).where(MediaBlob.path == stored[path])
+                           .values(ref_count=MediaBlob.ref_count + 1))
+        return stored[path]
+    source = media_store.absolute(path)
+    if not os.path.isfile(source):
+        return None
+    # Copy, so the original is still there if the batch does not commit
+    staging = media_store.absolute(f'{media_store.prefix}/.incoming-{uuid.uuid4().hex}')
+    os.makedirs(os.path.dirname(staging), exist_ok=True)
+    shutil.copy2(source, staging)
+    stored[path] = media_store.store_file(staging, os.path.basename(path))
+    return stored[path]
+
+def migrate_model(model, columns, stored):
+    """Rewrite the media paths of ``model`` in batches; returns (rows updated, files moved)"""
+    rows_updated = files_moved = 0
+    last_id = 0
+    while True:
+        records = db.session.execute(
+            select(model).where(model.id > last_id).order_by(model.id).limit(BATCH_SIZE)
+        ).scalars().all()
+        if not records:
+            break
+        last_id = records[-1].id
+        moved_before = set(stored)
+        for record in records:
+            changed = False
+            for column in columns:
+                value = getattr(record, column)
+                if not value:
+                    continue
+                paths = []
+                for path in value.split(','):
+                    if path and not media_store.is_blob(path):
+                        blob_path = store_legacy_file(path, stored)
+                        if blob_path:
+                            path, changed = blob_path, True
+                    paths.append(path)
+                setattr(record, column, ','.join(paths))
+            rows_updated += changed
+        db.session.commit()
+        for path in stored.keys() - moved_before:
+            os.remove(media_store.absolute(path))
+            files_moved += 1
+    return rows_updated, files_moved
+
+def add_media_blobs():
+    """Create media_blobs (with its garbage collection index) and migrate existing media"""
+    with app.app_context():
+        try:
+            MediaBlob.__table__.create(db.engine, checkfirst=True)
+            print("✅ media_blobs table ready")
+
+            stored = {}  # Legacy path -> blob path, for files referenced more than once
+            for model, columns in MEDIA_COLUMNS:
+                rows_updated, files_moved = migrate_model(model, columns, stored)
+                print(f"✅ {model.__tablename__}: moved {files_moved} files into the media store, updated {rows_updated} rows")
+
+            # Sizes of media rows copied by add_work_order_media.py before media_blobs existed
+            db.session.execute(
+                update(WorkOrderMedia).where(WorkOrderMedia.size.is_(None))
+                .values(size=select(MediaBlob.size).where(MediaBlob.path == WorkOrderMedia.path).scalar_subquery())
+            )
+            db.session.commit()
+
+            blobs = db.session.execute(select(db.func.count(MediaBlob.id))).scalar()
+            print(f"✅ The media store holds {blobs} distinct files")
+
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Error migrating media: {str(e)}")
+            raise
+
+if __name__ == "__main__":
+    add_media_blobs()
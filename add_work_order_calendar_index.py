@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+"""
+Migration script to add the calendar window index to work_orders
+Run this script once on existing databases; new databases get the index from db.create_all()
+"""
+
+from app import app, db
+from sqlalchemy import text
+
+def add_work_order_calendar_index():
+    """Create the (company_id, scheduled_date) index used by /api/calendar-events"""
+    with app.app_context():
+        try:
+            db.session.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_work_orders_company_scheduled_date "
+                "ON work_orders (company_id, scheduled_date)"
+            ))
+            db.session.commit()
+            print("✅ Work order calendar index created")
+            
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Error creating index: {str(e)}")
+            raise
+
+if __name__ == "__main__":
+    add_work_order_calendar_index()
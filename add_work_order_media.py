@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Migration script to add the work_order_media table and move the
+comma-separated images/videos/voice_notes columns of work_orders and
+work_order_comments into it
+Run this script once on existing databases, before add_media_blobs.py; file
+sizes are copied from media_blobs when that table already exists, otherwise
+add_media_blobs.py fills them in.
+Owners are copied in batches; each batch clears the old columns in the same
+transaction, so the script can be interrupted and run again.  With
+--drop-columns the emptied columns are dropped afterwards.
+"""
+
+import sys
+
+from app import app, db
+from models import MediaBlob, WorkOrderMedia
+from work_order_media import guess_mime_type
+from sqlalchemy import insert, inspect, select, text
+
+BATCH_SIZE = 1000
+MEDIA_COLUMNS = (('images', 'image'), ('videos', 'video'), ('voice_notes', 'audio'))
+
+# table -> (owner_type, column holding the uploader)
+OWNER_TABLES = {
+    'work_orders': ('work_order', 'NULL'),
+    'work_order_comments': ('comment', 'user_id'),
+}
+
+def legacy_columns(table):
+    """The media columns ``table`` still has"""
+    result = db.session.execute(text("""
+        SELECT column_name
+        FROM information_schema.columns
+        WHERE table_name = :table AND column_name IN ('images', 'videos', 'voice_notes')
+    """), {'table': table})
+    return {row[0] for row in result}
+
+def backfill(table, owner_type, uploader_column):
+    """Copy the media of ``table`` into work_order_media; returns (owners, rows) copied"""
+    # media_blobs only exists once add_media_blobs.py has run
+    has_blobs = inspect(db.engine).has_table(MediaBlob.__tablename__)
+    owners = copied = 0
+    last_id = 0
+    while True:
+        records = db.session.execute(text(f"""
+            SELECT id, company_id, created_at, {uploader_column} AS uploaded_by_id, images, videos, voice_notes
+            FROM {table}
+            WHERE id > :last_id AND (images IS NOT NULL OR videos IS NOT NULL OR voice_notes IS NOT NULL)
+            ORDER BY id
+            LIMIT :batch_size
+        """).columns(created_at=db.DateTime), {'last_id': last_id, 'batch_size': BATCH_SIZE}).mappings().all()
+        if not records:
+            break
+        last_id = records[-1]['id']
+
+        rows = []
+        for record in records:
+            for column, kind in MEDIA_COLUMNS:
+                for path in (record[column] or '').split(','):
+                    path = path.strip()
+                    if path:
+                        rows.append({
+                            'company_id': record['company_id'], 'owner_type': owner_type, 'owner_id': record['id'],
+                            'kind': kind, 'path': path, 'mime_type': guess_mime_type(kind, path),
+                            'uploaded_by_id': record['uploaded_by_id'], 'created_at': record['created_at'],
+                        })
+        sizes = dict(db.session.execute(
+            select(MediaBlob.path, MediaBlob.size).where(MediaBlob.path.in_({row['path'] for row in rows}))
+        ).all()) if rows and has_blobs else {}
+        for row in rows:
+            row['size'] = sizes.get(row['path'])
+
+        if rows:
+            db.session.execute(insert(WorkOrderMedia), rows)
+        db.session.execute(text(f"""
+            UPDATE {table} SET images = NULL, videos = NULL, voice_notes = NULL
+            WHERE id IN ({', '.join(str(record['id']) for record in records)})
+        """))
+        db.session.commit()
+        owners += len(records)
+        copied += len(rows)
+    return owners, copied
+
+def add_work_order_media(drop_columns=False):
+    """Create work_order_media (with its indexes) and move the media columns into it"""
+    with app.app_context():
+        try:
+            WorkOrderMedia.__table__.create(db.engine, checkfirst=True)
+            print("✅ work_order_media table ready")
+
+            for table, (owner_type, uploader_column) in OWNER_TABLES.items():
+                columns = legacy_columns(table)
+                if columns != {'images', 'videos', 'voice_notes'}:
+                    print(f"✅ {table} has no media columns left to migrate")
+                    continue
+                owners, copied = backfill(table, owner_type, uploader_column)
+                print(f"✅ {table}: moved {copied} media files of {owners} rows into work_order_media")
+
+                if drop_columns:
+                    for column, _ in MEDIA_COLUMNS:
+                        db.session.execute(text(f"ALTER TABLE {table} DROP COLUMN IF EXISTS {column}"))
+                    db.session.commit()
+                    print(f"✅ Dropped the media columns of {table}")
+
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Error migrating work order media: {str(e)}")
+            raise
+
+if __name__ == "__main__":
+    add_work_order_media(drop_columns='--drop-columns' in sys.argv)
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+"""
+Migration script to add the technician visibility indexes to work_orders
+Run this script once on existing databases; new databases get the indexes from db.create_all()
+"""
+
+from app import app, db
+from sqlalchemy import text
+
+INDEXES = {
+    'ix_work_orders_company_technician_status': '(company_id, assigned_technician_id, status)',
+    'ix_work_orders_company_team_status': '(company_id, assigned_team_id, status)',
+}
+
+def add_work_order_visibility_indexes():
+    """Create the composite indexes used by the "my tasks" queries"""
+    with app.app_context():
+        try:
+            for name, columns in INDEXES.items():
+                db.session.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON work_orders {columns}"))
+                print(f"✅ Index {name} ready")
+            db.session.commit()
+            print("✅ Work order visibility indexes created")
+            
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Error creating indexes: {str(e)}")
+            raise
+
+if __name__ == "__main__":
+    add_work_order_visibility_indexes()
@@ -1,4 +1,4 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session, send_from_directory, Response, send_file, abort
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session, send_from_directory, Response, send_file, abort, stream_with_context
 import os
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
@@ -10,6 +10,7 @@ from wtforms.validators import DataRequired, Email, Length, EqualTo, Optional
 from flask_dance.contrib.google import make_google_blueprint, google
 from flask import abort
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import RequestEntityTooLarge
 import csv
 from io import StringIO
 import qrcode
@@ -22,7 +23,7 @@ import sqlalchemy
 from flask.cli import with_appcontext
 import click
 from extensions import db
-from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import joinedload, selectinload
 import openai
 import pycountry
 from typing import Sequence
@@ -41,6 +42,10 @@ app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY')
 
+# Instrumented connection pool (checkout wait is exported on /metrics)
+from metrics import metrics
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = metrics.engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+
 # Flask-Mail configuration (add this if not present)
 app.config['MAIL_SERVER'] = os.getenv('MAIL_SERVER')
 app.config['MAIL_PORT'] = int(os.getenv('MAIL_PORT', 465))
@@ -53,12 +58,74 @@ app.config['MAIL_DEFAULT_SENDER'] = os.getenv('MAIL_DEFAULT_SENDER')
 # Initialize database with app
 db.init_app(app)
 
+# Slow query log (SLOW_QUERY_THRESHOLD_MS, see slow_query_log.py)
+from slow_query_log import slow_query_log
+slow_query_log.init_app(app)
+
+# Prometheus metrics (see metrics.py)
+metrics.init_app(app)
+
+# Sampling request profiler (configured from /admin/perf/profiles)
+from profiler import request_profiler, PROFILE_QUERY_ARG
+request_profiler.init_app(app)
+
+# Role permissions compiled once per role version (see permissions.py)
+from permissions import role_permissions, invalidate_role
+
 # Initialize Flask-Mail after app is configured
 mail = Mail(app)
 
 # Import models after db initialization
 from models import User, Equipment, WorkOrder, MaintenanceSchedule, Inventory, WorkOrderPart, Location, Team, WorkOrderComment, SOP, SOPChecklistItem, WorkOrderChecklist, WhatsAppUser, EmergencyBroadcast, NotificationLog, WhatsAppTemplate, WhatsAppMessage, Company, Role, Department, Category, Vendor, VendorContact, VendorFile
 
+# User, role and teams loaded in one query per request (IDENTITY_CACHE_TTL, see identity.py)
+from identity import identity_loader, identity_for
+identity_loader.init_app(app)
+
+# Sequential per-company work order numbers (WORK_ORDER_NUMBER_BLOCK_SIZE, see work_order_numbers.py)
+from work_order_numbers import work_order_numbers
+work_order_numbers.init_app(app)
+
+# Maintenance schedule recurrence rules (see recurrence.py)
+from recurrence import REPEATS_ON, build_rule, apply_rule, rule_for, repeats_on
+
+# Windowed, cached calendar events (see calendar_feed.py)
+from calendar_feed import calendar_cache, calendar_events_json, parse_window, scope_for, CalendarWindowError
+calendar_cache.init_app(app)
+from ics_feed import feed_token, resolve_token, cached_feed, can_subscribe_to_team
+
+# Load-aware technician assignment (see dispatcher.py)
+from dispatcher import dispatcher
+dispatcher.init_app(app)
+
+# Technician work order visibility (see visibility.py)
+from visibility import assigned_work_orders_filter, assigned_schedules_filter, is_assigned
+
+# Daily technician routes (see route_planner.py)
+from route_planner import plan_day
+
+# Map viewport clustering (see map_clusters.py)
+from map_clusters import clusters as map_clusters, search as search_map_locations, parse_bbox, parse_zoom, MapQueryError
+
+# Resumable chunked media uploads (see resumable_uploads.py)
+from resumable_uploads import resumable_uploads, parse_metadata, UploadError, TUS_VERSION, TUS_EXTENSIONS
+resumable_uploads.init_app(app)
+
+# Streaming multipart upload ingestion (see upload_ingest.py)
+from upload_ingest import upload_ingest, IngestedFile
+upload_ingest.init_app(app)
+
+# Content-addressed media store (see media_store.py)
+from media_store import media_store
+media_store.init_app(app)
+
+# Work order and comment media rows (see work_order_media.py)
+from work_order_media import attach_media, media_by_owner, detach_work_orders, detach_orphans
+
+# Photo thumbnails and previews (see thumbnails.py)
+from thumbnails import thumbnails
+thumbnails.init_app(app)
+
 # Custom Jinja2 filters
 @app.template_filter('from_json')
 def from_json_filter(value):
@@ -70,6 +137,11 @@ def from_json_filter(value):
     except (json.JSONDecodeError, TypeError):
         return []
 
+@app.template_filter('thumbnail')
+def thumbnail_filter(path, size='thumb'):
+    """Path of the 'thumb' or 'medium' derivative of a photo, or the photo itself until it is rendered"""
+    return thumbnails.derivative(path.strip() if path else path, size)
+
 def create_default_roles_for_company(company_id):
     """Create default system roles for a new company"""
     import json
@@ -220,9 +292,9 @@ def create_default_categories_for_company(company_id):
         print(f"Error creating default categories: {e}")
 
 # Utility functions
-def generate_work_order_number():
-    """Generate unique work order number"""
-    return f"WO-{datetime.now().strftime('%Y%m%d')}-{str(uuid.uuid4())[:8].upper()}"
+def generate_work_order_number(company_id):
+    """Generate the next sequential work order number for a company"""
+    return work_order_numbers.generate(company_id)
 
 def get_dashboard_stats():
     """Get dashboard statistics (company-scoped)"""
@@ -243,8 +315,7 @@ def get_technician_dashboard_stats(user):
     """Get dashboard statistics for technicians (showing only assigned work orders)"""
     # Get work orders assigned to the technician or their teams
     assigned_work_orders = filter_by_company(WorkOrder.query).filter(
-        (WorkOrder.assigned_technician_id == user.id) |
-        (WorkOrder.assigned_team_id.in_([team.id for team in user.teams]))
+        assigned_work_orders_filter(user)
     )
     
     stats = {
@@ -446,7 +517,15 @@ def calculate_system_health():
 ALLOWED_IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 ALLOWED_VIDEO_EXTENSIONS = {'mp4', 'avi', 'mov', 'wmv', 'flv', 'webm', 'mkv'}
 ALLOWED_AUDIO_EXTENSIONS = {'mp3', 'wav', 'ogg', 'm4a', 'aac'}
-MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB max file size
+MAX_FILE_SIZE = app.config['UPLOAD_MAX_FILE_SIZE']  # 50MB unless configured
+# Offline sync media type -> media kind
+OFFLINE_MEDIA_KINDS = {'image': 'image', 'video': 'video', 'voice': 'audio', 'audio': 'audio'}
+# media_type -> (work order / comment column, allowed extensions)
+MEDIA_UPLOAD_TYPES = {
+    'image': ('images', ALLOWED_IMAGE_EXTENSIONS),
+    'video': ('videos', ALLOWED_VIDEO_EXTENSIONS),
+    'audio': ('voice_notes', ALLOWED_AUDIO_EXTENSIONS),
+}
 
 def allowed_file(filename, allowed_extensions):
     """Check if file extension is allowed"""
@@ -454,7 +533,10 @@ def allowed_file(filename, allowed_extensions):
            filename.rsplit('.', 1)[1].lower() in allowed_extensions
 
 def save_uploaded_file(file, upload_dir, file_type):
-    """Save uploaded file with proper validation and naming"""
+    """Validate an uploaded file and add it to the media store; returns the path to save, or None.
+
+    Identical content is stored once (see media_store.py), so ``upload_dir`` no longer decides where it goes.
+    """
     if file and file.filename:
         # Validate file extension
         if file_type == 'image' and not allowed_file(file.filename, ALLOWED_IMAGE_EXTENSIONS):
@@ -464,27 +546,22 @@ def save_uploaded_file(file, upload_dir, file_type):
         elif file_type == 'audio' and not allowed_file(file.filename, ALLOWED_AUDIO_EXTENSIONS):
             return None
         
+        # Parsed uploads were streamed to a staging file, size-checked and hashed on the way in
+        ingested = file.stream if isinstance(file.stream, IngestedFile) else None
+        
         # Check file size
-        file.seek(0, 2)  # Seek to end
-        file_size = file.tell()
-        file.seek(0)  # Reset to beginning
+        if ingested is not None:
+            file_size = ingested.size
+        else:
+            file.seek(0, 2)  # Seek to end
+            file_size = file.tell()
+            file.seek(0)  # Reset to beginning
         
         if file_size > MAX_FILE_SIZE:
             return None
         
-        # Create upload directory if it doesn't exist
-        os.makedirs(upload_dir, exist_ok=True)
-        
-        # Generate unique filename
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
-        filename = f"{timestamp}_{secure_filename(file.filename)}"
-        file_path = os.path.join(upload_dir, filename)
-        
-        # Save file
-        file.save(file_path)
-        
-        # Return relative path for database storage
-        return f"uploads/{os.path.basename(upload_dir)}/{filename}"
+        # Store the content once; a staged upload is moved into place, not copied
+        return media_store.store_upload(file)
     
     return None
 
@@ -503,8 +580,7 @@ def index():
         recent_work_orders = filter_by_company(WorkOrder.query).order_by(WorkOrder.created_at.desc()).limit(5).all()
     elif user_has_permission(current_user, 'workorder_view_assigned_only'):
         recent_work_orders = filter_by_company(WorkOrder.query).filter(
-            (WorkOrder.assigned_technician_id == current_user.id) |
-            (WorkOrder.assigned_team_id.in_([team.id for team in current_user.teams]))
+            assigned_work_orders_filter()
         ).order_by(WorkOrder.created_at.desc()).limit(5).all()
     else:
         recent_work_orders = []
@@ -523,6 +599,14 @@ def health():
     """Health check endpoint"""
     return jsonify({'status': 'healthy', 'message': 'CMMS is running!'})
 
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus metrics endpoint"""
+    token = app.config.get('METRICS_AUTH_TOKEN')
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        abort(401)
+    return Response(metrics.render_latest(), content_type=metrics.content_type)
+
 def email_admin_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -768,6 +852,8 @@ def equipment_delete(id):
     try:
         work_orders = filter_by_company(WorkOrder.query).filter_by(equipment_id=id).all()
         maintenance_schedules = filter_by_company(MaintenanceSchedule.query).filter_by(equipment_id=id).all()
+        # Media rows have no foreign key to their work order; release them with it
+        legacy_files = detach_work_orders([work_order.id for work_order in work_orders])
         for work_order in work_orders:
             work_order_parts = WorkOrderPart.query.filter_by(work_order_id=work_order.id).all()
             for part in work_order_parts:
@@ -778,6 +864,7 @@ def equipment_delete(id):
             db.session.delete(schedule)
         db.session.delete(equipment)
         db.session.commit()
+        delete_files(legacy_files)
         flash(f'Equipment "{equipment.name}" deleted successfully!', 'success')
     except Exception as e:
         db.session.rollback()
@@ -905,10 +992,7 @@ def work_orders_list():
     if user_has_permission(current_user, 'workorder_view_all'):
         pass  # No extra filter
     elif user_has_permission(current_user, 'workorder_view_assigned_only'):
-        query = query.filter(
-            (WorkOrder.assigned_technician_id == current_user.id) |
-            (WorkOrder.assigned_team_id.in_([team.id for team in current_user.teams]))
-        )
+        query = query.filter(assigned_work_orders_filter())
     else:
         query = query.filter(sqlalchemy.sql.false())  # No access
     work_orders = query.order_by(WorkOrder.created_at.desc()).all()
@@ -963,15 +1047,35 @@ def work_order_new():
                 return redirect(url_for('my_work_order_requests'))
             else:
                 # Admin/manager: create WorkOrder directly
+                location_id = data.get('location_id') if data.get('location_id') else None
+                assigned_team_id = data.get('assigned_team_id') if data.get('assigned_team_id') else None
+                assigned_technician_id = data.get('assigned_technician_id') if data.get('assigned_technician_id') else None
+                if assigned_technician_id == 'auto':
+                    # Least loaded technician (of the team), nearest to the job on ties (see dispatcher.py)
+                    if location_id is None:
+                        equipment_item = Equipment.query.filter_by(id=data['equipment_id'], company_id=current_user.company_id).first()
+                        location_id = equipment_item.location_id if equipment_item else None
+                    location = Location.query.filter_by(id=location_id, company_id=current_user.company_id).first() if location_id else None
+                    assigned_technician_id = dispatcher.choose(
+                        current_user.company_id, location=location,
+                        team_id=int(assigned_team_id) if assigned_team_id else None)
+                estimated_duration = data.get('estimated_duration')
+                if estimated_duration == '':
+                    estimated_duration = None
                 work_order = WorkOrder(
                     company_id=current_user.company_id,
-                    work_order_number=generate_work_order_number(),
+                    work_order_number=generate_work_order_number(current_user.company_id),
                     title=data['title'],
                     description=data['description'],
                     priority=data.get('priority', 'medium'),
                     type=data.get('type', 'corrective'),
                     equipment_id=data['equipment_id'],
                     location_id=data.get('location_id') if data.get('location_id') else None,
+                    assigned_technician_id=assigned_technician_id,
+                    assigned_team_id=assigned_team_id,
+                    estimated_duration=estimated_duration,
+                    scheduled_date=datetime.strptime(data['scheduled_date'], '%Y-%m-%dT%H:%M') if data.get('scheduled_date') else None,
+                    due_date=datetime.strptime(data['due_date'], '%Y-%m-%dT%H:%M') if data.get('due_date') else None,
                     created_by_id=current_user.id,
                     status='open'
                 )
@@ -993,7 +1097,7 @@ def work_order_new():
                                 if file_path:
                                     image_paths.append(file_path)
                         if image_paths:
-                            work_order.images = ','.join(image_paths)
+                            attach_media(work_order, 'image', image_paths, current_user.id)
                             uploaded_files['images'] = image_paths
                     
                     # Process videos
@@ -1006,7 +1110,7 @@ def work_order_new():
                                 if file_path:
                                     video_paths.append(file_path)
                         if video_paths:
-                            work_order.videos = ','.join(video_paths)
+                            attach_media(work_order, 'video', video_paths, current_user.id)
                             uploaded_files['videos'] = video_paths
                     
                     # Process voice notes
@@ -1019,7 +1123,7 @@ def work_order_new():
                                 if file_path:
                                     voice_paths.append(file_path)
                         if voice_paths:
-                            work_order.voice_notes = ','.join(voice_paths)
+                            attach_media(work_order, 'audio', voice_paths, current_user.id)
                             uploaded_files['voice_notes'] = voice_paths
                     
                     db.session.commit()
@@ -1062,7 +1166,10 @@ def work_order_new():
 @login_required
 def work_order_detail(id):
     """Work order detail page"""
-    work_order = WorkOrder.query.get_or_404(id)
+    work_order = WorkOrder.query.options(
+        selectinload(WorkOrder.media),
+        selectinload(WorkOrder.comments).selectinload(WorkOrderComment.media)
+    ).get_or_404(id)
     enforce_company_access(work_order)
     if not user_can_access_work_order(work_order, current_user):
         abort(403)
@@ -1148,16 +1255,10 @@ def work_order_edit(id):
             work_order.estimated_duration = estimated_duration
             work_order.scheduled_date = datetime.strptime(data['scheduled_date'], '%Y-%m-%dT%H:%M') if data.get('scheduled_date') else None
             work_order.due_date = datetime.strptime(data['due_date'], '%Y-%m-%dT%H:%M') if data.get('due_date') else None
-            # Update media files (append to existing)
-            if images:
-                existing_images = work_order.images.split(',') if work_order.images else []
-                work_order.images = ','.join(existing_images + images)
-            if videos:
-                existing_videos = work_order.videos.split(',') if work_order.videos else []
-                work_order.videos = ','.join(existing_videos + videos)
-            if voice_notes:
-                existing_voice_notes = work_order.voice_notes.split(',') if work_order.voice_notes else []
-                work_order.voice_notes = ','.join(existing_voice_notes + voice_notes)
+            # Add media files (existing media is kept)
+            attach_media(work_order, 'image', images, current_user.id)
+            attach_media(work_order, 'video', videos, current_user.id)
+            attach_media(work_order, 'audio', voice_notes, current_user.id)
             db.session.commit()
             flash('Work order updated successfully!', 'success')
             return redirect(url_for('work_order_detail', id=work_order.id))
@@ -1237,12 +1338,13 @@ def work_order_add_comment(id):
         comment = WorkOrderComment(
             work_order_id=id,
             user_id=current_user.id,
-            comment=comment_text,
-            images=','.join(images) if images else None,
-            videos=','.join(videos) if videos else None,
-            voice_notes=','.join(voice_notes) if voice_notes else None
+            company_id=current_user.company_id,
+            comment=comment_text
         )
         db.session.add(comment)
+        attach_media(comment, 'image', images, current_user.id)
+        attach_media(comment, 'video', videos, current_user.id)
+        attach_media(comment, 'audio', voice_notes, current_user.id)
         db.session.commit()
         flash('Comment added successfully!', 'success')
     
@@ -1401,7 +1503,7 @@ def api_equipment():
 @app.route('/api/work-orders')
 def api_work_orders():
     """API endpoint for work orders (company-scoped)"""
-    work_orders = filter_by_company(WorkOrder.query).all()
+    work_orders = filter_by_company(WorkOrder.query).options(selectinload(WorkOrder.media)).all()
     return jsonify([wo.to_dict() for wo in work_orders])
 
 @app.route('/api/inventory')
@@ -1499,54 +1601,17 @@ def api_locations():
 @app.route('/api/calendar-events')
 @login_required
 def api_calendar_events():
-    events = []
-    
-    # Filter work orders based on user role
-    if current_user.role == 'technician':
-        # For technicians, show only assigned work orders
-        work_orders = filter_by_company(WorkOrder.query).filter(
-            WorkOrder.scheduled_date != None,
-            (WorkOrder.assigned_technician_id == current_user.id) |
-            (WorkOrder.assigned_team_id.in_([team.id for team in current_user.teams]))
-        ).all()
-    else:
-        # For others, show all work orders
-        work_orders = filter_by_company(WorkOrder.query).filter(WorkOrder.scheduled_date != None).all()
-    
-    # Filter maintenance schedules based on user role
-    if current_user.role == 'technician':
-        # For technicians, show only maintenance assigned to them or their teams
-        maints = MaintenanceSchedule.query.filter(
-            MaintenanceSchedule.next_due != None,
-            MaintenanceSchedule.is_active == True,
-            (MaintenanceSchedule.assigned_team_id.in_([team.id for team in current_user.teams]))
-        ).all()
-    else:
-        # For others, show all maintenance schedules
-        maints = MaintenanceSchedule.query.filter(
-            MaintenanceSchedule.next_due != None,
-            MaintenanceSchedule.is_active == True
-        ).all()
-    
-    # Add work order events
-    for wo in work_orders:
-        events.append({
-            'id': f'wo-{wo.id}',
-            'title': f'WO: {wo.title}',
-            'start': wo.scheduled_date.isoformat() if wo.scheduled_date else None,
-            'url': url_for('work_order_detail', id=wo.id)
-        })
-    
-    # Add maintenance events
-    for ms in maints:
-        events.append({
-            'id': f'ms-{ms.id}',
-            'title': f'Maintenance: {ms.equipment.name if ms.equipment else "Unknown"}',
-            'start': ms.next_due.isoformat() if ms.next_due else None,
-            'url': url_for('equipment_detail', id=ms.equipment_id)
-        })
+    """Calendar events in the start/end window FullCalendar asks for (current month by default)"""
+    try:
+        window_start, window_end = parse_window(request.args.get('start'), request.args.get('end'))
+    except CalendarWindowError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     
-    return jsonify(events)
+    payload, version = calendar_events_json(scope_for(current_user), window_start, window_end)
+    response = Response(payload, mimetype='application/json')
+    response.set_etag(version)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
 
 # API Routes for Mobile Media Uploads
 @app.route('/api/work-orders/<int:work_order_id>/upload-media', methods=['POST'])
@@ -1569,9 +1634,7 @@ def api_upload_media(work_order_id):
                     if file_path:
                         image_paths.append(file_path)
             if image_paths:
-                current_images = work_order.images or ''
-                updated_images = ','.join([current_images, *image_paths]) if current_images else ','.join(image_paths)
-                work_order.images = updated_images
+                attach_media(work_order, 'image', image_paths, current_user.id)
                 uploaded_files['images'] = image_paths
         
         # Process videos
@@ -1584,9 +1647,7 @@ def api_upload_media(work_order_id):
                     if file_path:
                         video_paths.append(file_path)
             if video_paths:
-                current_videos = work_order.videos or ''
-                updated_videos = ','.join([current_videos, *video_paths]) if current_videos else ','.join(video_paths)
-                work_order.videos = updated_videos
+                attach_media(work_order, 'video', video_paths, current_user.id)
                 uploaded_files['videos'] = video_paths
         
         # Process voice notes
@@ -1599,9 +1660,7 @@ def api_upload_media(work_order_id):
                     if file_path:
                         voice_paths.append(file_path)
             if voice_paths:
-                current_voice = work_order.voice_notes or ''
-                updated_voice = ','.join([current_voice, *voice_paths]) if current_voice else ','.join(voice_paths)
-                work_order.voice_notes = updated_voice
+                attach_media(work_order, 'audio', voice_paths, current_user.id)
                 uploaded_files['voice_notes'] = voice_paths
         
         # Commit changes if any files were uploaded
@@ -1631,12 +1690,121 @@ def api_upload_media(work_order_id):
                 'message': 'No valid files were uploaded'
             }), 400
         
+    except RequestEntityTooLarge:
+        raise
     except Exception as e:
         return jsonify({
             'success': False,
             'message': f'Upload failed: {str(e)}'
         }), 500
 
+# Resumable uploads (tus 1.0 subset): POST creates, HEAD reports the offset, PATCH appends, DELETE cancels,
+# POST .../finalize attaches the complete file to the work order or comment named in the metadata
+def tus_response(status=204, body=None, **headers):
+    response = Response(body, status=status, mimetype='application/json' if body else None)
+    response.headers['Tus-Resumable'] = TUS_VERSION
+    response.headers['Cache-Control'] = 'no-store'
+    for name, value in headers.items():
+        response.headers[name.replace('_', '-')] = str(value)
+    return response
+
+def tus_error(error):
+    return tus_response(error.status, json.dumps({'success': False, 'message': str(error)}))
+
+def resumable_upload_target(metadata):
+    """(work order, comment or None) an upload's metadata points at, within the current user's company"""
+    work_order_id = metadata.get('work_order_id') or ''
+    work_order = WorkOrder.query.filter_by(id=int(work_order_id), company_id=current_user.company_id).first() \
+        if work_order_id.isdigit() else None
+    if work_order is None:
+        raise UploadError('Work order not found', 404)
+    comment = None
+    comment_id = metadata.get('comment_id') or ''
+    if comment_id:
+        comment = WorkOrderComment.query.filter_by(id=int(comment_id), work_order_id=work_order.id).first() \
+            if comment_id.isdigit() else None
+        if comment is None:
+            raise UploadError('Comment not found', 404)
+    return work_order, comment
+
+def finalize_resumable_upload(upload, work_order):
+    """Move a complete upload into the media of ``work_order`` (or its comment); returns (column, path)"""
+    target_work_order, comment = resumable_upload_target(upload.metadata)
+    if target_work_order.id != work_order.id:
+        raise UploadError('Upload belongs to another work order', 409)
+    field, _ = MEDIA_UPLOAD_TYPES[upload.metadata['media_type']]
+    file_path = resumable_uploads.finalize(upload, media_store.store_file)
+    attach_media(comment or work_order, upload.metadata['media_type'], [file_path], current_user.id)
+    return field, file_path
+
+@app.route('/api/uploads', methods=['POST', 'OPTIONS'])
+@login_required
+def api_resumable_upload_create():
+    """Create a resumable upload (Upload-Length, Upload-Metadata: filename, media_type, work_order_id[, comment_id])"""
+    if request.method == 'OPTIONS':
+        # tus discovery
+        return tus_response(204, Tus_Version=TUS_VERSION, Tus_Extension=TUS_EXTENSIONS,
+                            Tus_Max_Size=resumable_uploads.max_size)
+    try:
+        length = request.headers.get('Upload-Length', '')
+        if not length.isdigit():
+            raise UploadError('Upload-Length header is required')
+        metadata = parse_metadata(request.headers.get('Upload-Metadata'))
+        media_type = metadata.get('media_type')
+        if media_type not in MEDIA_UPLOAD_TYPES:
+            raise UploadError('media_type must be image, video or audio')
+        if not allowed_file(metadata.get('filename', ''), MEDIA_UPLOAD_TYPES[media_type][1]):
+            raise UploadError(f'File type not allowed for {media_type}', 415)
+        resumable_upload_target(metadata)
+        upload = resumable_uploads.create(current_user, int(length), metadata)
+    except UploadError as e:
+        return tus_error(e)
+    return tus_response(201, Location=url_for('api_resumable_upload', upload_id=upload.id),
+                        Upload_Offset=0, Upload_Length=upload.length)
+
+@app.route('/api/uploads/<upload_id>', methods=['HEAD', 'PATCH', 'DELETE'])
+@login_required
+def api_resumable_upload(upload_id):
+    """Current offset (HEAD), append a chunk at Upload-Offset (PATCH) or cancel (DELETE)"""
+    try:
+        upload = resumable_uploads.get(upload_id, current_user)
+        if request.method == 'HEAD':
+            return tus_response(200, Upload_Offset=upload.offset, Upload_Length=upload.length)
+        if request.method == 'DELETE':
+            resumable_uploads.delete(upload)
+            return tus_response(204)
+        if request.mimetype != 'application/offset+octet-stream':
+            raise UploadError('Content-Type must be application/offset+octet-stream', 415)
+        offset = request.headers.get('Upload-Offset', '')
+        if not offset.isdigit():
+            raise UploadError('Upload-Offset header is required')
+        new_offset = resumable_uploads.append(upload, int(offset), request.stream, request.content_length)
+    except UploadError as e:
+        return tus_error(e)
+    return tus_response(204, Upload_Offset=new_offset)
+
+@app.route('/api/uploads/<upload_id>/finalize', methods=['POST'])
+@login_required
+def api_resumable_upload_finalize(upload_id):
+    """Attach a complete upload to its work order or comment"""
+    try:
+        upload = resumable_uploads.get(upload_id, current_user)
+        work_order, _ = resumable_upload_target(upload.metadata)
+        field, file_path = finalize_resumable_upload(upload, work_order)
+        db.session.commit()
+    except UploadError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), e.status
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error finalizing upload: {e}")
+        return jsonify({'success': False, 'message': f'Upload failed: {str(e)}'}), 500
+    return jsonify({
+        'success': True,
+        'message': '1 file(s) uploaded successfully',
+        'uploaded_files': {field: [file_path]}
+    })
+
 @app.route('/api/work-orders/<int:work_order_id>/comments/<int:comment_id>/upload-media', methods=['POST'])
 @login_required
 def api_upload_comment_media(work_order_id, comment_id):
@@ -1661,9 +1829,7 @@ def api_upload_comment_media(work_order_id, comment_id):
                     if file_path:
                         image_paths.append(file_path)
             if image_paths:
-                current_images = comment.images or ''
-                updated_images = ','.join([current_images, *image_paths]) if current_images else ','.join(image_paths)
-                comment.images = updated_images
+                attach_media(comment, 'image', image_paths, current_user.id)
                 uploaded_files['images'] = image_paths
         
         # Process videos
@@ -1676,9 +1842,7 @@ def api_upload_comment_media(work_order_id, comment_id):
                     if file_path:
                         video_paths.append(file_path)
             if video_paths:
-                current_videos = comment.videos or ''
-                updated_videos = ','.join([current_videos, *video_paths]) if current_videos else ','.join(video_paths)
-                comment.videos = updated_videos
+                attach_media(comment, 'video', video_paths, current_user.id)
                 uploaded_files['videos'] = video_paths
         
         # Process voice notes
@@ -1691,9 +1855,7 @@ def api_upload_comment_media(work_order_id, comment_id):
                     if file_path:
                         voice_paths.append(file_path)
             if voice_paths:
-                current_voice = comment.voice_notes or ''
-                updated_voice = ','.join([current_voice, *voice_paths]) if current_voice else ','.join(voice_paths)
-                comment.voice_notes = updated_voice
+                attach_media(comment, 'audio', voice_paths, current_user.id)
                 uploaded_files['voice_notes'] = voice_paths
         
         # Commit changes if any files were uploaded
@@ -1723,6 +1885,8 @@ def api_upload_comment_media(work_order_id, comment_id):
                 'message': 'No valid files were uploaded'
             }), 400
         
+    except RequestEntityTooLarge:
+        raise
     except Exception as e:
         return jsonify({
             'success': False,
@@ -1758,25 +1922,17 @@ def api_sync_offline_data(work_order_id):
                 media_type = media_item.get('type')  # image, video, voice
                 file_data = media_item.get('file_data')  # Base64 encoded file
                 
-                if media_type and file_data:
+                if media_type in OFFLINE_MEDIA_KINDS and file_data:
                     # Decode and save file
                     import base64
                     file_bytes = base64.b64decode(file_data.split(',')[1])
-                    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
-                    filename = f"{timestamp}_offline_{media_type}.{media_item.get('extension', 'jpg')}"
-                    
-                    upload_dir = os.path.join(app.static_folder or '', 'uploads', 'work_orders')
-                    os.makedirs(upload_dir, exist_ok=True)
-                    file_path = os.path.join(upload_dir, filename)
+                    filename = f"offline_{media_type}.{media_item.get('extension', 'jpg')}"
                     
-                    with open(file_path, 'wb') as f:
-                        f.write(file_bytes)
+                    # A replayed sync stores the same bytes again: the store keeps one copy
+                    media_path = media_store.store_bytes(file_bytes, filename)
                     
-                    # Update work order media
-                    media_path = f"uploads/work_orders/{filename}"
-                    current_media = getattr(work_order, f'{media_type}s', '') or ''
-                    updated_media = ','.join([current_media, media_path]) if current_media else media_path
-                    setattr(work_order, f'{media_type}s', updated_media)
+                    # Add to the work order media
+                    attach_media(work_order, OFFLINE_MEDIA_KINDS[media_type], [media_path], current_user.id)
         
         db.session.commit()
         
@@ -1799,7 +1955,7 @@ login_manager.login_view = "login"
 # User loader for Flask-Login
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.options(joinedload(User.role_info)).get(int(user_id))
+    return identity_loader.load_user(int(user_id))
 
 # Flask-WTF Forms
 class LoginForm(FlaskForm):
@@ -1868,6 +2024,9 @@ class MaintenanceScheduleForm(FlaskForm):
     description = TextAreaField('Description', validators=[DataRequired()])
     estimated_duration = IntegerField('Estimated Duration (minutes)', validators=[Optional()])
     next_due = DateTimeField('Next Due', format='%Y-%m-%dT%H:%M', validators=[DataRequired()])
+    repeats_on = SelectField('Repeats On (monthly/yearly)', choices=list(REPEATS_ON), default='day')
+    business_days = BooleanField('Business days only', default=False)
+    anchor = SelectField('After Completion', choices=[('fixed', 'Stay on the calendar'), ('floating', 'Count the interval from completion')], default='fixed')
     sop_id = SelectField('Standard Operating Procedure (SOP)', coerce=int, validators=[Optional()])
     assigned_team_id = SelectField('Assign to Team', coerce=int, validators=[Optional()])
     is_active = BooleanField('Is Active', default=True)
@@ -2267,10 +2426,52 @@ def location_delete(id):
 @app.route('/maps')
 @login_required
 def maps():
-    """Interactive maps page showing all locations (company-scoped)"""
-    locations = filter_by_company(Location.query).filter_by(is_active=True).all()
-    locations_data = [loc.to_dict() for loc in locations]
-    return render_template('maps.html', locations=locations_data)
+    """Interactive maps page (company-scoped); markers are loaded per viewport from /api/map/clusters"""
+    company_id = current_user.company_id
+    active = db.and_(Location.company_id == company_id, Location.is_active == True)
+    mapped = db.and_(Location.latitude != None, Location.longitude != None)
+    stats = db.session.execute(
+        db.select(db.func.count(Location.id), db.func.count(db.case((mapped, Location.id))),
+                  db.func.min(Location.latitude), db.func.min(Location.longitude),
+                  db.func.max(Location.latitude), db.func.max(Location.longitude)).where(active)
+    ).one()
+    with_equipment = db.session.scalar(
+        db.select(db.func.count(db.func.distinct(Equipment.location_id)))
+        .join(Location, Location.id == Equipment.location_id).where(active))
+    with_staff = db.session.scalar(
+        db.select(db.func.count(db.func.distinct(User.location_id)))
+        .join(Location, Location.id == User.location_id).where(active))
+    extent = [[stats[2], stats[3]], [stats[4], stats[5]]] if stats[1] else None
+    return render_template('maps.html', total_locations=stats[0], mapped_locations=stats[1],
+                           locations_with_equipment=with_equipment, locations_with_staff=with_staff,
+                           extent=extent)
+
+@app.route('/api/map/clusters')
+@login_required
+def api_map_clusters():
+    """Clustered location markers for a map viewport (?bbox=west,south,east,north&zoom=)"""
+    try:
+        boxes = parse_bbox(request.args.get('bbox'))
+        zoom = parse_zoom(request.args.get('zoom'))
+    except MapQueryError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    return jsonify({'success': True, 'zoom': zoom, **map_clusters(current_user.company_id, boxes, zoom)})
+
+@app.route('/api/map/locations')
+@login_required
+def api_map_locations():
+    """Locations whose name contains ?q=, wherever they are on the map"""
+    try:
+        locations = search_map_locations(current_user.company_id, request.args.get('q'))
+    except MapQueryError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    return jsonify({'success': True, 'locations': locations})
+
+def schedule_rule_from_form(form):
+    """Recurrence rule for the maintenance schedule form (the first due date fixes the day it repeats on)"""
+    return build_rule(form.frequency.data, form.frequency_value.data, form.next_due.data,
+                      repeats_on=form.repeats_on.data, business_days=form.business_days.data,
+                      anchor=form.anchor.data)
 
 @app.route('/equipment/<int:id>/maintenance-schedule/new', methods=['GET', 'POST'])
 @login_required
@@ -2284,16 +2485,15 @@ def maintenance_schedule_new(id):
     
     if form.validate_on_submit():
         schedule = MaintenanceSchedule(
+            company_id=current_user.company_id,
             equipment_id=equipment.id,
-            frequency=form.frequency.data,
-            frequency_value=form.frequency_value.data,
             description=form.description.data,
             estimated_duration=form.estimated_duration.data,
-            next_due=form.next_due.data,
             sop_id=form.sop_id.data if form.sop_id.data != 0 else None,
             assigned_team_id=form.assigned_team_id.data if form.assigned_team_id.data != 0 else None,
             is_active=form.is_active.data
         )
+        apply_rule(schedule, schedule_rule_from_form(form), form.next_due.data)
         db.session.add(schedule)
         db.session.commit()
         flash('Maintenance schedule created!', 'success')
@@ -2306,17 +2506,20 @@ def maintenance_schedule_edit(id, schedule_id):
     equipment = filter_by_company(Equipment.query).filter_by(id=id).first_or_404()
     schedule = filter_by_company(MaintenanceSchedule.query).filter_by(id=schedule_id).first_or_404()
     form = MaintenanceScheduleForm(obj=schedule)
+    rule = rule_for(schedule)
+    if request.method == 'GET' and rule is not None:
+        form.repeats_on.data = repeats_on(rule)
+        form.business_days.data = rule.business_days
+        form.anchor.data = rule.anchor
     
     # Populate form choices with company filtering
     form.sop_id.choices = [(0, '-- Select SOP --')] + [(s.id, s.name) for s in filter_by_company(SOP.query).filter_by(is_active=True).order_by(SOP.name).all()]
     form.assigned_team_id.choices = [(0, '-- Select Team --')] + [(t.id, t.name) for t in filter_by_company(Team.query).order_by(Team.name).all()]
     
     if form.validate_on_submit():
-        schedule.frequency = form.frequency.data
-        schedule.frequency_value = form.frequency_value.data
         schedule.description = form.description.data
         schedule.estimated_duration = form.estimated_duration.data
-        schedule.next_due = form.next_due.data
+        apply_rule(schedule, schedule_rule_from_form(form), form.next_due.data)
         schedule.sop_id = form.sop_id.data if form.sop_id.data != 0 else None
         schedule.assigned_team_id = form.assigned_team_id.data if form.assigned_team_id.data != 0 else None
         schedule.is_active = form.is_active.data
@@ -2648,74 +2851,43 @@ def sop_delete_checklist_item(id, item_id):
 @login_required
 def maintenance_calendar():
     """Calendar view of upcoming maintenance tasks and work orders"""
-    # Get date range for calendar (current month by default)
+    # Month to open the calendar on; events are loaded per visible window from /api/calendar-events
     year = request.args.get('year', datetime.now().year, type=int)
     month = request.args.get('month', datetime.now().month, type=int)
+    if not 1 <= month <= 12:
+        month = datetime.now().month
     
-    # Filter maintenance schedules based on user role
-    if current_user.role == 'technician':
-        # For technicians, show only maintenance assigned to them or their teams
-        team_ids = [team.id for team in current_user.teams] if current_user.teams else []
-        schedules = MaintenanceSchedule.query.filter(
-            MaintenanceSchedule.is_active == True,
-            (MaintenanceSchedule.assigned_team_id.in_(team_ids) if team_ids else False)
-        ).all()
-    else:
-        # For others, show all active maintenance schedules
-        schedules = MaintenanceSchedule.query.filter_by(is_active=True).all()
-    
-    # Filter work orders based on user role
-    if current_user.role == 'technician':
-        # For technicians, show only assigned work orders
-        team_ids = [team.id for team in current_user.teams] if current_user.teams else []
-        work_orders = filter_by_company(WorkOrder.query).filter(
-            WorkOrder.scheduled_date != None,
-            (WorkOrder.assigned_technician_id == current_user.id) |
-            (WorkOrder.assigned_team_id.in_(team_ids) if team_ids else False)
-        ).all()
+    return render_template('maintenance_calendar.html', year=year, month=month)
+
+@app.route('/calendar/feeds')
+@login_required
+def calendar_feeds():
+    """Subscription (ICS) links for the user's own calendar and their teams"""
+    if current_user.role in ['admin', 'manager']:
+        teams = filter_by_company(Team.query).filter(Team.is_active != False).order_by(Team.name).all()
     else:
-        # For others, show all work orders with scheduled dates
-        work_orders = filter_by_company(WorkOrder.query).filter(WorkOrder.scheduled_date != None).all()
-    
-    # Generate calendar events
-    calendar_events = []
-    
-    # Add maintenance schedule events
-    for schedule in schedules:
-        if schedule.next_due:
-            calendar_events.append({
-                'id': f'ms-{schedule.id}',
-                'title': f"{schedule.equipment.name if schedule.equipment else 'Unknown'} - {schedule.description}",
-                'start': schedule.next_due.isoformat(),
-                'end': (schedule.next_due + timedelta(minutes=schedule.estimated_duration or 60)).isoformat(),
-                'equipment_name': schedule.equipment.name if schedule.equipment else 'Unknown',
-                'description': schedule.description,
-                'assigned_team': schedule.assigned_team.name if schedule.assigned_team else None,
-                'sop_name': schedule.sop.name if schedule.sop else None,
-                'url': url_for('equipment_detail', id=schedule.equipment_id),
-                'type': 'maintenance'
-            })
-    
-    # Add work order events
-    for wo in work_orders:
-        if wo.scheduled_date:
-            calendar_events.append({
-                'id': f'wo-{wo.id}',
-                'title': f"WO: {wo.title}",
-                'start': wo.scheduled_date.isoformat(),
-                'end': (wo.scheduled_date + timedelta(hours=2)).isoformat() if wo.scheduled_date else None,
-                'equipment_name': wo.equipment.name if wo.equipment else 'N/A',
-                'description': wo.description,
-                'assigned_team': wo.assigned_team.name if wo.assigned_team else None,
-                'sop_name': None,
-                'url': url_for('work_order_detail', id=wo.id),
-                'type': 'work_order'
-            })
+        teams = sorted(current_user.teams, key=lambda team: team.name)
+    personal_url = url_for('calendar_ics_feed', token=feed_token(current_user), _external=True)
+    team_feeds = [(team, url_for('calendar_ics_feed', token=feed_token(current_user, team.id), _external=True))
+                  for team in teams if can_subscribe_to_team(current_user, team)]
+    return render_template('calendar_feeds.html', personal_url=personal_url, team_feeds=team_feeds)
+
+@app.route('/calendar/feed/<token>.ics')
+def calendar_ics_feed(token):
+    """Tokenized iCalendar feed polled by calendar apps (no login: the token is the credential)"""
+    resolved = resolve_token(token)
+    if resolved is None:
+        abort(404)
+    scope, name = resolved
     
-    return render_template('maintenance_calendar.html', 
-                         calendar_events=calendar_events,
-                         year=year, 
-                         month=month)
+    etag, last_modified, body, render = cached_feed(scope, name)
+    response = Response(body if body is not None else stream_with_context(render()),
+                        mimetype='text/calendar')
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.headers['Cache-Control'] = 'private, max-age=0, must-revalidate'
+    response.headers['Content-Disposition'] = 'inline; filename="calendar.ics"'
+    return response.make_conditional(request)
 
 @app.route('/maintenance-schedule/<int:schedule_id>/create-work-order', methods=['POST'])
 @login_required
@@ -2724,10 +2896,11 @@ def create_work_order_from_schedule(schedule_id):
     schedule = MaintenanceSchedule.query.get_or_404(schedule_id)
     
     # Generate work order number
-    work_order_number = generate_work_order_number()
+    work_order_number = generate_work_order_number(schedule.company_id)
     
     # Create work order
     work_order = WorkOrder(
+        company_id=schedule.company_id,
         work_order_number=work_order_number,
         title=f"PM: {schedule.description}",
         description=f"Preventive maintenance task: {schedule.description}",
@@ -2751,24 +2924,18 @@ def create_work_order_from_schedule(schedule_id):
         for checklist_item in schedule.sop.checklist_items:
             work_order_checklist = WorkOrderChecklist(
                 work_order_id=work_order.id,
-                sop_checklist_item_id=checklist_item.id
+                sop_checklist_item_id=checklist_item.id,
+                company_id=schedule.company_id
             )
             db.session.add(work_order_checklist)
     
     # Update maintenance schedule
     schedule.last_performed = datetime.utcnow()
     
-    # Calculate next due date based on frequency
-    if schedule.next_due:
-        if schedule.frequency == 'daily':
-            schedule.next_due = schedule.next_due + timedelta(days=schedule.frequency_value)
-        elif schedule.frequency == 'weekly':
-            schedule.next_due = schedule.next_due + timedelta(weeks=schedule.frequency_value)
-        elif schedule.frequency == 'monthly':
-            # Simple month calculation (30 days)
-            schedule.next_due = schedule.next_due + timedelta(days=30 * schedule.frequency_value)
-        elif schedule.frequency == 'yearly':
-            schedule.next_due = schedule.next_due + timedelta(days=365 * schedule.frequency_value)
+    # Move next due date to the following occurrence of the schedule's rule
+    rule = rule_for(schedule)
+    if schedule.next_due and rule is not None:
+        schedule.next_due = rule.next_after(schedule.next_due)
     
     db.session.commit()
     
@@ -2812,10 +2979,7 @@ def mobile_dashboard():
     """Mobile dashboard showing assigned tasks"""
     # Get work orders assigned to current user (technician or team member)
     assigned_work_orders = filter_by_company(WorkOrder.query).filter(
-        db.or_(
-            WorkOrder.assigned_technician_id == current_user.id,
-            WorkOrder.assigned_team_id.in_([team.id for team in current_user.teams])
-        )
+        assigned_work_orders_filter()
     ).filter(
         WorkOrder.status.in_(['open', 'in_progress'])
     ).order_by(WorkOrder.priority.desc(), WorkOrder.due_date.asc()).all()
@@ -2823,18 +2987,37 @@ def mobile_dashboard():
     # Get completed work orders from today
     today = datetime.now().date()
     completed_today = filter_by_company(WorkOrder.query).filter(
-        db.or_(
-            WorkOrder.assigned_technician_id == current_user.id,
-            WorkOrder.assigned_team_id.in_([team.id for team in current_user.teams])
-        )
+        assigned_work_orders_filter()
     ).filter(
         WorkOrder.status == 'completed',
         db.func.date(WorkOrder.actual_end_time) == today
     ).count()
     
+    # Today's route: planned stops first, in visiting order, then the rest by priority
+    route = None
+    route_stops = {}
+    if request.args.get('view') == 'route':
+        route = plan_day(current_user, today, start=route_start_from_args())
+        route_stops = {stop.work_order_id: (sequence, stop.leg_km) for sequence, stop in enumerate(route.stops, 1)}
+        position = {work_order_id: index for index, work_order_id in enumerate(route.work_order_ids)}
+        assigned_work_orders.sort(key=lambda wo: position.get(wo.id, len(position)))
+    
     return render_template('mobile/dashboard.html', 
                          work_orders=assigned_work_orders,
-                         completed_today=completed_today)
+                         completed_today=completed_today,
+                         route=route,
+                         route_stops=route_stops)
+
+def route_start_from_args():
+    """Starting point sent by the device as ``?lat=&lng=``, or None to start from the home location"""
+    try:
+        latitude = float(request.args['lat'])
+        longitude = float(request.args['lng'])
+    except (KeyError, ValueError):
+        return None
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return None
+    return latitude, longitude
 
 @app.route('/mobile/tasks')
 @login_required
@@ -2844,10 +3027,7 @@ def mobile_tasks():
     priority_filter = request.args.get('priority', 'all')
     
     query = filter_by_company(WorkOrder.query).filter(
-        db.or_(
-            WorkOrder.assigned_technician_id == current_user.id,
-            WorkOrder.assigned_team_id.in_([team.id for team in current_user.teams])
-        )
+        assigned_work_orders_filter()
     )
     
     if status_filter != 'all':
@@ -2870,8 +3050,7 @@ def mobile_task_detail(work_order_id):
     work_order = WorkOrder.query.get_or_404(work_order_id)
     
     # Check if user is assigned to this work order
-    if (work_order.assigned_technician_id != current_user.id and 
-        work_order.assigned_team_id not in [team.id for team in current_user.teams]):
+    if not is_assigned(work_order):
         abort(403)
     
     return render_template('mobile/task_detail.html', work_order=work_order)
@@ -2883,8 +3062,7 @@ def mobile_start_task(work_order_id):
     work_order = WorkOrder.query.get_or_404(work_order_id)
     
     # Check if user is assigned to this work order
-    if (work_order.assigned_technician_id != current_user.id and 
-        work_order.assigned_team_id not in [team.id for team in current_user.teams]):
+    if not is_assigned(work_order):
         abort(403)
     
     if work_order.status == 'open':
@@ -2902,8 +3080,7 @@ def mobile_complete_task(work_order_id):
     work_order = WorkOrder.query.get_or_404(work_order_id)
     
     # Check if user is assigned to this work order
-    if (work_order.assigned_technician_id != current_user.id and 
-        work_order.assigned_team_id not in [team.id for team in current_user.teams]):
+    if not is_assigned(work_order):
         abort(403)
     
     if request.method == 'POST':
@@ -2916,6 +3093,14 @@ def mobile_complete_task(work_order_id):
                 if file_path:
                     proof_images.append(file_path)
         
+        # Files uploaded beforehand through the resumable upload API
+        for upload_id in request.form.getlist('upload_ids'):
+            try:
+                finalize_resumable_upload(resumable_uploads.get(upload_id, current_user), work_order)
+            except UploadError as e:
+                print(f"Error attaching upload {upload_id}: {e}")
+                flash(f'An uploaded file could not be attached: {e}', 'warning')
+        
         # Update work order
         work_order.status = 'completed'
         work_order.actual_end_time = datetime.utcnow()
@@ -2924,11 +3109,8 @@ def mobile_complete_task(work_order_id):
         
         work_order.completion_notes = request.form.get('completion_notes', '')
         
-        # Add proof images to existing images
-        if proof_images:
-            current_images = work_order.images or ''
-            updated_images = ','.join([current_images, *proof_images]) if current_images else ','.join(proof_images)
-            work_order.images = updated_images
+        # Add proof images to the work order's photos
+        attach_media(work_order, 'image', proof_images, current_user.id)
         
         db.session.commit()
         flash('Task completed successfully!', 'success')
@@ -2943,8 +3125,7 @@ def mobile_add_proof(work_order_id):
     work_order = WorkOrder.query.get_or_404(work_order_id)
     
     # Check if user is assigned to this work order
-    if (work_order.assigned_technician_id != current_user.id and 
-        work_order.assigned_team_id not in [team.id for team in current_user.teams]):
+    if not is_assigned(work_order):
         abort(403)
     
     # Handle proof image uploads
@@ -2957,10 +3138,8 @@ def mobile_add_proof(work_order_id):
                 proof_images.append(file_path)
     
     if proof_images:
-        # Add proof images to existing images
-        current_images = work_order.images or ''
-        updated_images = ','.join([current_images, *proof_images]) if current_images else ','.join(proof_images)
-        work_order.images = updated_images
+        # Add proof images to the work order's photos
+        attach_media(work_order, 'image', proof_images, current_user.id)
         db.session.commit()
         flash('Proof images added successfully!', 'success')
     
@@ -2985,13 +3164,11 @@ def mobile_logout():
 def api_mobile_tasks():
     """API endpoint for mobile task list"""
     work_orders = filter_by_company(WorkOrder.query).filter(
-        db.or_(
-            WorkOrder.assigned_technician_id == current_user.id,
-            WorkOrder.assigned_team_id.in_([team.id for team in current_user.teams])
-        )
+        assigned_work_orders_filter()
     ).filter(
         WorkOrder.status.in_(['open', 'in_progress'])
     ).order_by(WorkOrder.priority.desc(), WorkOrder.due_date.asc()).all()
+    media = media_by_owner('work_order', [wo.id for wo in work_orders])
     
     return jsonify([{
         'id': wo.id,
@@ -3000,11 +3177,26 @@ def api_mobile_tasks():
         'status': wo.status,
         'due_date': wo.due_date.isoformat() if wo.due_date else None,
         'equipment_name': wo.equipment.name if wo.equipment else None,
-        'has_images': bool(wo.images),
-        'has_videos': bool(wo.videos),
-        'has_voice_notes': bool(wo.voice_notes)
+        'has_images': 'image' in media.get(wo.id, {}),
+        'has_videos': 'video' in media.get(wo.id, {}),
+        'has_voice_notes': 'audio' in media.get(wo.id, {}),
+        'thumbnail_url': url_for('static', filename=thumbnails.derivative(media[wo.id]['image'][0], 'thumb'))
+                         if 'image' in media.get(wo.id, {}) else None
     } for wo in work_orders])
 
+@app.route('/api/mobile/route')
+@login_required
+def api_mobile_route():
+    """Planned visiting order of the current user's work orders for a day (?date=YYYY-MM-DD&lat=&lng=)"""
+    day = datetime.now().date()
+    if request.args.get('date'):
+        try:
+            day = datetime.strptime(request.args['date'], '%Y-%m-%d').date()
+        except ValueError:
+            return jsonify({'success': False, 'message': 'Invalid date, use YYYY-MM-DD'}), 400
+    route = plan_day(current_user, day, start=route_start_from_args())
+    return jsonify({'success': True, 'date': day.isoformat(), **route.to_dict()})
+
 @app.route('/api/mobile/task/<int:work_order_id>')
 @login_required
 def api_mobile_task_detail(work_order_id):
@@ -3012,8 +3204,7 @@ def api_mobile_task_detail(work_order_id):
     work_order = WorkOrder.query.get_or_404(work_order_id)
     
     # Check if user is assigned to this work order
-    if (work_order.assigned_technician_id != current_user.id and 
-        work_order.assigned_team_id not in [team.id for team in current_user.teams]):
+    if not is_assigned(work_order):
         abort(403)
     
     return jsonify({
@@ -3033,9 +3224,14 @@ def api_mobile_task_detail(work_order_id):
         'estimated_duration': work_order.estimated_duration,
         'actual_duration': work_order.actual_duration,
         'completion_notes': work_order.completion_notes,
-        'images': work_order.images.split(',') if work_order.images else [],
-        'videos': work_order.videos.split(',') if work_order.videos else [],
-        'voice_notes': work_order.voice_notes.split(',') if work_order.voice_notes else [],
+        'images': work_order.image_paths,
+        'image_previews': [{
+            'url': url_for('static', filename=path),
+            'thumbnail_url': url_for('static', filename=thumbnails.derivative(path, 'thumb')),
+            'medium_url': url_for('static', filename=thumbnails.derivative(path, 'medium')),
+        } for path in work_order.image_paths],
+        'videos': work_order.video_paths,
+        'voice_notes': work_order.voice_note_paths,
         'created_at': work_order.created_at.isoformat(),
         'actual_start_time': work_order.actual_start_time.isoformat() if work_order.actual_start_time else None,
         'actual_end_time': work_order.actual_end_time.isoformat() if work_order.actual_end_time else None
@@ -3104,7 +3300,7 @@ def task_logs():
     if assigned_to != 'all':
         query = query.filter(WorkOrder.assigned_technician_id == assigned_to)
     
-    work_orders = query.order_by(WorkOrder.created_at.desc()).all()
+    work_orders = query.options(selectinload(WorkOrder.media)).order_by(WorkOrder.created_at.desc()).all()
     
     # Get filter options
     equipment_list = Equipment.query.all()
@@ -3272,9 +3468,9 @@ def export_csv():
             wo.estimated_duration if wo.estimated_duration else 'N/A',
             wo.actual_duration if wo.actual_duration else 'N/A',
             wo.completion_notes if wo.completion_notes else 'N/A',
-            wo.images if wo.images else 'N/A',
-            wo.videos if wo.videos else 'N/A',
-            wo.voice_notes if wo.voice_notes else 'N/A'
+            ','.join(wo.image_paths) or 'N/A',
+            ','.join(wo.video_paths) or 'N/A',
+            ','.join(wo.voice_note_paths) or 'N/A'
         ])
     
     # Create response
@@ -3730,6 +3926,21 @@ def admin_quick_actions():
     
     return render_template('admin/quick_actions.html')
 
+WORK_ORDER_STATUSES = ('open', 'in_progress', 'completed', 'cancelled')
+BULK_UPDATE_CHUNK_SIZE = 1000
+
+def bulk_update_company_rows(model, ids, values, chunk_size=BULK_UPDATE_CHUNK_SIZE):
+    """UPDATE the current company's rows with the given ids in chunks; returns the affected row count"""
+    row_ids = sorted({int(row_id) for row_id in ids if str(row_id).strip().isdigit()})
+    updated_count = 0
+    for start in range(0, len(row_ids), chunk_size):
+        statement = sqlalchemy.update(model).where(
+            model.company_id == current_user.company_id,
+            model.id.in_(row_ids[start:start + chunk_size])
+        ).values(values).execution_options(synchronize_session=False)
+        updated_count += db.session.execute(statement).rowcount
+    return updated_count
+
 @app.route('/admin/bulk-assign', methods=['POST'])
 @login_required
 def admin_bulk_assign():
@@ -3751,15 +3962,17 @@ def admin_bulk_assign():
         flash('Invalid technician selected.', 'error')
         return redirect(url_for('admin_work_orders'))
     
-    # Update work orders
-    updated_count = 0
-    for work_order_id in work_order_ids:
-        work_order = filter_by_company(WorkOrder.query).filter_by(id=work_order_id).first()
-        if work_order:
-            work_order.assigned_technician_id = technician_id
-            updated_count += 1
-    
+    # Update work orders in set-based, company-scoped batches
+    updated_count = bulk_update_company_rows(WorkOrder, work_order_ids, {'assigned_technician_id': technician.id})
     db.session.commit()
+    
+    # One summary notification instead of one message per work order
+    try:
+        from whatsapp_notifications import WhatsAppNotifications
+        WhatsAppNotifications.notify_bulk_assignment(technician, updated_count)
+    except Exception as e:
+        print(f"Error sending bulk assignment notification: {e}")
+    
     flash(f'Successfully assigned {updated_count} work orders to {technician.first_name} {technician.last_name}.', 'success')
     
     return redirect(url_for('admin_work_orders'))
@@ -3780,19 +3993,21 @@ def admin_bulk_status():
         flash('Please select work orders and a new status.', 'error')
         return redirect(url_for('admin_work_orders'))
     
-    # Update work orders
-    updated_count = 0
-    for work_order_id in work_order_ids:
-        work_order = filter_by_company(WorkOrder.query).filter_by(id=work_order_id).first()
-        if work_order:
-            work_order.status = new_status
-            if new_status == 'in_progress' and not work_order.actual_start_time:
-                work_order.actual_start_time = datetime.utcnow()
-            elif new_status == 'completed' and not work_order.actual_end_time:
-                work_order.actual_end_time = datetime.utcnow()
-            updated_count += 1
+    if new_status not in WORK_ORDER_STATUSES:
+        flash('Invalid status selected.', 'error')
+        return redirect(url_for('admin_work_orders'))
     
+    # Update work orders in set-based, company-scoped batches; start/end times
+    # are stamped only where they are not set yet
+    now = datetime.utcnow()
+    values = {'status': new_status}
+    if new_status == 'in_progress':
+        values['actual_start_time'] = db.func.coalesce(WorkOrder.actual_start_time, now)
+    elif new_status == 'completed':
+        values['actual_end_time'] = db.func.coalesce(WorkOrder.actual_end_time, now)
+    updated_count = bulk_update_company_rows(WorkOrder, work_order_ids, values)
     db.session.commit()
+    
     flash(f'Successfully updated status for {updated_count} work orders to {new_status.replace("_", " ").title()}.', 'success')
     
     return redirect(url_for('admin_work_orders'))
@@ -4396,27 +4611,27 @@ def admin_roles():
     
     roles = query.all()
     
-    # Get all users for the current company to calculate user counts
-    users = filter_by_company(User.query).all()
-    
-    # Calculate user counts for each role
-    role_user_counts = {}
-    for role in roles:
-        count = 0
-        for user in users:
-            # Check both role_id and role field for compatibility
-            if user.role_id == role.id or user.role == role.name:
-                count += 1
-        role_user_counts[role.id] = count
+    # Count members per (role_id, legacy role name) pair in one grouped query;
+    # a user counts towards a role if either field matches, as before
+    membership = db.session.query(User.role_id, User.role, db.func.count(User.id)).filter(
+        User.company_id == current_user.company_id
+    ).group_by(User.role_id, User.role).all()
+    role_user_counts = {
+        role.id: sum(count for role_id, role_name, count in membership
+                     if role_id == role.id or role_name == role.name)
+        for role in roles
+    }
     
-    # Calculate statistics
-    active_roles_count = filter_by_company(Role.query).filter_by(is_active=True).count()
-    system_roles_count = filter_by_company(Role.query).filter_by(is_system_role=True).count()
-    custom_roles_count = filter_by_company(Role.query).filter_by(is_system_role=False).count()
+    # Calculate statistics from one grouped query over the company's roles
+    role_stats = db.session.query(Role.is_active, Role.is_system_role, db.func.count(Role.id)).filter(
+        Role.company_id == current_user.company_id
+    ).group_by(Role.is_active, Role.is_system_role).all()
+    active_roles_count = sum(count for is_active, _, count in role_stats if is_active is True)
+    system_roles_count = sum(count for _, is_system, count in role_stats if is_system is True)
+    custom_roles_count = sum(count for _, is_system, count in role_stats if is_system is False)
     
     return render_template('admin/roles.html', 
                          roles=roles,
-                         users=users,
                          role_user_counts=role_user_counts,
                          active_roles_count=active_roles_count,
                          system_roles_count=system_roles_count,
@@ -4586,7 +4801,7 @@ def approve_work_order_request(request_id):
     # Create WorkOrder from request
     work_order = WorkOrder(
         company_id=req.company_id,
-        work_order_number=generate_work_order_number(),
+        work_order_number=generate_work_order_number(req.company_id),
         title=req.title,
         description=req.description,
         priority=req.priority,
@@ -4708,6 +4923,7 @@ def admin_update_role(role_id):
         role.permissions = json.dumps(permissions)
         
         db.session.commit()
+        invalidate_role(role.id)
         
         flash(f'Role "{display_name}" updated successfully.', 'success')
         return redirect(url_for('admin_get_role', role_id=role_id))
@@ -4753,6 +4969,7 @@ def admin_delete_role(role_id):
         # Delete the role
         db.session.delete(role)
         db.session.commit()
+        invalidate_role(role_id)
         
         flash(f'Role "{role.display_name}" deleted successfully.', 'success')
         return redirect(url_for('admin_roles'))
@@ -5239,6 +5456,102 @@ def admin_save_notification_settings():
     flash('Notification settings saved successfully.', 'success')
     return redirect(url_for('admin_settings'))
 
+@app.route('/admin/perf/slow-queries')
+@login_required
+def admin_slow_queries():
+    """Slow query log for the current company"""
+    if current_user.role != 'admin':
+        flash('Access denied. Admin privileges required.', 'error')
+        return redirect(url_for('index'))
+    
+    route_filter = request.args.get('route', '').strip() or None
+    limit = min(request.args.get('limit', 500, type=int), 5000)
+    
+    entries = slow_query_log.read_entries(limit=limit, company_id=current_user.company_id, route=route_filter)
+    summary = slow_query_log.summarize(entries)
+    routes = sorted({entry['route'] for entry in entries if entry.get('route')})
+    
+    return render_template('admin/slow_queries.html',
+                         entries=entries[:100],
+                         summary=summary[:50],
+                         routes=routes,
+                         route_filter=route_filter,
+                         threshold_ms=app.config['SLOW_QUERY_THRESHOLD_MS'],
+                         explain_analyze=app.config['SLOW_QUERY_EXPLAIN_ANALYZE'])
+
+@app.route('/admin/perf/profiles')
+@login_required
+def admin_profiles():
+    """Request profiler settings and stored profiles"""
+    if current_user.role != 'admin':
+        flash('Access denied. Admin privileges required.', 'error')
+        return redirect(url_for('index'))
+    
+    token = request_profiler.generate_token(current_user.id, current_user.company_id)
+    endpoints = sorted(endpoint for endpoint in app.view_functions if endpoint != 'static')
+    
+    return render_template('admin/profiles.html',
+                         settings=request_profiler.get_settings(current_user.company_id),
+                         profiles=request_profiler.list_profiles(current_user.company_id),
+                         endpoints=endpoints,
+                         profile_token=token,
+                         profile_query_arg=PROFILE_QUERY_ARG,
+                         token_max_age=app.config['PROFILE_TOKEN_MAX_AGE'])
+
+@app.route('/admin/perf/profiles/settings', methods=['POST'])
+@login_required
+def admin_profile_settings():
+    """Update request profiler sampling settings of the current company"""
+    if current_user.role != 'admin':
+        flash('Access denied. Admin privileges required.', 'error')
+        return redirect(url_for('index'))
+    
+    try:
+        request_profiler.save_settings(
+            company_id=current_user.company_id,
+            enabled=request.form.get('enabled') == 'on',
+            sample_rate=request.form.get('sample_rate', 1.0, type=float),
+            routes=request.form.getlist('routes')
+        )
+        flash('Profiler settings saved successfully.', 'success')
+    except (OSError, ValueError) as e:
+        flash(f'Error saving profiler settings: {str(e)}', 'error')
+    
+    return redirect(url_for('admin_profiles'))
+
+@app.route('/admin/perf/profiles/<filename>')
+@login_required
+def admin_profile_view(filename):
+    """Show the pstats report of a stored profile"""
+    if current_user.role != 'admin':
+        flash('Access denied. Admin privileges required.', 'error')
+        return redirect(url_for('index'))
+    
+    profile = request_profiler.get_profile(filename, current_user.company_id)
+    if not profile:
+        abort(404)
+    
+    sort_by = request.args.get('sort', 'cumulative')
+    if sort_by not in ['cumulative', 'tottime', 'ncalls']:
+        sort_by = 'cumulative'
+    
+    return render_template('admin/profile_detail.html',
+                         profile=profile,
+                         sort_by=sort_by,
+                         report=request_profiler.format_stats(filename, sort_by))
+
+@app.route('/admin/perf/profiles/<filename>/download')
+@login_required
+def admin_profile_download(filename):
+    """Download a stored .prof file"""
+    if current_user.role != 'admin':
+        abort(403)
+    
+    if not request_profiler.get_profile(filename, current_user.company_id):
+        abort(404)
+    
+    return send_from_directory(request_profiler.profile_dir, filename, as_attachment=True)
+
 @app.route('/admin/bulk-equipment-status', methods=['POST'])
 @login_required
 def admin_bulk_equipment_status():
@@ -5254,19 +5567,14 @@ def admin_bulk_equipment_status():
         return jsonify({'success': False, 'message': 'No equipment selected'}), 400
     
     try:
-        updated_count = 0
-        for equipment_id in equipment_ids:
-            equipment = filter_by_company(Equipment.query).filter_by(id=equipment_id).first()
-            if equipment:
-                equipment.status = new_status
-                equipment.updated_at = datetime.utcnow()
-                updated_count += 1
-        
+        updated_count = bulk_update_company_rows(Equipment, equipment_ids,
+                                                 {'status': new_status, 'updated_at': datetime.utcnow()})
         db.session.commit()
         
         return jsonify({
             'success': True, 
-            'message': f'Successfully updated status for {updated_count} equipment items to {new_status.title()}'
+            'message': f'Successfully updated status for {updated_count} equipment items to {new_status.title()}',
+            'updated_count': updated_count
         })
     except Exception as e:
         db.session.rollback()
@@ -5557,6 +5865,55 @@ def quick_asset_registry_export():
     )
 
 
+@app.route('/quick-asset-registry/import', methods=['POST'])
+@login_required
+def quick_asset_registry_import():
+    """Bulk import equipment and inventory from the registry template (CSV or XLSX)"""
+    if current_user.role not in ['admin', 'manager']:
+        flash('Access denied. Admin/Manager privileges required.', 'error')
+        return redirect(url_for('index'))
+    
+    from asset_import import AssetImporter, ImportFileError, read_rows
+    
+    upload = request.files.get('csv_file')
+    if not upload or not upload.filename:
+        flash('Please choose a CSV or XLSX file to import.', 'error')
+        return redirect(url_for('quick_asset_registry'))
+    
+    dry_run = request.form.get('dry_run') == 'on'
+    report_format = request.form.get('format', 'html')
+    try:
+        importer = AssetImporter(current_user.company_id, current_user.id,
+                                 default_type=request.form.get('asset_type') or None)
+        report = importer.run(read_rows(upload), dry_run=dry_run)
+    except ImportFileError as e:
+        if report_format == 'json':
+            return jsonify({'success': False, 'message': str(e)}), 400
+        flash(str(e), 'error')
+        return redirect(url_for('quick_asset_registry'))
+    except Exception as e:
+        if report_format == 'json':
+            return jsonify({'success': False, 'message': f'Error importing assets: {str(e)}'}), 500
+        flash(f'Error importing assets: {str(e)}', 'error')
+        return redirect(url_for('quick_asset_registry'))
+    
+    if report_format == 'json':
+        return jsonify(dict(report, success=True))
+    if report_format == 'csv':
+        # Rejected rows only, ready to fix and upload again
+        output = StringIO()
+        writer = csv.writer(output)
+        writer.writerow(['Row', 'ID/Part Number', 'Name', 'Errors'])
+        for error in report['errors']:
+            writer.writerow([error['row'], error['identifier'], error['name'], '; '.join(error['errors'])])
+        return Response(
+            output.getvalue(),
+            mimetype='text/csv',
+            headers={'Content-Disposition': 'attachment; filename=asset_import_errors.csv'}
+        )
+    return render_template('quick_asset_registry_import.html', report=report, filename=upload.filename)
+
+
 @app.route('/quick-asset-registry/template')
 @login_required
 def quick_asset_registry_template():
@@ -5573,21 +5930,21 @@ def quick_asset_registry_template():
         'Type', 'Name', 'ID/Part Number', 'Category', 'Location', 'Status', 
         'Manufacturer', 'Model', 'Serial Number', 'Criticality',
         'Current Stock', 'Minimum Stock', 'Unit Cost', 'Unit of Measure',
-        'Description'
+        'Description', 'Department'
     ])
     
     # Write example rows
     writer.writerow([
-        'Equipment', 'Pump Station A', 'PUMP-001', 'Mechanical', 'Building 1', 'Operational',
+        'Equipment', 'Pump Station A', 'PUMP-001', 'Machinery', 'Building 1', 'Operational',
         'Grundfos', 'CR45-4', 'SN123456', 'High',
         '', '', '', '',
-        'Main water pump for Building 1'
+        'Main water pump for Building 1', 'Maintenance'
     ])
     writer.writerow([
-        'Inventory', 'Pump Filter', 'FILTER-001', 'Spare Parts', 'Warehouse A', 'Active',
+        'Inventory', 'Pump Filter', 'FILTER-001', 'Filters', 'Warehouse A', 'Active',
         '', '', '', '',
         '50', '10', '25.50', 'pieces',
-        'Replacement filter for pump stations'
+        'Replacement filter for pump stations', ''
         ])
     
     output.seek(0)
@@ -5618,14 +5975,14 @@ def quick_maintenance_schedule():
         try:
             equipment = filter_by_company(Equipment.query).filter_by(id=equipment_id).first_or_404()
             schedule = MaintenanceSchedule(
+                company_id=current_user.company_id,
                 equipment_id=equipment.id,
-                frequency=frequency,
-                frequency_value=int(frequency_value),
                 description=description,
                 estimated_duration=data.get('estimated_duration'),
-                next_due=datetime.strptime(next_due, '%Y-%m-%dT%H:%M'),
                 is_active=True
             )
+            first_due = datetime.strptime(next_due, '%Y-%m-%dT%H:%M')
+            apply_rule(schedule, build_rule(frequency, int(frequency_value), first_due), first_due)
             db.session.add(schedule)
             db.session.commit()
             flash(f'Maintenance schedule created for {equipment.name}!', 'success')
@@ -5758,15 +6115,11 @@ def qr_failure_report(equipment_id):
             else:
                 # ADMIN/MANAGER: Create WorkOrder directly
                 try:
-                    technicians = User.query.filter_by(company_id=equipment.company_id, role='technician', is_active=True).all()
-                    technician_id = None
-                    if technicians:
-                        tech_counts = [(tech, WorkOrder.query.filter_by(assigned_technician_id=tech.id).count()) for tech in technicians]
-                        tech_counts.sort(key=lambda x: (x[1], x[0].id))
-                        technician_id = tech_counts[0][0].id
+                    # Least loaded technician, nearest to the equipment on ties (see dispatcher.py)
+                    technician_id = dispatcher.choose(equipment.company_id, location=equipment.location_info)
                     work_order = WorkOrder(
                         company_id=equipment.company_id,
-                        work_order_number=generate_work_order_number(),
+                        work_order_number=generate_work_order_number(equipment.company_id),
                         title=f"QR Report: {failure_type.title()} Failure - {equipment.name}",
                         description=f"Failure reported via QR code:\n\n{description}\n\nReporter: {reporter_name or 'Anonymous'}\nPhone: {reporter_phone or 'Not provided'}",
                         priority='urgent' if urgency == 'high' else 'high',
@@ -5777,12 +6130,12 @@ def qr_failure_report(equipment_id):
                         created_by_id=current_user.id,
                         scheduled_date=datetime.now(),
                         due_date=datetime.now() + timedelta(hours=4) if urgency == 'high' else datetime.now() + timedelta(days=1),
-                        images=','.join(images) if images else None,
-                        videos=','.join(videos) if videos else None,
-                        voice_notes=','.join(audio_files) if audio_files else None,
                         estimated_duration=estimated_duration
                     )
                     db.session.add(work_order)
+                    attach_media(work_order, 'image', images, current_user.id)
+                    attach_media(work_order, 'video', videos, current_user.id)
+                    attach_media(work_order, 'audio', audio_files, current_user.id)
                     if equipment.status == 'operational':
                         equipment.status = 'maintenance'
                         equipment.updated_at = datetime.utcnow()
@@ -6461,7 +6814,8 @@ def delete_vendor(vendor_id):
 # Helper function to send email
 def send_email(subject, recipients, body, html=None):
     msg = Message(subject, recipients=recipients, body=body, html=html)
-    mail.send(msg)
+    with metrics.track_outbound('smtp'):
+        mail.send(msg)
 
 # Helper function for work order access
 from flask import abort
@@ -6469,20 +6823,20 @@ from flask import abort
 def user_can_access_work_order(work_order, user):
     if user.role in ['admin', 'manager']:
         return True
-    return (
-        work_order.assigned_technician_id == user.id or
-        (work_order.assigned_team_id is not None and work_order.assigned_team_id in [team.id for team in user.teams])
-    )
+    return is_assigned(work_order, user)
 
 def user_has_permission(user, permission):
     # Always grant assigned-only permission to technicians
     if getattr(user, 'role', None) == 'technician' and permission == 'workorder_view_assigned_only':
         return True
+    # The logged-in user's role and permissions are resolved once per request (see identity.py)
+    identity = identity_for(user)
+    if identity is not None:
+        return identity.role_name == 'admin' or permission in identity.permissions
     if hasattr(user, 'role_info') and user.role_info and getattr(user.role_info, 'name', None) == 'admin':
         return True
-    if hasattr(user, 'role_info') and user.role_info and getattr(user.role_info, 'permissions', None):
-        perms = json.loads(user.role_info.permissions)
-        return permission in perms
+    if hasattr(user, 'role_info') and user.role_info:
+        return permission in role_permissions(user.role_info)
     return False
 
 # Template context processor to make user_has_permission available in templates
@@ -6498,15 +6852,100 @@ def init_db_command():
     click.echo('✅ Database tables created.')
 
 @click.command('cleanup-files')
+@click.option('--scan', is_flag=True, help='Also look for stored files without a database record.')
 @with_appcontext
-def cleanup_files_command():
+def cleanup_files_command(scan):
     """Clean up orphaned files."""
-    cleanup_orphaned_files()
+    cleanup_orphaned_files(scan=scan)
     click.echo('✅ File cleanup completed!')
 
+@click.command('generate-thumbnails')
+@click.option('--batch-size', default=500, show_default=True, help='Photos queued per batch.')
+@with_appcontext
+def generate_thumbnails_command(batch_size):
+    """Render the missing thumbnails and previews of all work order and comment photos."""
+    from concurrent.futures import wait
+    from models import WorkOrderMedia
+    
+    rendered = failed = 0
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            db.select(WorkOrderMedia.id, WorkOrderMedia.path)
+            .where(WorkOrderMedia.kind == 'image', WorkOrderMedia.id > last_id)
+            .order_by(WorkOrderMedia.id).limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        done, _ = wait(thumbnails.enqueue(dict.fromkeys(row.path for row in rows)))
+        failed += sum(1 for future in done if future.exception() is not None)
+        rendered += len(done)
+    click.echo(f"✅ Rendered thumbnails of {rendered - failed} photos" + (f", {failed} failed" if failed else ''))
+
+@click.command('seed')
+@click.option('--companies', default=1, show_default=True, help='Number of companies to generate.')
+@click.option('--technicians', type=int, help='Technicians per company.')
+@click.option('--teams', type=int, help='Teams per company.')
+@click.option('--locations', type=int, help='Locations per company.')
+@click.option('--equipment', type=int, help='Equipment per company.')
+@click.option('--inventory', type=int, help='Inventory items per company.')
+@click.option('--work-orders', 'work_orders', type=int, help='Work orders per company.')
+@click.option('--comments', type=int, help='Work order comments per company.')
+@click.option('--schedules', type=int, help='Maintenance schedules per company.')
+@click.option('--notifications', type=int, help='Notification log entries per company.')
+@click.option('--batch-size', default=10000, show_default=True, help='Rows per bulk insert / COPY batch.')
+@click.option('--seed', 'random_seed', type=int, help='Random seed for reproducible data.')
+@with_appcontext
+def seed_command(companies, batch_size, random_seed, **scale):
+    """Generate synthetic companies with bulk inserts (for load and performance testing)."""
+    from seed_data import TenantSeeder, SEED_PASSWORD, ScaleError, resolve_scale
+    
+    try:
+        resolve_scale(scale)
+    except ScaleError as e:
+        raise click.BadParameter(str(e), param_hint=f"--{e.option.replace('_', '-')}")
+    
+    seeder = TenantSeeder(batch_size=batch_size, seed=random_seed)
+    run_id = datetime.utcnow().strftime('%Y%m%d%H%M%S')
+    for index in range(1, companies + 1):
+        started = datetime.utcnow()
+        tenant = seeder.seed_company(f'Seed Company {run_id}-{index}', scale)
+        elapsed = (datetime.utcnow() - started).total_seconds()
+        click.echo(f"✅ Company {tenant['company_id']} seeded in {elapsed:.1f}s "
+                   f"({len(tenant['work_order_ids'])} work orders, {len(tenant['equipment_ids'])} equipment)")
+    click.echo(f"Log in as c<company_id>.admin@example.com / {SEED_PASSWORD}")
+
+@click.command('generate-pm-work-orders')
+@click.option('--horizon', default='7d', show_default=True, help='How far ahead to generate, e.g. 12h, 7d, 2w.')
+@click.option('--company-id', type=int, help='Only generate for this company.')
+@click.option('--batch-size', default=500, show_default=True, help='Schedules per batch / transaction.')
+@click.option('--dry-run', is_flag=True, help='Report what would be generated without writing anything.')
+@with_appcontext
+def generate_pm_work_orders_command(horizon, company_id, batch_size, dry_run):
+    """Create work orders for all maintenance schedules due within the horizon (safe to re-run)."""
+    from pm_generator import PMWorkOrderGenerator, parse_horizon
+    
+    try:
+        window = parse_horizon(horizon)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--horizon')
+    
+    started = datetime.utcnow()
+    stats = PMWorkOrderGenerator(window, company_id=company_id, batch_size=batch_size, dry_run=dry_run).run()
+    elapsed = (datetime.utcnow() - started).total_seconds()
+    prefix = 'Would create' if dry_run else '✅ Created'
+    click.echo(f"{prefix} {stats['work_orders']} work orders and {stats['checklist_items']} checklist items "
+               f"from {stats['schedules']} schedules in {elapsed:.1f}s")
+    if stats['skipped']:
+        click.echo(f"⚠️  Skipped {stats['skipped']} schedules (invalid recurrence rule or no active admin in the company)")
+
 def register_commands(app):
     app.cli.add_command(init_db_command)
     app.cli.add_command(cleanup_files_command)
+    app.cli.add_command(generate_thumbnails_command)
+    app.cli.add_command(seed_command)
+    app.cli.add_command(generate_pm_work_orders_command)
 
 register_commands(app)
 
@@ -6518,6 +6957,15 @@ def forbidden_error(error):
     else:
         return redirect(url_for('login'))
 
+@app.errorhandler(413)
+def request_entity_too_large_error(error):
+    # Raised while the upload is still streaming in (see upload_ingest.py)
+    message = error.description or 'Uploaded file is too large.'
+    if request.path.startswith('/api/') or request.accept_mimetypes.best == 'application/json':
+        return jsonify({'success': False, 'message': message}), 413
+    flash(message, 'error')
+    return redirect(request.referrer or url_for('index'))
+
 @app.route('/locations/ajax-new', methods=['POST'])
 @login_required
 def ajax_location_new():
@@ -6622,11 +7070,15 @@ def api_subdivisions(country_code):
     return jsonify(result)
 
 def delete_files(file_paths):
-    """Delete files from the filesystem"""
+    """Drop references to media files; stored media is removed by cleanup_orphaned_files once unreferenced"""
     if not file_paths:
         return
-    if isinstance(file_paths, str):
-        file_paths = file_paths.split(',')
+    try:
+        # Only files from before the media store are deleted directly
+        file_paths = media_store.release(file_paths)
+    except Exception as e:
+        print(f"Error releasing media {file_paths}: {e}")
+        return
     for path in file_paths:
         if path:
             abs_path = os.path.join(app.static_folder or '', path) if not os.path.isabs(path) else path
@@ -6638,85 +7090,28 @@ def delete_files(file_paths):
                 print(f"Error deleting file {abs_path}: {e}")
 
 def cleanup_work_order_files(work_order):
-    """Clean up all files associated with a work order"""
+    """Detach all media of a work order and its comments"""
     try:
-        # Clean up work order media files
-        if work_order.images:
-            delete_files(work_order.images)
-        if work_order.videos:
-            delete_files(work_order.videos)
-        if work_order.voice_notes:
-            delete_files(work_order.voice_notes)
-        
-        # Clean up comment files
-        from models import WorkOrderComment
-        comments = WorkOrderComment.query.filter_by(work_order_id=work_order.id).all()
-        for comment in comments:
-            if comment.images:
-                delete_files(comment.images)
-            if comment.videos:
-                delete_files(comment.videos)
-            if comment.voice_notes:
-                delete_files(comment.voice_notes)
+        delete_files(detach_work_orders([work_order.id]))
         
         print(f"Cleaned up files for work order {work_order.id}")
     except Exception as e:
         print(f"Error cleaning up files for work order {work_order.id}: {e}")
 
-def cleanup_orphaned_files():
-    """Clean up orphaned files that don't have associated database records"""
+def cleanup_orphaned_files(scan=False):
+    """Remove stored media no longer referenced by any work order, request, comment or message.
+
+    Unreferenced blobs come from an indexed query; ``scan`` also walks the store for files whose
+    upload was rolled back.
+    """
     try:
-        upload_dir = os.path.join(app.static_folder or '', 'uploads', 'work_orders')
-        if not os.path.exists(upload_dir):
-            return
-        
-        # Get all files in upload directory
-        all_files = []
-        for root, dirs, files in os.walk(upload_dir):
-            for file in files:
-                all_files.append(os.path.join(root, file))
-        
-        # Get all file paths from database
-        from models import WorkOrder, WorkOrderComment
-        db_files = set()
-        
-        # Work order files
-        work_orders = WorkOrder.query.all()
-        for wo in work_orders:
-            if wo.images:
-                db_files.update(wo.images.split(','))
-            if wo.videos:
-                db_files.update(wo.videos.split(','))
-            if wo.voice_notes:
-                db_files.update(wo.voice_notes.split(','))
-        
-        # Comment files
-        comments = WorkOrderComment.query.all()
-        for comment in comments:
-            if comment.images:
-                db_files.update(comment.images.split(','))
-            if comment.videos:
-                db_files.update(comment.videos.split(','))
-            if comment.voice_notes:
-                db_files.update(comment.voice_notes.split(','))
-        
-        # Find orphaned files
-        orphaned_files = []
-        for file_path in all_files:
-            relative_path = os.path.relpath(file_path, app.static_folder or '')
-            if relative_path not in db_files:
-                orphaned_files.append(file_path)
-        
-        # Delete orphaned files
-        for file_path in orphaned_files:
-            try:
-                os.remove(file_path)
-                print(f"Deleted orphaned file: {file_path}")
-            except Exception as e:
-                print(f"Error deleting orphaned file {file_path}: {e}")
-        
-        print(f"Cleaned up {len(orphaned_files)} orphaned files")
+        # Media rows of work orders or comments deleted without detaching it
+        delete_files(detach_orphans())
+        db.session.commit()
+        removed = media_store.collect_garbage(scan=scan)
+        print(f"Cleaned up {removed} orphaned files")
     except Exception as e:
+        db.session.rollback()
         print(f"Error in cleanup_orphaned_files: {e}")
 
 if __name__ == '__main__':
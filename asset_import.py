@@ -0,0 +1,370 @@
+"""
+Bulk asset import for the Quick Asset Registry.
+
+Reads the registry template (CSV, or XLSX when openpyxl is installed) as a
+stream, validates rows in chunks and writes the valid equipment and
+inventory rows with batched inserts (``COPY`` on PostgreSQL, see
+bulk_load.py).  Category, location and department names are resolved to the
+company's records through lookup maps built once per import, and duplicate
+asset tags / part numbers are checked with one query per chunk, so a 20k
+row onboarding file costs a few dozen queries.
+
+Every rejected row is reported with its line number and reasons; valid rows
+are imported in a single transaction (or only validated with ``dry_run``).
+"""
+import io
+import csv
+import math
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import select
+
+from extensions import db
+from models import Equipment, Inventory, Category, Location, Department
+from bulk_load import bulk_insert
+
+# Template header -> field name; a few common spellings are accepted as well
+COLUMNS = {
+    'type': 'type',
+    'asset type': 'type',
+    'name': 'name',
+    'id/part number': 'identifier',
+    'identifier': 'identifier',
+    'equipment id': 'identifier',
+    'part number': 'identifier',
+    'category': 'category',
+    'location': 'location',
+    'department': 'department',
+    'status': 'status',
+    'manufacturer': 'manufacturer',
+    'model': 'model',
+    'serial number': 'serial_number',
+    'criticality': 'criticality',
+    'current stock': 'current_stock',
+    'minimum stock': 'minimum_stock',
+    'unit cost': 'unit_cost',
+    'unit of measure': 'unit_of_measure',
+    'description': 'description',
+}
+
+EQUIPMENT_STATUSES = ('operational', 'maintenance', 'offline', 'out_of_service')
+CRITICALITIES = ('low', 'medium', 'high', 'critical')
+INVENTORY_STATUSES = {'active': True, 'inactive': False}
+
+INTEGER_MAX = 2 ** 31 - 1  # db.Integer is a 32-bit INTEGER on PostgreSQL
+
+# Column -> label used in problem reports
+FIELD_LABELS = {
+    'name': 'Name',
+    'equipment_id': 'ID/Part Number',
+    'part_number': 'ID/Part Number',
+    'category': 'Category',
+    'manufacturer': 'Manufacturer',
+    'model': 'Model',
+    'serial_number': 'Serial Number',
+    'location': 'Location',
+    'department': 'Department',
+    'unit_of_measure': 'Unit of Measure',
+}
+
+
+class ImportFileError(ValueError):
+    """The uploaded file cannot be read at all"""
+
+
+def read_rows(file_storage) -> Iterator[Tuple[int, Dict[str, str]]]:
+    """Yield ``(line_number, row)`` pairs from an uploaded CSV or XLSX file"""
+    filename = (file_storage.filename or '').lower()
+    if filename.endswith('.xlsx'):
+        rows = _xlsx_rows(file_storage.stream)
+    elif filename.endswith('.csv') or not filename:
+        rows = csv.reader(io.TextIOWrapper(file_storage.stream, encoding='utf-8-sig', newline=''))
+    else:
+        raise ImportFileError('Unsupported file type; upload a .csv or .xlsx file.')
+
+    header = next(rows, None)
+    if not header:
+        raise ImportFileError('The file is empty.')
+    fields = [COLUMNS.get(str(column or '').strip().lower()) for column in header]
+    if 'name' not in fields or 'identifier' not in fields:
+        raise ImportFileError('The header must contain at least the "Name" and "ID/Part Number" columns.')
+
+    for line_number, values in enumerate(rows, start=2):
+        row = {field: ('' if value is None else str(value)).strip()
+               for field, value in zip(fields, values) if field}
+        if any(row.values()):
+            yield line_number, row
+
+
+def _xlsx_rows(stream):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ImportFileError('XLSX import requires the openpyxl package; upload a CSV file instead.')
+    # Read-only mode streams the sheet XML instead of building the whole workbook
+    workbook = load_workbook(stream, read_only=True, data_only=True)
+    try:
+        for values in workbook.active.iter_rows(values_only=True):
+            yield [_cell_text(value) for value in values]
+    finally:
+        workbook.close()
+
+
+def _cell_text(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return value
+
+
+class AssetImporter:
+    def __init__(self, company_id: int, user_id: int, default_type: Optional[str] = None, chunk_size: int = 1000):
+        self.company_id = company_id
+        self.user_id = user_id
+        self.default_type = default_type
+        self.chunk_size = chunk_size
+        self.errors: List[Dict[str, Any]] = []
+        self.created = {'equipment': 0, 'inventory': 0}
+        self.rows_read = 0
+        self._seen = {'equipment': set(), 'inventory': set()}
+        self._load_lookups()
+
+    def _load_lookups(self):
+        """Name -> record maps for the company, built once per import"""
+        self.categories = {'equipment': {}, 'inventory': {}}
+        for name, category_type in db.session.execute(
+                select(Category.name, Category.type).where(Category.company_id == self.company_id,
+                                                          Category.is_active == True)):
+            self.categories.setdefault(category_type, {})[name.lower()] = name
+        self.locations = {name.lower(): (location_id, name) for location_id, name in db.session.execute(
+            select(Location.id, Location.name).where(Location.company_id == self.company_id))}
+        self.departments = {name.lower(): (department_id, name) for department_id, name in db.session.execute(
+            select(Department.id, Department.name).where(Department.company_id == self.company_id))}
+
+    def run(self, rows: Iterator[Tuple[int, Dict[str, str]]], dry_run: bool = False) -> Dict[str, Any]:
+        """Validate and insert all rows; returns the import report"""
+        rows = iter(rows)
+        try:
+            while True:
+                chunk = list(islice(rows, self.chunk_size))
+                if not chunk:
+                    break
+                self.rows_read += len(chunk)
+                equipment_rows, inventory_rows = self._validate_chunk(chunk)
+                if not dry_run:
+                    self.created['equipment'] += bulk_insert(Equipment, equipment_rows, self.chunk_size)
+                    self.created['inventory'] += bulk_insert(Inventory, inventory_rows, self.chunk_size)
+                else:
+                    self.created['equipment'] += len(equipment_rows)
+                    self.created['inventory'] += len(inventory_rows)
+            if dry_run:
+                db.session.rollback()
+            else:
+                db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return self.report(dry_run)
+
+    def report(self, dry_run: bool = False) -> Dict[str, Any]:
+        return {
+            'dry_run': dry_run,
+            'rows_read': self.rows_read,
+            'equipment_created': self.created['equipment'],
+            'inventory_created': self.created['inventory'],
+            'rejected': len(self.errors),
+            'errors': self.errors,
+        }
+
+    def _validate_chunk(self, chunk) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        # One query per asset type for identifiers that already exist (they are globally unique)
+        identifiers = {'equipment': set(), 'inventory': set()}
+        for _, row in chunk:
+            asset_type = self._asset_type(row)
+            if asset_type in identifiers and row.get('identifier'):
+                identifiers[asset_type].add(row['identifier'])
+        existing = {
+            'equipment': self._existing(Equipment.equipment_id, identifiers['equipment']),
+            'inventory': self._existing(Inventory.part_number, identifiers['inventory']),
+        }
+
+        now = datetime.utcnow()
+        equipment_rows, inventory_rows = [], []
+        for line_number, row in chunk:
+            problems = []
+            asset_type = self._asset_type(row)
+            if asset_type not in ('equipment', 'inventory'):
+                problems.append('Type must be "Equipment" or "Inventory"')
+                self._reject(line_number, row, problems)
+                continue
+
+            name = row.get('name', '')
+            identifier = row.get('identifier', '')
+            if not name:
+                problems.append('Name is required')
+            if not identifier:
+                problems.append('ID/Part Number is required')
+            elif identifier in existing[asset_type]:
+                problems.append(f'{identifier} already exists')
+            elif identifier in self._seen[asset_type]:
+                problems.append(f'{identifier} appears more than once in the file')
+
+            if asset_type == 'equipment':
+                record = self._equipment_row(row, problems, now)
+                self._check_lengths(Equipment, record, problems)
+            else:
+                record = self._inventory_row(row, problems, now)
+                self._check_lengths(Inventory, record, problems)
+
+            if problems:
+                self._reject(line_number, row, problems)
+                continue
+            self._seen[asset_type].add(identifier)
+            (equipment_rows if asset_type == 'equipment' else inventory_rows).append(record)
+        return equipment_rows, inventory_rows
+
+    def _equipment_row(self, row, problems, now) -> Dict[str, Any]:
+        category = self._category('equipment', row.get('category', ''), problems, required=True)
+        location_id, location = self._lookup(self.locations, row.get('location', ''), 'location', problems)
+        department_id, department = self._lookup(self.departments, row.get('department', ''), 'department', problems)
+        status = self._choice(row.get('status', ''), EQUIPMENT_STATUSES, 'operational', 'Status', problems)
+        criticality = self._choice(row.get('criticality', ''), CRITICALITIES, 'medium', 'Criticality', problems)
+        return {
+            'company_id': self.company_id,
+            'name': row.get('name', ''),
+            'equipment_id': row.get('identifier', ''),
+            'category': category,
+            'manufacturer': row.get('manufacturer') or None,
+            'model': row.get('model') or None,
+            'serial_number': row.get('serial_number') or None,
+            'location': location,
+            'location_id': location_id,
+            'department': department,
+            'department_id': department_id,
+            'status': status,
+            'criticality': criticality,
+            'description': row.get('description') or None,
+            'created_by_id': self.user_id,
+            'created_at': now,
+            'updated_at': now,
+        }
+
+    def _inventory_row(self, row, problems, now) -> Dict[str, Any]:
+        category = self._category('inventory', row.get('category', ''), problems, required=False)
+        _, location = self._lookup(self.locations, row.get('location', ''), 'location', problems)
+        status = row.get('status', '').lower()
+        if status and status not in INVENTORY_STATUSES:
+            problems.append('Status must be "Active" or "Inactive"')
+        return {
+            'company_id': self.company_id,
+            'name': row.get('name', ''),
+            'part_number': row.get('identifier', ''),
+            'category': category,
+            'location': location,
+            'description': row.get('description') or None,
+            'current_stock': self._integer(row.get('current_stock', ''), 'Current Stock', problems),
+            'minimum_stock': self._integer(row.get('minimum_stock', ''), 'Minimum Stock', problems),
+            'unit_cost': self._decimal(row.get('unit_cost', ''), 'Unit Cost', Inventory.__table__.c.unit_cost, problems),
+            'currency': 'USD',
+            'unit_of_measure': row.get('unit_of_measure') or 'pieces',
+            'is_active': INVENTORY_STATUSES.get(status, True),
+            'created_at': now,
+            'updated_at': now,
+        }
+
+    def _asset_type(self, row) -> str:
+        return (row.get('type') or self.default_type or '').strip().lower()
+
+    def _existing(self, column, identifiers) -> set:
+        if not identifiers:
+            return set()
+        return set(db.session.execute(select(column).where(column.in_(identifiers))).scalars())
+
+    def _category(self, asset_type, name, problems, required) -> Optional[str]:
+        if not name:
+            if required:
+                problems.append('Category is required')
+            return None
+        category = self.categories.get(asset_type, {}).get(name.lower())
+        if category is None:
+            problems.append(f'Unknown {asset_type} category "{name}"')
+        return category
+
+    @staticmethod
+    def _lookup(mapping, name, label, problems) -> Tuple[Optional[int], Optional[str]]:
+        if not name:
+            return None, None
+        match = mapping.get(name.lower())
+        if match is None:
+            problems.append(f'Unknown {label} "{name}"')
+            return None, None
+        return match
+
+    @staticmethod
+    def _check_lengths(model, record, problems):
+        # An over-long value would abort the whole COPY / INSERT on PostgreSQL, not just its row
+        columns = model.__table__.c
+        for field, value in record.items():
+            if not isinstance(value, str) or field not in columns:
+                continue
+            length = getattr(columns[field].type, 'length', None)
+            if length is not None and len(value) > length:
+                problems.append(f'{FIELD_LABELS.get(field, field)} must be at most {length} characters')
+
+    @staticmethod
+    def _choice(value, allowed, default, label, problems) -> str:
+        if not value:
+            return default
+        normalized = value.strip().lower().replace(' ', '_')
+        if normalized not in allowed:
+            problems.append(f'{label} must be one of: {", ".join(allowed)}')
+        return normalized
+
+    @staticmethod
+    def _integer(value, label, problems) -> int:
+        if not value:
+            return 0
+        try:
+            number = float(value)
+        except ValueError:
+            problems.append(f'{label} must be a whole number')
+            return 0
+        if not math.isfinite(number):
+            problems.append(f'{label} must be a whole number')
+            return 0
+        if number < 0:
+            problems.append(f'{label} cannot be negative')
+        elif number > INTEGER_MAX:
+            problems.append(f'{label} must be at most {INTEGER_MAX}')
+            return 0
+        return int(number)
+
+    @staticmethod
+    def _decimal(value, label, column, problems) -> Optional[Decimal]:
+        if not value:
+            return None
+        # Numeric(precision, scale): at most precision - scale digits before the point
+        precision, scale = column.type.precision, column.type.scale
+        try:
+            number = Decimal(value)
+            if not number.is_finite():
+                raise InvalidOperation
+            limit = Decimal(10) ** (precision - scale)
+            # Checked before rounding too: quantize() fails on values far out of range
+            if abs(number) >= limit or abs(number.quantize(Decimal(1).scaleb(-scale))) >= limit:
+                problems.append(f'{label} must be less than {limit:,}')
+                return None
+            return number.quantize(Decimal(1).scaleb(-scale))
+        except InvalidOperation:
+            problems.append(f'{label} must be a number')
+            return None
+
+    def _reject(self, line_number, row, problems):
+        self.errors.append({
+            'row': line_number,
+            'identifier': row.get('identifier', ''),
+            'name': row.get('name', ''),
+            'errors': problems,
+        })
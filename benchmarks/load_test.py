@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+"""
+Headless load generator for the CMMS application.
+
+Logs in as many technicians and managers (one thread per virtual user) and
+replays realistic flows against either the app in-process (Flask test
+client) or a live deployment, then reports throughput and latency
+percentiles per flow.  Use it to size gunicorn workers and database pools.
+
+Technician flows: mobile dashboard, mobile task list, start/complete a task
+with a photo, offline sync, QR failure report.
+Manager flows: admin dashboard polling, admin dashboard, task logs, CSV export.
+
+Usage:
+    # In-process against a temporary SQLite tenant seeded on the fly
+    python benchmarks/load_test.py --technicians 10 --managers 2 --duration 30
+
+    # Live deployment seeded with `flask seed` (users c<id>.tech<n>@example.com)
+    python benchmarks/load_test.py --url https://cmms.example.com --company-id 3 --technicians 50 --managers 5
+
+    # Live deployment with explicit accounts (CSV columns: email,password,role)
+    python benchmarks/load_test.py --url http://localhost:5000 --users-file users.csv --duration 120
+"""
+import io
+import os
+import sys
+import csv
+import json
+import time
+import base64
+import random
+import argparse
+import tempfile
+import threading
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Replay technician and manager flows against the CMMS')
+    parser.add_argument('--url', help='Base URL of a live deployment (default: run the app in-process)')
+    parser.add_argument('--database-url', help='Database for in-process mode (default: temporary seeded SQLite)')
+    parser.add_argument('--company-id', type=int, help='Company seeded with `flask seed` whose accounts to use')
+    parser.add_argument('--users-file', help='CSV of email,password,role to log in with')
+    parser.add_argument('--password', default='password123', help='Password of seeded accounts')
+    parser.add_argument('--technicians', type=int, default=10, help='Concurrent technician users')
+    parser.add_argument('--managers', type=int, default=2, help='Concurrent manager users')
+    parser.add_argument('--duration', type=float, default=30, help='Test duration in seconds')
+    parser.add_argument('--ramp-up', type=float, default=5, help='Seconds over which users start')
+    parser.add_argument('--think-time', type=float, default=1.0, help='Mean pause between flows per user')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed so runs replay the same flow sequence')
+    parser.add_argument('--output', help='Also write the results as JSON to this file')
+    return parser.parse_args()
+
+
+# Transports -------------------------------------------------------------
+
+class HttpTransport:
+    """Talks to a live deployment with one cookie session per virtual user"""
+
+    def __init__(self, base_url):
+        import requests
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+
+    def get(self, path):
+        response = self.session.get(self.base_url + path, timeout=60)
+        return response.status_code, response.content, response.headers.get('Content-Type', '')
+
+    def post(self, path, data=None, files=None, json_body=None):
+        if files:
+            files = {name: (filename, content, mimetype) for name, (filename, content, mimetype) in files.items()}
+        response = self.session.post(self.base_url + path, data=data, files=files, json=json_body, timeout=60)
+        return response.status_code, response.content, response.headers.get('Content-Type', '')
+
+
+class TestClientTransport:
+    """Drives the app in-process through the Flask test client"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def get(self, path):
+        response = self.client.get(path, follow_redirects=True)
+        return response.status_code, response.get_data(), response.content_type or ''
+
+    def post(self, path, data=None, files=None, json_body=None):
+        if json_body is not None:
+            response = self.client.post(path, json=json_body, follow_redirects=True)
+        else:
+            payload = dict(data or {})
+            for name, (filename, content, mimetype) in (files or {}).items():
+                payload[name] = (io.BytesIO(content), filename, mimetype)
+            response = self.client.post(path, data=payload, content_type='multipart/form-data', follow_redirects=True)
+        return response.status_code, response.get_data(), response.content_type or ''
+
+
+# Virtual users ----------------------------------------------------------
+
+class FlowSkipped(Exception):
+    """The flow had nothing to do (e.g. no open tasks left)"""
+
+
+class VirtualUser:
+    def __init__(self, transport, email, password, role, rng, photo):
+        self.transport = transport
+        self.email = email
+        self.password = password
+        self.role = role
+        self.rng = rng
+        self.photo = photo
+
+    def check(self, result, expected_json=False):
+        status, body, content_type = result
+        if status >= 400:
+            raise RuntimeError(f'HTTP {status}')
+        if expected_json:
+            if 'json' not in content_type:
+                raise RuntimeError('expected JSON (session lost?)')
+            return json.loads(body)
+        return body
+
+    def login(self):
+        self.check(self.transport.post('/mobile/login', data={'email': self.email, 'password': self.password}))
+
+    def pick_task(self, statuses):
+        tasks = self.check(self.transport.get('/api/mobile/tasks'), expected_json=True)
+        candidates = [task for task in tasks if task['status'] in statuses]
+        if not candidates:
+            raise FlowSkipped()
+        return self.rng.choice(candidates)
+
+    # Technician flows
+
+    def mobile_dashboard(self):
+        self.check(self.transport.get('/mobile/dashboard'))
+
+    def mobile_tasks(self):
+        self.check(self.transport.get('/api/mobile/tasks'), expected_json=True)
+
+    def start_complete_task(self):
+        task = self.pick_task({'open', 'in_progress'})
+        if task['status'] == 'open':
+            self.check(self.transport.post(f"/mobile/task/{task['id']}/start"))
+        self.check(self.transport.post(
+            f"/mobile/task/{task['id']}/complete",
+            data={'completion_notes': 'Completed during load test'},
+            files={'proof_images': ('proof.jpg', self.photo, 'image/jpeg')},
+        ))
+
+    def offline_sync(self):
+        task = self.pick_task({'in_progress', 'open'})
+        encoded = base64.b64encode(self.photo).decode()
+        result = self.check(self.transport.post(
+            f"/api/work-orders/{task['id']}/sync-offline-data",
+            json_body={
+                'status': 'in_progress',
+                'completion_notes': 'Synced from offline queue',
+                'offline_media': [{'type': 'image', 'extension': 'jpg', 'file_data': f'data:image/jpeg;base64,{encoded}'}],
+            },
+        ), expected_json=True)
+        if not result.get('success'):
+            raise RuntimeError(result.get('message', 'sync failed'))
+
+    def qr_report(self):
+        task = self.pick_task({'open', 'in_progress', 'completed'})
+        detail = self.check(self.transport.get(f"/api/mobile/task/{task['id']}"), expected_json=True)
+        equipment = detail.get('equipment')
+        if not equipment:
+            raise FlowSkipped()
+        self.check(self.transport.get(f"/qr-report/{equipment['id']}"))
+        self.check(self.transport.post(
+            f"/qr-report/{equipment['id']}",
+            data={'description': 'Unusual noise reported during load test', 'failure_type': 'mechanical',
+                  'urgency': 'medium', 'reporter_name': self.email},
+            files={'images': ('failure.jpg', self.photo, 'image/jpeg')},
+        ))
+
+    # Manager flows
+
+    def admin_polling(self):
+        self.check(self.transport.get('/api/admin/dashboard-stats'), expected_json=True)
+        self.check(self.transport.get('/api/dashboard-stats'), expected_json=True)
+
+    def admin_dashboard(self):
+        self.check(self.transport.get('/admin'))
+
+    def task_logs(self):
+        self.check(self.transport.get('/reports/task-logs'))
+
+    def report_export(self):
+        self.check(self.transport.get('/reports/export/csv'))
+
+
+FLOW_MIX = {
+    'technician': [
+        ('mobile_dashboard', 35), ('mobile_tasks', 20), ('start_complete_task', 15),
+        ('offline_sync', 15), ('qr_report', 15),
+    ],
+    'manager': [
+        ('admin_polling', 60), ('admin_dashboard', 15), ('task_logs', 10), ('report_export', 15),
+    ],
+}
+
+
+class FlowStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.skipped = {}
+        self.error_samples = {}
+
+    def record(self, flow, seconds=None, error=None, skipped=False):
+        with self.lock:
+            if skipped:
+                self.skipped[flow] = self.skipped.get(flow, 0) + 1
+            elif error is not None:
+                self.errors[flow] = self.errors.get(flow, 0) + 1
+                self.error_samples.setdefault(flow, str(error))
+            else:
+                self.latencies.setdefault(flow, []).append(seconds * 1000)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def make_photo():
+    """A small JPEG comparable to a compressed phone photo"""
+    from PIL import Image
+    image = Image.effect_noise((640, 480), 40).convert('RGB')
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=80)
+    return buffer.getvalue()
+
+
+def run_user(user, stats, deadline, start_delay, think_time):
+    time.sleep(start_delay)
+    try:
+        user.login()
+    except Exception as e:
+        stats.record('login', error=e)
+        return
+    flows, weights = zip(*FLOW_MIX[user.role])
+    while time.time() < deadline:
+        flow = user.rng.choices(flows, weights=weights)[0]
+        started = time.perf_counter()
+        try:
+            getattr(user, flow)()
+            stats.record(flow, time.perf_counter() - started)
+        except FlowSkipped:
+            stats.record(flow, skipped=True)
+        except Exception as e:
+            stats.record(flow, error=e)
+        if think_time:
+            time.sleep(user.rng.expovariate(1.0 / think_time))
+
+
+def load_accounts(args, tenant=None):
+    """Return [(email, password, role)] for the requested number of users"""
+    if args.users_file:
+        with open(args.users_file, newline='') as users_file:
+            rows = [(row['email'], row['password'], row['role']) for row in csv.DictReader(users_file)]
+        technicians = [row for row in rows if row[2] == 'technician']
+        managers = [row for row in rows if row[2] in ('admin', 'manager')]
+    else:
+        company_id = tenant['company_id'] if tenant else args.company_id
+        if company_id is None:
+            sys.exit('--company-id or --users-file is required with --url')
+        technicians = [(f'c{company_id}.tech{i}@example.com', args.password, 'technician')
+                       for i in range(1, args.technicians + 1)]
+        managers = [(f'c{company_id}.manager@example.com', args.password, 'manager'),
+                    (f'c{company_id}.admin@example.com', args.password, 'manager')]
+    if not technicians and args.technicians or not managers and args.managers:
+        sys.exit('Not enough accounts for the requested technicians/managers')
+    accounts = [technicians[i % len(technicians)] for i in range(args.technicians)]
+    accounts += [(email, password, 'manager') for email, password, _ in
+                 (managers[i % len(managers)] for i in range(args.managers))]
+    return accounts
+
+
+def main():
+    args = parse_args()
+    tenant = None
+
+    if args.url:
+        make_transport = lambda: HttpTransport(args.url)
+    else:
+        if args.database_url:
+            os.environ['DATABASE_URL'] = args.database_url
+        else:
+            os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='cmms-load-'), 'load.db')}"
+        os.environ.setdefault('SECRET_KEY', 'load-test-secret-key')
+        os.environ.setdefault('MAIL_DEFAULT_SENDER', 'load-test@example.com')
+        from app import app, db
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        # Flask-Mail captured its settings at import; never send notification mail from a load test
+        app.extensions['mail'].suppress = True
+        if not args.company_id and not args.users_file:
+            from seed_data import TenantSeeder
+            with app.app_context():
+                db.create_all()
+                print('Seeding tenant for in-process run...')
+                tenant = TenantSeeder(seed=args.seed).seed_company(
+                    f'Load Test {int(time.time())}',
+                    {'technicians': max(args.technicians, 1), 'work_orders': 50 * max(args.technicians, 1)})
+        make_transport = lambda: TestClientTransport(app)
+
+    accounts = load_accounts(args, tenant)
+    photo = make_photo()
+    stats = FlowStats()
+    users = [VirtualUser(make_transport(), email, password, role, random.Random(args.seed * 1000 + index), photo)
+             for index, (email, password, role) in enumerate(accounts)]
+
+    print(f"Running {len(users)} users ({args.technicians} technicians, {args.managers} managers) "
+          f"for {args.duration:.0f}s against {args.url or 'in-process app'}...")
+    started = time.time()
+    deadline = started + args.ramp_up + args.duration
+    with ThreadPoolExecutor(max_workers=len(users)) as pool:
+        for index, user in enumerate(users):
+            pool.submit(run_user, user, stats, deadline, args.ramp_up * index / max(len(users), 1), args.think_time)
+    elapsed = time.time() - started
+
+    results = {}
+    flows = sorted(set(stats.latencies) | set(stats.errors) | set(stats.skipped))
+    print()
+    print(f"{'flow':<22}{'ok':>7}{'err':>6}{'skip':>6}{'per s':>8}{'p50 ms':>9}{'p90 ms':>9}"
+          f"{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    for flow in flows:
+        latencies = stats.latencies.get(flow, [])
+        result = {
+            'ok': len(latencies),
+            'errors': stats.errors.get(flow, 0),
+            'skipped': stats.skipped.get(flow, 0),
+            'throughput_per_s': round(len(latencies) / elapsed, 2),
+        }
+        if latencies:
+            result.update({
+                'p50_ms': round(statistics.median(latencies), 1),
+                'p90_ms': round(percentile(latencies, 0.90), 1),
+                'p95_ms': round(percentile(latencies, 0.95), 1),
+                'p99_ms': round(percentile(latencies, 0.99), 1),
+                'max_ms': round(max(latencies), 1),
+            })
+        results[flow] = result
+        print(f"{flow:<22}{result['ok']:>7}{result['errors']:>6}{result['skipped']:>6}"
+              f"{result['throughput_per_s']:>8}{result.get('p50_ms', '-'):>9}{result.get('p90_ms', '-'):>9}"
+              f"{result.get('p95_ms', '-'):>9}{result.get('p99_ms', '-'):>9}{result.get('max_ms', '-'):>9}")
+
+    total_ok = sum(result['ok'] for result in results.values())
+    print(f"\nTotal: {total_ok} flows in {elapsed:.1f}s ({total_ok / elapsed:.1f} flows/s)")
+    for flow, sample in stats.error_samples.items():
+        print(f"  first error in {flow}: {sample}")
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump({'users': len(users), 'duration_s': round(elapsed, 1), 'flows': results}, output_file, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,285 @@
+"""
+Windowed calendar events for the maintenance calendar and dashboard.
+
+``GET /api/calendar-events?start=...&end=...`` (the parameters FullCalendar
+sends for the visible range) returns only what falls inside the window:
+
+* work orders are selected by ``(company_id, scheduled_date)`` range with
+  their equipment and team names joined in, instead of loading every
+  scheduled work order ever created and lazy loading the names per row;
+* maintenance schedules are expanded into virtual occurrences for the
+  window only (see recurrence.py), so a weekly schedule shows every week
+  rather than just its ``next_due``.
+
+The serialized JSON is cached in-process per ``(company, user scope,
+window)``.  Each request first asks the database for a cheap fingerprint
+of the scope (row count and latest ``updated_at`` of the work orders and
+schedules in it); a cached payload is served only while its fingerprint
+still matches, so every worker sees changes on the next request, and
+``CALENDAR_CACHE_TTL`` (seconds, default 300) bounds staleness of joined
+names (equipment, teams, SOPs) that do not touch the fingerprint.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, FrozenSet, Iterator, List, Optional, Tuple
+
+from flask import url_for
+from sqlalchemy import false, func, or_, select, true
+
+from extensions import db
+from identity import current_identity, team_ids_for
+from metrics import metrics
+from models import WorkOrder, MaintenanceSchedule, Equipment, Team, SOP
+from recurrence import RecurrenceError, RecurrenceRule
+
+MAX_WINDOW = timedelta(days=400)
+DESCRIPTION_LENGTH = 200
+
+
+class CalendarWindowError(ValueError):
+    """Invalid or too large ``start``/``end`` window"""
+
+
+class CalendarScope:
+    """Whose events a calendar shows: a whole company (no user or teams), a user and their teams, or teams"""
+
+    def __init__(self, company_id: int, user_id: Optional[int] = None, team_ids: FrozenSet[int] = frozenset()):
+        self.company_id = company_id
+        self.user_id = user_id
+        self.team_ids = frozenset(team_ids)
+
+    @property
+    def key(self) -> Tuple:
+        return self.company_id, self.user_id, tuple(sorted(self.team_ids))
+
+    @property
+    def company_wide(self) -> bool:
+        return self.user_id is None and not self.team_ids
+
+    def work_order_filters(self) -> List:
+        filters = [WorkOrder.company_id == self.company_id]
+        if not self.company_wide:
+            assigned = []
+            if self.user_id is not None:
+                assigned.append(WorkOrder.assigned_technician_id == self.user_id)
+            if self.team_ids:
+                assigned.append(WorkOrder.assigned_team_id.in_(sorted(self.team_ids)))
+            filters.append(or_(*assigned))
+        return filters
+
+    def schedule_filters(self) -> List:
+        filters = [MaintenanceSchedule.company_id == self.company_id,
+                   MaintenanceSchedule.is_active == True,
+                   MaintenanceSchedule.next_due != None]
+        if not self.company_wide:
+            if self.team_ids:
+                filters.append(MaintenanceSchedule.assigned_team_id.in_(sorted(self.team_ids)))
+            else:
+                filters.append(false())
+        return filters
+
+
+def scope_for(user) -> CalendarScope:
+    """Technicians see their own and their teams' assignments, everyone else the whole company"""
+    if user.role != 'technician':
+        return CalendarScope(user.company_id)
+    identity = current_identity()
+    if identity is not None and identity.user_id == user.id:
+        return CalendarScope(user.company_id, user.id, identity.team_ids)
+    return CalendarScope(user.company_id, user.id, frozenset(team_ids_for(user)))
+
+
+def parse_window(start: Optional[str], end: Optional[str], today: Optional[date] = None) -> Tuple[datetime, datetime]:
+    """``[start, end)`` from ISO dates/datetimes (offsets are dropped: stored times are wall times);
+    defaults to the current month"""
+    try:
+        window_start = _parse_moment(start)
+        window_end = _parse_moment(end)
+    except ValueError:
+        raise CalendarWindowError('start and end must be ISO 8601 dates')
+    if window_start is None:
+        today = today or date.today()
+        window_start = datetime(today.year, today.month, 1)
+    if window_end is None:
+        year, month = divmod(window_start.year * 12 + window_start.month, 12)
+        window_end = datetime(year, month + 1, 1)
+    if window_end <= window_start:
+        raise CalendarWindowError('end must be after start')
+    if window_end - window_start > MAX_WINDOW:
+        raise CalendarWindowError(f'The window cannot exceed {MAX_WINDOW.days} days')
+    return window_start, window_end
+
+
+def _parse_moment(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    # A "+" in the offset arrives as a space when the client does not encode it
+    return datetime.fromisoformat(value.strip().replace(' ', '+').replace('Z', '+00:00')).replace(tzinfo=None)
+
+
+def fingerprint(scope: CalendarScope, window_start: Optional[datetime] = None,
+                window_end: Optional[datetime] = None) -> Tuple[str, Optional[datetime]]:
+    """Digest of the rows in scope (count and latest update of work orders and schedules) and that
+    latest update, in one query"""
+    work_orders = select(func.count().label('n'), func.max(WorkOrder.updated_at).label('latest')).where(
+        *scope.work_order_filters(), WorkOrder.scheduled_date != None)
+    if window_start is not None:
+        work_orders = work_orders.where(WorkOrder.scheduled_date >= window_start,
+                                        WorkOrder.scheduled_date < window_end)
+    schedules = select(func.count().label('n'), func.max(MaintenanceSchedule.updated_at).label('latest')).where(
+        *scope.schedule_filters())
+    if window_end is not None:
+        schedules = schedules.where(MaintenanceSchedule.next_due < window_end)
+    work_orders, schedules = work_orders.subquery(), schedules.subquery()
+    row = db.session.execute(
+        select(work_orders.c.n, work_orders.c.latest, schedules.c.n, schedules.c.latest)
+        .select_from(work_orders.join(schedules, true()))
+    ).one()
+    last_modified = max((latest for latest in (row[1], row[3]) if latest is not None), default=None)
+    return hashlib.sha1(repr(tuple(row)).encode()).hexdigest(), last_modified
+
+
+def work_order_rows(scope: CalendarScope, window_start: Optional[datetime] = None,
+                    window_end: Optional[datetime] = None):
+    """Scheduled work orders in scope (and window) with equipment and team names, as column rows"""
+    query = (select(WorkOrder.id, WorkOrder.work_order_number, WorkOrder.title, WorkOrder.description,
+                    WorkOrder.status, WorkOrder.scheduled_date, WorkOrder.estimated_duration,
+                    WorkOrder.updated_at, Equipment.name.label('equipment_name'), Team.name.label('team_name'))
+             .outerjoin(Equipment, Equipment.id == WorkOrder.equipment_id)
+             .outerjoin(Team, Team.id == WorkOrder.assigned_team_id)
+             .where(*scope.work_order_filters(), WorkOrder.scheduled_date != None)
+             .order_by(WorkOrder.scheduled_date, WorkOrder.id)
+             .execution_options(yield_per=500))
+    if window_start is not None:
+        query = query.where(WorkOrder.scheduled_date >= window_start, WorkOrder.scheduled_date < window_end)
+    return db.session.execute(query)
+
+
+def schedule_rows(scope: CalendarScope, window_end: Optional[datetime] = None):
+    """Active schedules in scope due before ``window_end`` with equipment, team and SOP names"""
+    query = (select(MaintenanceSchedule.id, MaintenanceSchedule.equipment_id, MaintenanceSchedule.description,
+                    MaintenanceSchedule.frequency, MaintenanceSchedule.frequency_value,
+                    MaintenanceSchedule.recurrence_options, MaintenanceSchedule.next_due,
+                    MaintenanceSchedule.estimated_duration, MaintenanceSchedule.updated_at,
+                    Equipment.name.label('equipment_name'), Team.name.label('team_name'),
+                    SOP.name.label('sop_name'))
+             .outerjoin(Equipment, Equipment.id == MaintenanceSchedule.equipment_id)
+             .outerjoin(Team, Team.id == MaintenanceSchedule.assigned_team_id)
+             .outerjoin(SOP, SOP.id == MaintenanceSchedule.sop_id)
+             .where(*scope.schedule_filters())
+             .order_by(MaintenanceSchedule.next_due, MaintenanceSchedule.id)
+             .execution_options(yield_per=500))
+    if window_end is not None:
+        query = query.where(MaintenanceSchedule.next_due < window_end)
+    return db.session.execute(query)
+
+
+def schedule_occurrences(row, window_start: datetime, window_end: datetime) -> Iterator[datetime]:
+    """Occurrences of a schedule row in ``[window_start, window_end)``"""
+    try:
+        rule = RecurrenceRule.from_options(row.frequency, row.frequency_value, row.recurrence_options)
+    except RecurrenceError:
+        # Invalid rule: only the stored next due date is known
+        if window_start <= row.next_due < window_end:
+            yield row.next_due
+        return
+    yield from rule.occurrences(row.next_due, window_start, window_end - timedelta(microseconds=1))
+
+
+def _summary(text: Optional[str]) -> str:
+    text = text or ''
+    return text if len(text) <= DESCRIPTION_LENGTH else text[:DESCRIPTION_LENGTH - 1] + '…'
+
+
+def build_events(scope: CalendarScope, window_start: datetime, window_end: datetime) -> List[Dict[str, Any]]:
+    """FullCalendar events for the scope and window"""
+    events = []
+    for row in work_order_rows(scope, window_start, window_end):
+        events.append({
+            'id': f'wo-{row.id}',
+            'title': f'WO: {row.title}',
+            'start': row.scheduled_date.isoformat(),
+            'end': (row.scheduled_date + timedelta(minutes=row.estimated_duration or 120)).isoformat(),
+            'url': url_for('work_order_detail', id=row.id),
+            'type': 'work_order',
+            'status': row.status,
+            'equipment': row.equipment_name or 'N/A',
+            'assigned_team': row.team_name,
+            'description': _summary(row.description),
+        })
+    for row in schedule_rows(scope, window_end):
+        url = url_for('equipment_detail', id=row.equipment_id)
+        for occurrence in schedule_occurrences(row, window_start, window_end):
+            events.append({
+                'id': f'ms-{row.id}-{occurrence:%Y%m%d%H%M}',
+                'title': f'Maintenance: {row.equipment_name or "Unknown"}',
+                'start': occurrence.isoformat(),
+                'end': (occurrence + timedelta(minutes=row.estimated_duration or 60)).isoformat(),
+                'url': url,
+                'type': 'maintenance',
+                'equipment': row.equipment_name or 'Unknown',
+                'assigned_team': row.team_name,
+                'sop_name': row.sop_name,
+                'description': _summary(row.description),
+            })
+    return events
+
+
+class CalendarCache:
+    def __init__(self, app=None):
+        self.ttl = 300.0
+        self.max_entries = 512
+        self._entries: 'OrderedDict[Tuple, Tuple[float, str, Any]]' = OrderedDict()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('CALENDAR_CACHE_TTL', float(os.getenv('CALENDAR_CACHE_TTL', '300')))
+        app.config.setdefault('CALENDAR_CACHE_SIZE', int(os.getenv('CALENDAR_CACHE_SIZE', '512')))
+        self.ttl = float(app.config['CALENDAR_CACHE_TTL'])
+        self.max_entries = int(app.config['CALENDAR_CACHE_SIZE'])
+        app.extensions['calendar_cache'] = self
+
+    def get(self, cache: str, key: Tuple, version: str) -> Optional[Any]:
+        """The cached value for ``key`` if it was stored for ``version`` and has not expired"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get((cache, key))
+            hit = entry is not None and entry[0] > now and entry[1] == version
+            if hit:
+                self._entries.move_to_end((cache, key))
+        metrics.record_cache(cache, hit)
+        return entry[2] if hit else None
+
+    def put(self, cache: str, key: Tuple, version: str, value: Any):
+        if self.ttl <= 0 or self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[(cache, key)] = (time.monotonic() + self.ttl, version, value)
+            self._entries.move_to_end((cache, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+calendar_cache = CalendarCache()
+
+
+def calendar_events_json(scope: CalendarScope, window_start: datetime, window_end: datetime) -> Tuple[str, str]:
+    """``(json, version)`` for the window, served from the cache while the scope is unchanged"""
+    version, _ = fingerprint(scope, window_start, window_end)
+    key = scope.key + (window_start, window_end)
+    payload = calendar_cache.get('calendar_events', key, version)
+    if payload is None:
+        payload = json.dumps(build_events(scope, window_start, window_end), separators=(',', ':'))
+        calendar_cache.put('calendar_events', key, version, payload)
+    return payload, version
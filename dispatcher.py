@@ -0,0 +1,160 @@
+"""
+Load-aware technician dispatch.
+
+A technician's workload is the priority-weighted count of their open work
+orders (open, in progress, on hold) -- finished history does not count.
+The workload is one ``GROUP BY`` over the ``(company_id, status,
+assigned_technician_id, priority)`` index, so it never touches the table
+itself, and ``Dispatcher.choose`` joins it to the company's active
+technicians and ranks them in a single query:
+
+    score = workload + DISPATCH_DISTANCE_WEIGHT * distance_km
+
+Distance is between the technician's home location (``User.location_id``)
+and the job's location: 0 for the same location, an approximate (Manhattan)
+distance from the coordinates otherwise, and
+``DISPATCH_UNKNOWN_DISTANCE_KM`` when either side has no coordinates.
+With a team, only that team's members are candidates.
+
+``Dispatcher.plan`` assigns many jobs at once (PM generation): it loads the
+candidates once per company and updates their workload in memory as it
+assigns, so a batch is spread instead of piling onto one technician.
+"""
+import math
+import os
+from typing import Dict, List, Optional, Sequence
+
+from sqlalchemy import and_, case, func, literal, select
+
+from extensions import db
+from models import User, WorkOrder, Location, user_teams
+
+OPEN_STATUSES = ('open', 'in_progress', 'on_hold')
+PRIORITY_WEIGHTS = {'low': 1, 'medium': 2, 'high': 3, 'urgent': 5}
+KM_PER_DEGREE = 111.32
+
+
+class DispatchJob:
+    """What the dispatcher needs to know about a work order to assign it"""
+
+    def __init__(self, priority: str = 'medium', location: Optional[Location] = None, team_id: Optional[int] = None):
+        self.priority = priority
+        self.location = location
+        self.team_id = team_id
+
+
+class Dispatcher:
+    def __init__(self, app=None):
+        self.distance_weight = 0.05
+        self.unknown_distance_km = 25.0
+        self.weight_by_priority = True
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('DISPATCH_DISTANCE_WEIGHT', float(os.getenv('DISPATCH_DISTANCE_WEIGHT', '0.05')))
+        app.config.setdefault('DISPATCH_UNKNOWN_DISTANCE_KM', float(os.getenv('DISPATCH_UNKNOWN_DISTANCE_KM', '25')))
+        app.config.setdefault('DISPATCH_WEIGHT_BY_PRIORITY',
+                              os.getenv('DISPATCH_WEIGHT_BY_PRIORITY', 'true').lower() in ('1', 'true', 'yes'))
+        self.distance_weight = float(app.config['DISPATCH_DISTANCE_WEIGHT'])
+        self.unknown_distance_km = float(app.config['DISPATCH_UNKNOWN_DISTANCE_KM'])
+        self.weight_by_priority = bool(app.config['DISPATCH_WEIGHT_BY_PRIORITY'])
+        app.extensions['dispatcher'] = self
+
+    # -- workload -------------------------------------------------------------
+
+    def job_weight(self, priority: Optional[str]) -> int:
+        return PRIORITY_WEIGHTS.get(priority or 'medium', 2) if self.weight_by_priority else 1
+
+    def workload(self, company_id: int):
+        """Open workload per technician: ``(technician_id, load)`` subquery"""
+        if self.weight_by_priority:
+            weight = case(PRIORITY_WEIGHTS, value=WorkOrder.priority, else_=PRIORITY_WEIGHTS['medium'])
+            load = func.sum(weight)
+        else:
+            load = func.count()
+        return (select(WorkOrder.assigned_technician_id.label('technician_id'), load.label('load'))
+                .where(WorkOrder.company_id == company_id,
+                       WorkOrder.status.in_(OPEN_STATUSES),
+                       WorkOrder.assigned_technician_id != None)
+                .group_by(WorkOrder.assigned_technician_id)
+                .subquery('workload'))
+
+    def workloads(self, company_id: int) -> Dict[int, int]:
+        """``{technician_id: load}`` for technicians with open work"""
+        workload = self.workload(company_id)
+        return dict(db.session.execute(select(workload.c.technician_id, workload.c.load)).all())
+
+    # -- selection ------------------------------------------------------------
+
+    def _candidates(self, company_id: int, team_id: Optional[int] = None):
+        """Active technicians (of the team) with their open workload and home coordinates, and the load column"""
+        workload = self.workload(company_id)
+        load = func.coalesce(workload.c.load, 0)
+        query = (select(User.id, load.label('load'), User.location_id, Location.latitude, Location.longitude)
+                 .outerjoin(workload, workload.c.technician_id == User.id)
+                 .outerjoin(Location, Location.id == User.location_id)
+                 .where(User.company_id == company_id, User.role == 'technician', User.is_active == True))
+        if team_id is not None:
+            query = query.join(user_teams, and_(user_teams.c.user_id == User.id, user_teams.c.team_id == team_id))
+        return query, load
+
+    def _distance_sql(self, location: Optional[Location]):
+        if location is None:
+            return literal(0.0)
+        same = User.location_id == location.id
+        if location.latitude is None or location.longitude is None:
+            return case((same, 0.0), else_=self.unknown_distance_km)
+        cos_lat = math.cos(math.radians(location.latitude))
+        approximate = KM_PER_DEGREE * (func.abs(Location.latitude - location.latitude) +
+                                       func.abs(Location.longitude - location.longitude) * cos_lat)
+        return case((same, 0.0),
+                    (and_(Location.latitude != None, Location.longitude != None), approximate),
+                    else_=self.unknown_distance_km)
+
+    def _distance(self, location: Optional[Location], location_id, latitude, longitude) -> float:
+        if location is None or location_id == location.id:
+            return 0.0
+        if None in (location.latitude, location.longitude, latitude, longitude):
+            return self.unknown_distance_km
+        cos_lat = math.cos(math.radians(location.latitude))
+        return KM_PER_DEGREE * (abs(latitude - location.latitude) + abs(longitude - location.longitude) * cos_lat)
+
+    def choose(self, company_id: int, location: Optional[Location] = None, team_id: Optional[int] = None) -> Optional[int]:
+        """Id of the best technician for a new job in one query, or None when nobody qualifies"""
+        query, load = self._candidates(company_id, team_id)
+        score = load + self.distance_weight * self._distance_sql(location)
+        row = db.session.execute(
+            query.with_only_columns(User.id).order_by(score, User.id).limit(1)
+        ).first()
+        return row[0] if row else None
+
+    def plan(self, company_id: int, jobs: Sequence[DispatchJob]) -> List[Optional[int]]:
+        """Technician id (or None) per job, balancing the workload across the whole batch"""
+        if not jobs:
+            return []
+        technicians = {row.id: [row.load, row.location_id, row.latitude, row.longitude]
+                       for row in db.session.execute(self._candidates(company_id)[0])}
+        team_ids = {job.team_id for job in jobs if job.team_id is not None}
+        members: Dict[int, List[int]] = {}
+        if team_ids and technicians:
+            for team_id, user_id in db.session.execute(
+                    select(user_teams.c.team_id, user_teams.c.user_id)
+                    .where(user_teams.c.team_id.in_(team_ids), user_teams.c.user_id.in_(list(technicians)))):
+                members.setdefault(team_id, []).append(user_id)
+
+        assignments = []
+        for job in jobs:
+            pool = members.get(job.team_id, []) if job.team_id is not None else list(technicians)
+            if not pool:
+                assignments.append(None)
+                continue
+            best = min(pool, key=lambda user_id: (
+                technicians[user_id][0] + self.distance_weight * self._distance(job.location, *technicians[user_id][1:]),
+                user_id))
+            technicians[best][0] += self.job_weight(job.priority)
+            assignments.append(best)
+        return assignments
+
+
+dispatcher = Dispatcher()
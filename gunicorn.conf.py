@@ -0,0 +1,31 @@
+"""
+Gunicorn configuration for the CMMS application.
+
+Usage:
+    PROMETHEUS_MULTIPROC_DIR=/tmp/cmms-metrics gunicorn app:app
+
+When PROMETHEUS_MULTIPROC_DIR is set, every worker writes its metric samples
+to that directory and /metrics aggregates them across workers.
+"""
+import os
+import shutil
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.getenv('GUNICORN_WORKERS', 4))
+threads = int(os.getenv('GUNICORN_THREADS', 1))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 60))
+
+
+def on_starting(server):
+    """Start every deployment with an empty metrics directory"""
+    multiproc_dir = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+    if multiproc_dir:
+        shutil.rmtree(multiproc_dir, ignore_errors=True)
+        os.makedirs(multiproc_dir, exist_ok=True)
+
+
+def child_exit(server, worker):
+    """Drop live gauges (in-flight requests) of workers that have exited"""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
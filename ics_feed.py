@@ -0,0 +1,170 @@
+"""
+iCalendar (ICS) subscription feeds.
+
+Every user gets a personal feed (work orders assigned to them or their
+teams, plus their teams' maintenance schedules) and every team a team feed,
+at ``/calendar/feed/<token>.ics``.  Tokens are signed with the app's
+``SECRET_KEY`` and carry a digest of the user's password hash, so they need
+no storage and stop working when the password changes, the account is
+deactivated or the user leaves the team.
+
+Calendar apps poll these URLs every 15 minutes or so.  Each poll costs one
+fingerprint query (see calendar_feed.py): it is the feed's ETag and its
+latest ``updated_at`` the Last-Modified date, so unchanged feeds answer
+``304 Not Modified``.  A changed feed is streamed event by event while being
+rendered and kept in the in-process cache until an assignment in its scope
+changes.
+"""
+import hashlib
+from datetime import date, datetime, timedelta
+from typing import Callable, Iterator, List, Optional, Tuple
+
+from flask import current_app, url_for
+from itsdangerous import URLSafeSerializer, BadSignature
+
+from extensions import db
+from identity import team_ids_for
+from models import User, Team
+from calendar_feed import CalendarScope, calendar_cache, fingerprint, work_order_rows, schedule_rows, schedule_occurrences
+
+PAST_DAYS = 30
+FUTURE_DAYS = 180
+REFRESH_INTERVAL = 'PT15M'
+
+
+def _serializer() -> URLSafeSerializer:
+    return URLSafeSerializer(current_app.config['SECRET_KEY'] or '', salt='calendar-feed')
+
+
+def _password_digest(user) -> str:
+    return hashlib.sha256((user.password_hash or '').encode()).hexdigest()[:12]
+
+
+def feed_token(user, team_id: Optional[int] = None) -> str:
+    """Token for ``user``'s personal feed, or for a team feed subscribed to by ``user``"""
+    payload = {'u': user.id, 'p': _password_digest(user)}
+    if team_id is not None:
+        payload['t'] = team_id
+    return _serializer().dumps(payload)
+
+
+def can_subscribe_to_team(user, team) -> bool:
+    if team is None or team.company_id != user.company_id:
+        return False
+    return user.role in ('admin', 'manager') or team.id in team_ids_for(user)
+
+
+def resolve_token(token: str) -> Optional[Tuple[CalendarScope, str]]:
+    """``(scope, calendar name)`` for a valid feed token, None otherwise"""
+    try:
+        payload = _serializer().loads(token)
+    except BadSignature:
+        return None
+    user = db.session.get(User, payload.get('u')) if isinstance(payload, dict) else None
+    if user is None or not user.is_active or payload.get('p') != _password_digest(user):
+        return None
+    if 't' in payload:
+        team = db.session.get(Team, payload['t'])
+        if not can_subscribe_to_team(user, team):
+            return None
+        return CalendarScope(team.company_id, team_ids=frozenset([team.id])), f'{team.name} - CMMS'
+    scope = CalendarScope(user.company_id, user.id, frozenset(team_ids_for(user)))
+    return scope, f'{user.first_name} {user.last_name} - CMMS'
+
+
+def feed_window(today: Optional[date] = None) -> Tuple[datetime, datetime]:
+    """Feeds cover the last 30 and next 180 days; whole days so the window changes once a day"""
+    today = today or date.today()
+    start = datetime(today.year, today.month, today.day)
+    return start - timedelta(days=PAST_DAYS), start + timedelta(days=FUTURE_DAYS)
+
+
+def _escape(text: Optional[str]) -> str:
+    return ((text or '').replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+            .replace('\r\n', '\\n').replace('\n', '\\n'))
+
+
+def _fold(line: str) -> str:
+    """Fold content lines at 75 octets as RFC 5545 requires"""
+    encoded = line.encode('utf-8')
+    if len(encoded) <= 75:
+        return line + '\r\n'
+    parts, limit = [], 75
+    while encoded:
+        cut = min(limit, len(encoded))
+        while cut < len(encoded) and (encoded[cut] & 0xC0) == 0x80:
+            cut -= 1  # Do not split a UTF-8 sequence
+        parts.append(encoded[:cut].decode('utf-8'))
+        encoded, limit = encoded[cut:], 74
+    return '\r\n '.join(parts) + '\r\n'
+
+
+def _local(moment: datetime) -> str:
+    # Stored times are wall-clock times, so events are "floating" (no time zone)
+    return moment.strftime('%Y%m%dT%H%M%S')
+
+
+def _utc(moment: Optional[datetime]) -> str:
+    return (moment or datetime.utcnow()).strftime('%Y%m%dT%H%M%SZ')
+
+
+def _event(lines: List[str]) -> str:
+    return ''.join(_fold(line) for line in ['BEGIN:VEVENT', *lines, 'END:VEVENT'])
+
+
+def render(scope: CalendarScope, name: str, window_start: datetime, window_end: datetime) -> Iterator[str]:
+    """Yield the feed in chunks: the header, one VEVENT per event, the footer"""
+    host = current_app.config.get('SERVER_NAME') or 'cmms'
+    yield ''.join(_fold(line) for line in (
+        'BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:-//CMMS//Maintenance Calendar//EN', 'CALSCALE:GREGORIAN',
+        'METHOD:PUBLISH', f'X-WR-CALNAME:{_escape(name)}', f'REFRESH-INTERVAL;VALUE=DURATION:{REFRESH_INTERVAL}',
+        f'X-PUBLISHED-TTL:{REFRESH_INTERVAL}',
+    ))
+    for row in work_order_rows(scope, window_start, window_end):
+        yield _event([
+            f'UID:wo-{row.id}@{host}',
+            f'DTSTAMP:{_utc(row.updated_at)}',
+            f'LAST-MODIFIED:{_utc(row.updated_at)}',
+            f'DTSTART:{_local(row.scheduled_date)}',
+            f'DTEND:{_local(row.scheduled_date + timedelta(minutes=row.estimated_duration or 120))}',
+            f'SUMMARY:{_escape(f"{row.work_order_number}: {row.title}")}',
+            f'DESCRIPTION:{_escape(row.description)}',
+            f'LOCATION:{_escape(row.equipment_name)}',
+            f'URL:{url_for("work_order_detail", id=row.id, _external=True)}',
+            f'STATUS:{"CANCELLED" if row.status == "cancelled" else "CONFIRMED"}',
+            'CATEGORIES:Work Order',
+        ])
+    for row in schedule_rows(scope, window_end):
+        url = url_for('equipment_detail', id=row.equipment_id, _external=True)
+        for occurrence in schedule_occurrences(row, window_start, window_end):
+            yield _event([
+                f'UID:ms-{row.id}-{occurrence:%Y%m%dT%H%M}@{host}',
+                f'DTSTAMP:{_utc(row.updated_at)}',
+                f'DTSTART:{_local(occurrence)}',
+                f'DTEND:{_local(occurrence + timedelta(minutes=row.estimated_duration or 60))}',
+                f'SUMMARY:{_escape("Maintenance: " + (row.equipment_name or "Unknown"))}',
+                f'DESCRIPTION:{_escape(row.description)}',
+                f'LOCATION:{_escape(row.equipment_name)}',
+                f'URL:{url}',
+                'CATEGORIES:Preventive Maintenance',
+            ])
+    yield _fold('END:VCALENDAR')
+
+
+def cached_feed(scope: CalendarScope, name: str) -> Tuple[str, Optional[datetime], Optional[str], Callable[[], Iterator[str]]]:
+    """``(etag, last_modified, cached body, render)``; ``render()`` streams the feed and caches it once
+    complete, and is only needed when there is no cached body"""
+    window_start, window_end = feed_window()
+    version, last_modified = fingerprint(scope, window_start, window_end)
+    key = scope.key + (window_start,)
+    body = calendar_cache.get('ics_feed', key, version)
+
+    def renderer():
+        chunks = []
+        for chunk in render(scope, name, window_start, window_end):
+            chunks.append(chunk)
+            yield chunk
+        calendar_cache.put('ics_feed', key, version, ''.join(chunks))
+
+    # The window moves daily, so the ETag changes with it even when no row does
+    return f'{version}-{window_start:%Y%m%d}', last_modified, body, renderer
@@ -0,0 +1,142 @@
+"""
+Request-scoped identity for the CMMS application.
+
+Flask-Login calls ``load_user`` on every request, and most routes then walk
+``current_user.teams`` (a lazy load) to build the ``assigned_team_id IN
+(...)`` filter, often several times per request.  ``IdentityLoader`` loads
+the user together with its role and teams in a single query and keeps the
+derived team id set and compiled permissions on ``flask.g``.
+
+Optionally (``IDENTITY_CACHE_TTL`` seconds, default 0 = off) the loaded user
+is kept in a short-lived in-process cache and merged into each request's
+session without touching the database.  Changes to users, roles or teams
+flushed in this process invalidate the cache immediately; other workers see
+them once the TTL expires.
+"""
+import os
+import time
+import threading
+import logging
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from flask import g, has_request_context
+from flask_login import current_user
+from sqlalchemy import event
+from sqlalchemy.orm import Session, joinedload
+
+from extensions import db
+from metrics import metrics
+from models import User, Role, Team
+from permissions import role_permissions
+
+logger = logging.getLogger(__name__)
+
+
+class Identity:
+    """What the current request knows about its user"""
+
+    def __init__(self, user):
+        self.user_id = user.id
+        self.company_id = user.company_id
+        self.role = user.role
+        self.role_name: Optional[str] = user.role_info.name if user.role_info else None
+        self.team_ids: FrozenSet[int] = frozenset(team.id for team in user.teams)
+        self.permissions: FrozenSet[str] = role_permissions(user.role_info)
+
+
+class IdentityLoader:
+    def __init__(self, app=None):
+        self.ttl = 0.0
+        self._cache: Dict[int, Tuple[float, User]] = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('IDENTITY_CACHE_TTL', float(os.getenv('IDENTITY_CACHE_TTL', '0')))
+        self.ttl = float(app.config['IDENTITY_CACHE_TTL'])
+        app.extensions['identity_loader'] = self
+        event.listen(db.session, 'after_flush', self._after_flush)
+
+    def _query(self, session, user_id: int) -> Optional[User]:
+        return (session.query(User)
+                .options(joinedload(User.role_info), joinedload(User.teams))
+                .filter(User.id == user_id)
+                .first())
+
+    def load_user(self, user_id: int) -> Optional[User]:
+        """Return the user for ``user_id`` with role and teams already loaded"""
+        if self.ttl <= 0:
+            return self._query(db.session, user_id)
+
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(user_id)
+        hit = cached is not None and cached[0] > now
+        metrics.record_cache('identity', hit)
+        if not hit:
+            # Load in a private session so the cached instance is never
+            # modified by the request that happened to load it
+            session = Session(db.engine)
+            try:
+                user = self._query(session, user_id)
+            finally:
+                session.close()
+            if user is None:
+                return None
+            with self._lock:
+                self._cache[user_id] = (now + self.ttl, user)
+            cached = (now + self.ttl, user)
+        return db.session.merge(cached[1], load=False)
+
+    def invalidate(self, user_id: Optional[int] = None):
+        """Drop one user (or everyone) from the cross-request cache"""
+        with self._lock:
+            if user_id is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(user_id, None)
+
+    def _after_flush(self, session, flush_context):
+        if not self._cache:
+            return
+        for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+            if isinstance(obj, (Role, Team)):
+                self.invalidate()
+                return
+            if isinstance(obj, User):
+                self.invalidate(obj.id)
+
+
+identity_loader = IdentityLoader()
+
+
+def current_identity() -> Optional[Identity]:
+    """The ``Identity`` of the logged-in user, built once per request"""
+    if not has_request_context() or not current_user.is_authenticated:
+        return None
+    if 'identity' not in g:
+        g.identity = Identity(current_user)
+    return g.identity
+
+
+def identity_for(user) -> Optional[Identity]:
+    """The request's ``Identity`` when ``user`` is the logged-in user, otherwise None"""
+    identity = current_identity()
+    if identity is not None and identity.user_id == getattr(user, 'id', None):
+        return identity
+    return None
+
+
+def team_ids_for(user) -> List[int]:
+    """Team ids of ``user``; free for the current user after the first call"""
+    identity = identity_for(user)
+    if identity is not None:
+        return list(identity.team_ids)
+    return [team.id for team in user.teams]
+
+
+def current_team_ids() -> List[int]:
+    """Team ids of the logged-in user, for ``assigned_team_id.in_(...)`` filters"""
+    identity = current_identity()
+    return list(identity.team_ids) if identity is not None else []
@@ -0,0 +1,248 @@
+"""
+Geohash index and server-side marker clustering for the maps page.
+
+Every location with coordinates stores its geohash (``Location.geohash``,
+indexed with ``company_id``).  ``clusters`` answers the map's viewport
+request -- a bounding box and a zoom level -- with three grouped queries
+(locations, equipment, open work orders) over the same cells:
+
+* the box is covered by a handful of geohash prefixes, each turned into an
+  index range scan on ``(company_id, geohash)`` and trimmed to the box;
+* locations are grouped by the geohash prefix whose cell is roughly 60 px
+  wide at that zoom, so the number of clusters depends on the viewport and
+  not on how many locations the company has;
+* each cluster carries its centroid, location count, equipment count and
+  open work order count (work orders at the location or at its equipment).
+
+Single-location cells and everything at ``CLUSTER_MAX_ZOOM`` and beyond are
+returned as individual markers.  ``search`` finds locations by name anywhere
+on the map, so the page can fly to ones hidden in a cluster or out of view.
+
+Geohashes are set by ORM inserts/updates of ``Location``; rows written
+around the ORM (bulk imports, seeding) are filled in on the next map request
+for their company.
+"""
+import math
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, event, func, or_, select, update
+from sqlalchemy.orm import aliased
+
+from extensions import db
+from models import Equipment, Location, WorkOrder
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 9  # ~5 m cells
+CLUSTER_MAX_ZOOM = 16
+MAX_PREFIXES = 16
+SEARCH_LIMIT = 10
+OPEN_STATUSES = ('open', 'in_progress', 'on_hold')
+
+# Leaflet zoom level -> geohash precision of the cluster cells (~40-150 px wide)
+ZOOM_PRECISION = ((2, 1), (5, 2), (7, 3), (10, 4), (12, 5), (15, 6))
+
+
+class MapQueryError(ValueError):
+    """Invalid bounding box or zoom in a map request"""
+
+
+# -- geohash ------------------------------------------------------------------
+
+def encode(latitude: float, longitude: float, precision: int = GEOHASH_PRECISION) -> str:
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        interval, coordinate = (lon_range, longitude) if even else (lat_range, latitude)
+        middle = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits, value = 0, 0
+    return ''.join(chars)
+
+
+def cell_size(precision: int) -> Tuple[float, float]:
+    """(height, width) in degrees of a geohash cell"""
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lon_bits)
+
+
+def _next_prefix(prefix: str) -> Optional[str]:
+    """Smallest geohash after every hash starting with ``prefix`` (None after 'zzz...')"""
+    while prefix:
+        index = BASE32.index(prefix[-1])
+        if index + 1 < len(BASE32):
+            return prefix[:-1] + BASE32[index + 1]
+        prefix = prefix[:-1]
+    return None
+
+
+def precision_for_zoom(zoom: int) -> int:
+    for max_zoom, precision in ZOOM_PRECISION:
+        if zoom <= max_zoom:
+            return precision
+    return 7
+
+
+def covering_prefixes(south: float, west: float, north: float, east: float, precision: int) -> List[str]:
+    """Geohash prefixes (at most ``MAX_PREFIXES``, as long as possible up to ``precision``)
+    whose cells cover the box; ``west <= east``"""
+    for length in range(precision, 0, -1):
+        height, width = cell_size(length)
+        rows = int((north + 90) // height) - int((south + 90) // height) + 1
+        columns = int((east + 180) // width) - int((west + 180) // width) + 1
+        if rows * columns <= MAX_PREFIXES or length == 1:
+            break
+    prefixes = set()
+    first_row, first_column = int((south + 90) // height), int((west + 180) // width)
+    for row in range(first_row, first_row + rows):
+        for column in range(first_column, first_column + columns):
+            latitude = min(-90 + (row + 0.5) * height, 90.0)
+            longitude = min(-180 + (column + 0.5) * width, 180.0)
+            prefixes.add(encode(latitude, longitude, length))
+    return sorted(prefixes)
+
+
+def parse_bbox(value: Optional[str]) -> List[Tuple[float, float, float, float]]:
+    """``west,south,east,north`` (Leaflet's ``toBBoxString()``) as one or two
+    ``(south, west, north, east)`` boxes -- split at the antimeridian"""
+    try:
+        west, south, east, north = (float(part) for part in (value or '').split(','))
+    except ValueError:
+        raise MapQueryError('bbox must be "west,south,east,north"')
+    if not all(math.isfinite(coordinate) for coordinate in (west, south, east, north)):
+        raise MapQueryError('bbox coordinates must be finite numbers')
+    south, north = max(south, -90.0), min(north, 90.0)
+    if south > north:
+        raise MapQueryError('bbox must be "west,south,east,north"')
+    if west > east:
+        east += 360  # Already wrapped across the antimeridian
+    if east - west >= 360:
+        return [(south, -180.0, north, 180.0)]
+    west = (west + 180) % 360 - 180
+    east = (east + 180) % 360 - 180
+    if west <= east:
+        return [(south, west, north, east)]
+    return [(south, west, north, 180.0), (south, -180.0, north, east)]
+
+
+def parse_zoom(value: Optional[str]) -> int:
+    try:
+        zoom = int(value)
+    except (TypeError, ValueError):
+        raise MapQueryError('zoom must be an integer')
+    return max(0, min(zoom, 22))
+
+
+# -- index maintenance --------------------------------------------------------
+
+def _set_geohash(mapper, connection, target):
+    if target.latitude is not None and target.longitude is not None:
+        target.geohash = encode(target.latitude, target.longitude)
+    else:
+        target.geohash = None
+
+
+event.listen(Location, 'before_insert', _set_geohash)
+event.listen(Location, 'before_update', _set_geohash)
+
+
+def backfill_geohashes(company_id: Optional[int] = None) -> int:
+    """Set the geohash of located rows that have none; returns the number of rows updated"""
+    query = select(Location.id, Location.latitude, Location.longitude).where(
+        Location.geohash == None, Location.latitude != None, Location.longitude != None)
+    if company_id is not None:
+        query = query.where(Location.company_id == company_id)
+    rows = db.session.execute(query).all()
+    if rows:
+        db.session.execute(update(Location), [
+            {'id': row.id, 'geohash': encode(row.latitude, row.longitude)} for row in rows
+        ])
+        db.session.commit()
+    return len(rows)
+
+
+# -- clustering ---------------------------------------------------------------
+
+def _box_filter(boxes, precision: int):
+    conditions = []
+    for south, west, north, east in boxes:
+        ranges = []
+        for prefix in covering_prefixes(south, west, north, east, precision):
+            upper = _next_prefix(prefix)
+            ranges.append(and_(Location.geohash >= prefix, Location.geohash < upper) if upper
+                          else Location.geohash >= prefix)
+        conditions.append(and_(or_(*ranges), Location.latitude.between(south, north),
+                               Location.longitude.between(west, east)))
+    return or_(*conditions)
+
+
+def clusters(company_id: int, boxes, zoom: int) -> Dict:
+    """Clusters and markers of the company's active locations inside ``boxes`` (see ``parse_bbox``)"""
+    backfill_geohashes(company_id)
+    markers_only = zoom >= CLUSTER_MAX_ZOOM
+    precision = GEOHASH_PRECISION if markers_only else precision_for_zoom(zoom)
+    key = (Location.id if markers_only else func.substr(Location.geohash, 1, precision)).label('cell')
+    in_view = (Location.company_id == company_id, Location.is_active == True, _box_filter(boxes, precision))
+
+    locations = (select(key, func.count(Location.id).label('count'),
+                        func.avg(Location.latitude).label('latitude'), func.avg(Location.longitude).label('longitude'),
+                        func.min(Location.id).label('id'), func.min(Location.name).label('name'))
+                 .where(*in_view).group_by(key).order_by(key))
+    equipment_counts = dict(db.session.execute(
+        select(key, func.count(Equipment.id))
+        .join(Location, Location.id == Equipment.location_id)
+        .where(Equipment.company_id == company_id, *in_view)
+        .group_by(key)
+    ).all())
+    # Work orders count at their own location, or else at their equipment's
+    work_order_equipment = aliased(Equipment)
+    work_order_counts = dict(db.session.execute(
+        select(key, func.count(WorkOrder.id))
+        .outerjoin(work_order_equipment, work_order_equipment.id == WorkOrder.equipment_id)
+        .join(Location, Location.id == func.coalesce(WorkOrder.location_id, work_order_equipment.location_id))
+        .where(WorkOrder.company_id == company_id, WorkOrder.status.in_(OPEN_STATUSES), *in_view)
+        .group_by(key)
+    ).all())
+
+    result = {'precision': precision, 'clusters': [], 'markers': []}
+    height, width = cell_size(precision)
+    for row in db.session.execute(locations):
+        counts = {'equipment_count': equipment_counts.get(row.cell, 0),
+                  'open_work_orders': work_order_counts.get(row.cell, 0)}
+        if row.count == 1:
+            result['markers'].append({'id': row.id, 'name': row.name, 'latitude': row.latitude,
+                                      'longitude': row.longitude, **counts})
+            continue
+        # Cell bounds, so the client can zoom into the cluster
+        south = -90 + ((row.latitude + 90) // height) * height
+        west = -180 + ((row.longitude + 180) // width) * width
+        result['clusters'].append({
+            'geohash': row.cell, 'count': row.count, 'latitude': row.latitude, 'longitude': row.longitude,
+            'bounds': [[south, west], [south + height, west + width]], **counts,
+        })
+    return result
+
+
+def search(company_id: int, query: str, limit: int = SEARCH_LIMIT) -> List[Dict]:
+    """The company's active locations with coordinates whose name contains ``query``, by name"""
+    query = (query or '').strip()
+    if not query:
+        raise MapQueryError('q must not be empty')
+    pattern = '%' + query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+    rows = db.session.execute(
+        select(Location.id, Location.name, Location.latitude, Location.longitude)
+        .where(Location.company_id == company_id, Location.is_active == True,
+               Location.latitude.isnot(None), Location.longitude.isnot(None),
+               Location.name.ilike(pattern, escape='\\'))
+        .order_by(Location.name).limit(limit)
+    )
+    return [{'id': row.id, 'name': row.name, 'latitude': row.latitude, 'longitude': row.longitude} for row in rows]
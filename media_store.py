@@ -0,0 +1,231 @@
+"""
+Content-addressed media store with reference counts.
+
+Every uploaded file is stored once per distinct content, at
+``static/uploads/blobs/ab/cd/<sha256>.<ext>``, with a ``media_blobs`` row
+counting the references to its path: ``work_order_media`` rows, entries
+in the media columns of work order requests, and WhatsApp message media.
+Storing bytes that are already there -- a re-sent WhatsApp photo, a replayed
+offline sync -- only adds a reference; ``release`` drops one.
+
+Reference counts change in the caller's session, so they are committed or
+rolled back together with the columns that hold the paths.  A rolled back
+upload can leave a new file without a row; ``collect_garbage(scan=True)``
+finds those, the normal run never looks at the filesystem:
+
+    unreferenced blobs = ref_count <= 0 AND released_at < now - grace
+
+is a range scan of the ``(ref_count, released_at)`` index.  The grace period
+keeps a blob that was just released around for an upload of the same
+content that is still in flight.
+"""
+import hashlib
+import os
+import shutil
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Callable, Iterable, List, Optional, Tuple, Union
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+from werkzeug.utils import secure_filename
+
+from extensions import db
+from models import MediaBlob
+
+CHUNK_SIZE = 1024 * 1024
+GC_BATCH_SIZE = 500
+
+
+def hash_file(path: str) -> Tuple[str, int]:
+    """(SHA-256 hex digest, size) of the file at ``path``"""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as source:
+        for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def _move(source: str, destination: str):
+    try:
+        os.replace(source, destination)
+    except OSError:
+        shutil.move(source, destination)  # Different filesystem
+
+
+class MediaStore:
+    def __init__(self, app=None):
+        self.static_folder = ''
+        self.prefix = 'uploads/blobs'
+        self.grace = 3600
+        self.unlink_listeners: List[Callable[[str], None]] = []  # Called with each deleted path
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('MEDIA_BLOB_PREFIX', os.getenv('MEDIA_BLOB_PREFIX', 'uploads/blobs'))
+        app.config.setdefault('MEDIA_BLOB_GRACE_HOURS', float(os.getenv('MEDIA_BLOB_GRACE_HOURS', '1')))
+        self.static_folder = app.static_folder or ''
+        self.prefix = app.config['MEDIA_BLOB_PREFIX'].strip('/')
+        self.grace = float(app.config['MEDIA_BLOB_GRACE_HOURS']) * 3600
+        app.extensions['media_store'] = self
+
+    # -- paths ----------------------------------------------------------------
+
+    def blob_path(self, sha256: str, filename: Optional[str]) -> str:
+        """Path (relative to ``static/``) for content ``sha256``; keeps the extension of ``filename``"""
+        extension = os.path.splitext(secure_filename(filename or ''))[1].lower()
+        return f'{self.prefix}/{sha256[:2]}/{sha256[2:4]}/{sha256}{extension}'
+
+    def is_blob(self, path: Optional[str]) -> bool:
+        return bool(path) and path.startswith(f'{self.prefix}/')
+
+    def absolute(self, path: str) -> str:
+        return os.path.join(self.static_folder, path)
+
+    # -- storing --------------------------------------------------------------
+
+    def store_upload(self, file) -> str:
+        """Store a ``FileStorage``; returns the path to save in the media column"""
+        stream = file.stream
+        if hasattr(stream, 'sha256') and hasattr(stream, 'commit'):
+            # Streamed to disk and hashed while the form was parsed (see upload_ingest.py)
+            return self._store(stream.sha256, stream.size, file.filename, stream.commit, stream.close)
+        staging = self.absolute(f'{self.prefix}/.incoming-{uuid.uuid4().hex}')
+        os.makedirs(os.path.dirname(staging), exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        with open(staging, 'wb') as target:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+                target.write(chunk)
+                size += len(chunk)
+        return self._store(digest.hexdigest(), size, file.filename,
+                           lambda destination: _move(staging, destination), lambda: os.remove(staging))
+
+    def store_file(self, source: str, filename: Optional[str]) -> str:
+        """Store the file at ``source``, which is moved into the store (or removed if the content is there)"""
+        sha256, size = hash_file(source)
+        return self._store(sha256, size, filename, lambda destination: _move(source, destination),
+                           lambda: os.remove(source))
+
+    def store_bytes(self, data: bytes, filename: Optional[str]) -> str:
+        def write(destination):
+            temporary = f'{destination}.{uuid.uuid4().hex}.tmp'
+            with open(temporary, 'wb') as target:
+                target.write(data)
+            os.replace(temporary, destination)
+
+        return self._store(hashlib.sha256(data).hexdigest(), len(data), filename, write, lambda: None)
+
+    def _store(self, sha256: str, size: int, filename: Optional[str],
+               put: Callable[[str], None], discard: Callable[[], None]) -> str:
+        path = self._reference(sha256, size, filename)
+        destination = self.absolute(path)
+        if os.path.exists(destination):
+            discard()
+        else:
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            put(destination)
+        return path
+
+    def _reference(self, sha256: str, size: int, filename: Optional[str]) -> str:
+        """Add a reference to the blob with this content, creating its row if needed; returns its path"""
+        path = db.session.execute(select(MediaBlob.path).where(MediaBlob.sha256 == sha256)).scalar()
+        if path is None:
+            path = self.blob_path(sha256, filename)
+            try:
+                with db.session.begin_nested():
+                    db.session.add(MediaBlob(sha256=sha256, path=path, size=size, ref_count=1))
+                return path
+            except IntegrityError:
+                # Another request stored the same content first
+                path = db.session.execute(select(MediaBlob.path).where(MediaBlob.sha256 == sha256)).scalar_one()
+        db.session.execute(update(MediaBlob).where(MediaBlob.sha256 == sha256)
+                           .values(ref_count=MediaBlob.ref_count + 1))
+        return path
+
+    # -- references -----------------------------------------------------------
+
+    def release(self, paths: Union[str, Iterable[str], None]) -> List[str]:
+        """Drop one reference per stored path; returns the paths that are not in the store"""
+        if not paths:
+            return []
+        if isinstance(paths, str):
+            paths = paths.split(',')
+        paths = [path for path in paths if path]
+        now = datetime.utcnow()
+        for path, count in Counter(path for path in paths if self.is_blob(path)).items():
+            db.session.execute(update(MediaBlob).where(MediaBlob.path == path)
+                               .values(ref_count=MediaBlob.ref_count - count, released_at=now))
+        return [path for path in paths if not self.is_blob(path)]
+
+    # -- garbage collection ---------------------------------------------------
+
+    def collect_garbage(self, scan: bool = False) -> int:
+        """Delete unreferenced blobs (and, with ``scan``, files without a row); returns the number of files removed"""
+        cutoff = datetime.utcnow() - timedelta(seconds=self.grace)
+        removed = 0
+        while True:
+            rows = db.session.execute(
+                select(MediaBlob.id, MediaBlob.path)
+                .where(MediaBlob.ref_count <= 0, MediaBlob.released_at < cutoff)
+                .order_by(MediaBlob.ref_count, MediaBlob.released_at)
+                .limit(GC_BATCH_SIZE)
+            ).all()
+            if not rows:
+                break
+            ids = [row.id for row in rows]
+            db.session.execute(delete(MediaBlob).where(MediaBlob.id.in_(ids), MediaBlob.ref_count <= 0))
+            # Rows referenced again since the select survive the delete; keep their files
+            survivors = set(db.session.execute(select(MediaBlob.id).where(MediaBlob.id.in_(ids))).scalars())
+            db.session.commit()
+            for row in rows:
+                if row.id not in survivors:
+                    removed += self._unlink(row.path)
+            if len(survivors) == len(rows):
+                break
+        if scan:
+            removed += self._remove_untracked(time.time() - self.grace)
+        return removed
+
+    def _remove_untracked(self, cutoff: float) -> int:
+        """Files in the store without a ``media_blobs`` row (left by rolled back uploads)"""
+        removed = 0
+        for directory, _, filenames in os.walk(self.absolute(self.prefix)):
+            candidates = {}
+            for filename in filenames:
+                full_path = os.path.join(directory, filename)
+                try:
+                    if os.path.getmtime(full_path) < cutoff:
+                        candidates[os.path.relpath(full_path, self.static_folder).replace(os.sep, '/')] = full_path
+                except OSError:
+                    continue
+            if not candidates:
+                continue
+            tracked = set(db.session.execute(
+                select(MediaBlob.path).where(MediaBlob.path.in_(list(candidates)))
+            ).scalars())
+            for path in candidates.keys() - tracked:
+                removed += self._unlink(path)
+        return removed
+
+    def _unlink(self, path: str) -> int:
+        try:
+            os.remove(self.absolute(path))
+            print(f"Deleted orphaned file: {path}")
+        except FileNotFoundError:
+            return 0
+        except Exception as e:
+            print(f"Error deleting orphaned file {path}: {e}")
+            return 0
+        for listener in self.unlink_listeners:
+            listener(path)
+        return 1
+
+
+media_store = MediaStore()
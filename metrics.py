@@ -0,0 +1,182 @@
+"""
+Prometheus metrics for the CMMS application.
+
+Exposes request latency, in-flight requests, database pool checkout wait,
+SQL query counts, cache hit/miss counters and outbound WhatsApp/SMTP call
+latency on ``/metrics``.
+
+Under gunicorn set ``PROMETHEUS_MULTIPROC_DIR`` to an empty, writable
+directory before the workers start; every worker then writes its samples to
+memory-mapped files in that directory and ``/metrics`` aggregates them, so any
+worker can answer a scrape.  ``gunicorn.conf.py`` prepares the directory and
+cleans up after dead workers.
+"""
+import os
+import time
+import logging
+from contextlib import contextmanager
+from typing import Dict, Optional, Any
+
+from flask import g, has_request_context, request
+from prometheus_client import (CollectorRegistry, Counter, Gauge, Histogram, REGISTRY,
+                               CONTENT_TYPE_LATEST, generate_latest, multiprocess)
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+from extensions import db
+
+logger = logging.getLogger(__name__)
+
+REQUEST_LATENCY = Histogram(
+    'cmms_http_request_duration_seconds', 'HTTP request latency by endpoint',
+    ['endpoint', 'method'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+REQUESTS_TOTAL = Counter(
+    'cmms_http_requests_total', 'HTTP requests by endpoint and status code',
+    ['endpoint', 'method', 'status'],
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    'cmms_http_requests_in_flight', 'HTTP requests currently being served',
+    multiprocess_mode='livesum',
+)
+DB_POOL_CHECKOUT_WAIT = Histogram(
+    'cmms_db_pool_checkout_wait_seconds', 'Time spent waiting for a pooled database connection',
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0),
+)
+DB_QUERIES = Counter(
+    'cmms_db_queries_total', 'SQL statements executed by endpoint',
+    ['endpoint'],
+)
+DB_QUERIES_PER_REQUEST = Histogram(
+    'cmms_db_queries_per_request', 'SQL statements executed per request',
+    ['endpoint'],
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000),
+)
+CACHE_REQUESTS = Counter(
+    'cmms_cache_requests_total', 'Cache lookups by cache name and result (hit/miss)',
+    ['cache', 'result'],
+)
+OUTBOUND_LATENCY = Histogram(
+    'cmms_outbound_request_duration_seconds', 'Latency of calls to external services',
+    ['service'],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+OUTBOUND_REQUESTS = Counter(
+    'cmms_outbound_requests_total', 'Calls to external services by outcome (success/error)',
+    ['service', 'outcome'],
+)
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that reports how long each checkout waited for a connection"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_CHECKOUT_WAIT.observe(time.perf_counter() - start)
+
+
+class OutboundCall:
+    """Handle yielded by ``Metrics.track_outbound``; set ``failed`` for soft failures"""
+
+    def __init__(self):
+        self.failed = False
+
+
+class Metrics:
+    """Collects request, database, cache and outbound-call metrics"""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    @staticmethod
+    def engine_options(database_uri: Optional[str]) -> Dict[str, Any]:
+        """Engine options that swap in the instrumented pool (SQLite keeps its own pool)"""
+        if not database_uri or database_uri.startswith('sqlite'):
+            return {}
+        return {'poolclass': TimedQueuePool}
+
+    def init_app(self, app):
+        app.config.setdefault('METRICS_AUTH_TOKEN', os.getenv('METRICS_AUTH_TOKEN'))
+        app.extensions['metrics'] = self
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+        with app.app_context():
+            event.listen(db.engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    def _before_request(self):
+        g._metrics_start = time.perf_counter()
+        g._metrics_queries = 0
+        REQUESTS_IN_FLIGHT.inc()
+
+    def _observe_request(self, status_code):
+        endpoint = request.endpoint or 'unmatched'
+        REQUEST_LATENCY.labels(endpoint, request.method).observe(time.perf_counter() - g._metrics_start)
+        REQUESTS_TOTAL.labels(endpoint, request.method, str(status_code)).inc()
+        queries = g.get('_metrics_queries', 0)
+        if queries:
+            DB_QUERIES.labels(endpoint).inc(queries)
+        DB_QUERIES_PER_REQUEST.labels(endpoint).observe(queries)
+        g._metrics_observed = True
+
+    def _after_request(self, response):
+        if g.get('_metrics_start') is not None:
+            self._observe_request(response.status_code)
+        return response
+
+    def _teardown_request(self, exc=None):
+        if g.get('_metrics_start') is None:
+            return
+        if not g.get('_metrics_observed'):
+            # after_request does not run when the view raised
+            self._observe_request(500)
+        REQUESTS_IN_FLIGHT.dec()
+        g._metrics_start = None
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if has_request_context() and g.get('_metrics_start') is not None:
+            g._metrics_queries = g.get('_metrics_queries', 0) + 1
+        else:
+            DB_QUERIES.labels('background').inc()
+
+    @staticmethod
+    def record_cache(cache: str, hit: bool):
+        """Count a cache lookup; the hit ratio is hits / (hits + misses)"""
+        CACHE_REQUESTS.labels(cache, 'hit' if hit else 'miss').inc()
+
+    @staticmethod
+    @contextmanager
+    def track_outbound(service: str):
+        """Time a call to an external service; exceptions and ``call.failed`` count as errors"""
+        call = OutboundCall()
+        start = time.perf_counter()
+        try:
+            yield call
+        except Exception:
+            call.failed = True
+            raise
+        finally:
+            OUTBOUND_LATENCY.labels(service).observe(time.perf_counter() - start)
+            OUTBOUND_REQUESTS.labels(service, 'error' if call.failed else 'success').inc()
+
+    @staticmethod
+    def render_latest():
+        """Serialize all metrics, aggregating across worker processes when configured"""
+        if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = REGISTRY
+        return generate_latest(registry)
+
+    content_type = CONTENT_TYPE_LATEST
+
+
+metrics = Metrics()
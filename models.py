@@ -217,8 +217,28 @@ class Equipment(db.Model):
             'created_by_name': f"{self.created_by.first_name} {self.created_by.last_name}" if self.created_by else None
         }
 
-class WorkOrder(db.Model):
+class MediaOwnerMixin:
+    """Photos, videos and voice notes attached through ``work_order_media`` (see work_order_media.py)"""
+    media_owner_type = None
+
+    def media_paths(self, kind):
+        return [item.path for item in self.media if item.kind == kind]
+
+    @property
+    def image_paths(self):
+        return self.media_paths('image')
+
+    @property
+    def video_paths(self):
+        return self.media_paths('video')
+
+    @property
+    def voice_note_paths(self):
+        return self.media_paths('audio')
+
+class WorkOrder(MediaOwnerMixin, db.Model):
     __tablename__ = 'work_orders'
+    media_owner_type = 'work_order'
     
     id = db.Column(db.Integer, primary_key=True)
     company_id = db.Column(db.Integer, db.ForeignKey('companies.id'), nullable=False)
@@ -240,9 +260,6 @@ class WorkOrder(db.Model):
     actual_start_time = db.Column(db.DateTime)
     actual_end_time = db.Column(db.DateTime)
     completion_notes = db.Column(db.Text)
-    images = db.Column(db.Text)  # Store image file paths as JSON
-    videos = db.Column(db.Text)  # Store video file paths as JSON
-    voice_notes = db.Column(db.Text)  # Store voice note file paths as JSON
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -250,6 +267,18 @@ class WorkOrder(db.Model):
     location = db.relationship('Location', backref='work_orders')
     assigned_team = db.relationship('Team', backref='assigned_work_orders')
     comments = db.relationship('WorkOrderComment', backref='work_order', lazy=True, cascade='all, delete-orphan')
+    media = db.relationship('WorkOrderMedia', viewonly=True, order_by='WorkOrderMedia.id',
+                            primaryjoin="and_(WorkOrderMedia.owner_type == 'work_order', "
+                                        "foreign(WorkOrderMedia.owner_id) == WorkOrder.id)")
+    
+    # Technician visibility lookups (see visibility.py), calendar windows (see calendar_feed.py)
+    # and open workload per technician (see dispatcher.py)
+    __table_args__ = (
+        db.Index('ix_work_orders_company_technician_status', 'company_id', 'assigned_technician_id', 'status'),
+        db.Index('ix_work_orders_company_team_status', 'company_id', 'assigned_team_id', 'status'),
+        db.Index('ix_work_orders_company_scheduled_date', 'company_id', 'scheduled_date'),
+        db.Index('ix_work_orders_open_workload', 'company_id', 'status', 'assigned_technician_id', 'priority'),
+    )
     
     def __repr__(self):
         return f'<WorkOrder {self.work_order_number}>'
@@ -280,13 +309,24 @@ class WorkOrder(db.Model):
             'actual_start_time': self.actual_start_time.isoformat() if self.actual_start_time else None,
             'actual_end_time': self.actual_end_time.isoformat() if self.actual_end_time else None,
             'completion_notes': self.completion_notes,
-            'images': self.images,
-            'videos': self.videos,
-            'voice_notes': self.voice_notes,
+            'images': self.image_paths,
+            'videos': self.video_paths,
+            'voice_notes': self.voice_note_paths,
             'created_at': self.created_at.isoformat(),
             'updated_at': self.updated_at.isoformat()
         }
 
+class WorkOrderSequence(db.Model):
+    """Per-company work order number counter, handed out in blocks (see work_order_numbers.py)"""
+    __tablename__ = 'work_order_sequences'
+    
+    company_id = db.Column(db.Integer, db.ForeignKey('companies.id'), primary_key=True)
+    next_value = db.Column(db.BigInteger, nullable=False, default=1)  # First number not yet handed out
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<WorkOrderSequence company={self.company_id} next={self.next_value}>'
+
 class WorkOrderRequest(db.Model):
     __tablename__ = 'work_order_requests'
 
@@ -338,6 +378,7 @@ class MaintenanceSchedule(db.Model):
     schedule_type = db.Column(db.String(20), default='calendar')  # calendar, runtime, condition
     frequency = db.Column(db.String(20), nullable=False)  # daily, weekly, monthly, yearly
     frequency_value = db.Column(db.Integer, default=1)  # every X days/weeks/months/years
+    recurrence_options = db.Column(db.Text)  # JSON day rules, business days, fixed/floating (see recurrence.py)
     description = db.Column(db.Text, nullable=False)
     estimated_duration = db.Column(db.Integer)  # in minutes
     is_active = db.Column(db.Boolean, default=True)
@@ -352,6 +393,11 @@ class MaintenanceSchedule(db.Model):
     sop = db.relationship('SOP', backref='maintenance_schedules')
     assigned_team = db.relationship('Team', backref='assigned_maintenance_schedules')
     
+    # Due-schedule scans (see pm_generator.py)
+    __table_args__ = (
+        db.Index('ix_maintenance_schedules_active_next_due', 'is_active', 'next_due'),
+    )
+    
     def __repr__(self):
         return f'<MaintenanceSchedule {self.equipment.name if self.equipment else "Unknown"}>'
     
@@ -363,6 +409,7 @@ class MaintenanceSchedule(db.Model):
             'schedule_type': self.schedule_type,
             'frequency': self.frequency,
             'frequency_value': self.frequency_value,
+            'recurrence_options': self.recurrence_options,
             'description': self.description,
             'estimated_duration': self.estimated_duration,
             'is_active': self.is_active,
@@ -534,22 +581,23 @@ class Inventory(db.Model):
             'updated_at': self.updated_at.isoformat()
         }
 
-class WorkOrderComment(db.Model):
+class WorkOrderComment(MediaOwnerMixin, db.Model):
     __tablename__ = 'work_order_comments'
+    media_owner_type = 'comment'
     
     id = db.Column(db.Integer, primary_key=True)
     work_order_id = db.Column(db.Integer, db.ForeignKey('work_orders.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     company_id = db.Column(db.Integer, db.ForeignKey('companies.id'), nullable=False)
     comment = db.Column(db.Text, nullable=False)
-    images = db.Column(db.Text)  # Store image file paths as JSON
-    videos = db.Column(db.Text)  # Store video file paths as JSON
-    voice_notes = db.Column(db.Text)  # Store voice note file paths as JSON
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationships
     user = db.relationship('User', backref='work_order_comments')
     company = db.relationship('Company', backref='work_order_comments')
+    media = db.relationship('WorkOrderMedia', viewonly=True, order_by='WorkOrderMedia.id',
+                            primaryjoin="and_(WorkOrderMedia.owner_type == 'comment', "
+                                        "foreign(WorkOrderMedia.owner_id) == WorkOrderComment.id)")
     
     def __repr__(self):
         return f'<WorkOrderComment {self.id}>'
@@ -561,12 +609,68 @@ class WorkOrderComment(db.Model):
             'user_id': self.user_id,
             'company_id': self.company_id,
             'comment': self.comment,
-            'images': self.images,
-            'videos': self.videos,
-            'voice_notes': self.voice_notes,
+            'images': self.image_paths,
+            'videos': self.video_paths,
+            'voice_notes': self.voice_note_paths,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+class WorkOrderMedia(db.Model):
+    """A photo, video or voice note of a work order or comment (see work_order_media.py)"""
+    __tablename__ = 'work_order_media'
+
+    id = db.Column(db.Integer, primary_key=True)
+    company_id = db.Column(db.Integer, db.ForeignKey('companies.id'), nullable=False)
+    owner_type = db.Column(db.String(20), nullable=False)  # work_order, comment
+    owner_id = db.Column(db.Integer, nullable=False)
+    kind = db.Column(db.String(10), nullable=False)  # image, video, audio
+    path = db.Column(db.String(255), nullable=False)  # Relative to static/
+    size = db.Column(db.BigInteger)
+    mime_type = db.Column(db.String(100))
+    uploaded_by_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    uploaded_by = db.relationship('User')
+
+    __table_args__ = (
+        db.Index('ix_work_order_media_owner', 'owner_type', 'owner_id', 'kind'),
+        db.Index('ix_work_order_media_company_created', 'company_id', 'created_at'),
+    )
+
+    def __repr__(self):
+        return f'<WorkOrderMedia {self.owner_type}:{self.owner_id} {self.kind}>'
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'path': self.path,
+            'size': self.size,
+            'mime_type': self.mime_type,
+            'uploaded_by_id': self.uploaded_by_id,
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
+class MediaBlob(db.Model):
+    """A stored media file, named by the SHA-256 of its content (see media_store.py)"""
+    __tablename__ = 'media_blobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), unique=True, nullable=False)
+    path = db.Column(db.String(255), unique=True, nullable=False)  # Relative to static/
+    size = db.Column(db.BigInteger, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    released_at = db.Column(db.DateTime)  # Last time a reference was dropped
+
+    __table_args__ = (
+        # Garbage collection: unreferenced blobs, oldest release first
+        db.Index('ix_media_blobs_ref_count_released', 'ref_count', 'released_at'),
+    )
+
+    def __repr__(self):
+        return f'<MediaBlob {self.sha256[:12]}>'
+
 class WorkOrderPart(db.Model):
     __tablename__ = 'work_order_parts'
     
@@ -610,6 +714,7 @@ class Location(db.Model):
     country = db.Column(db.String(100), default='USA')
     latitude = db.Column(db.Float)  # For map coordinates
     longitude = db.Column(db.Float)  # For map coordinates
+    geohash = db.Column(db.String(12))  # Set from the coordinates (see map_clusters.py)
     description = db.Column(db.Text)
     contact_person = db.Column(db.String(100))
     contact_phone = db.Column(db.String(20))
@@ -622,6 +727,11 @@ class Location(db.Model):
     equipment = db.relationship('Equipment', backref='location_info', lazy=True)
     users = db.relationship('User', backref='location_info', lazy=True)
     
+    # Viewport queries on the maps page (see map_clusters.py)
+    __table_args__ = (
+        db.Index('ix_locations_company_geohash', 'company_id', 'geohash'),
+    )
+    
     def __repr__(self):
         return f'<Location {self.name}>'
     
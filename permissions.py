@@ -0,0 +1,77 @@
+"""
+Compiled role permissions.
+
+``Role.permissions`` is stored as a JSON list.  Parsing it on every
+``user_has_permission`` call is wasteful because templates call that helper
+dozens of times per render, so each role's list is compiled once into a
+frozenset and cached in-process under ``(role_id, role.updated_at)``.  Any
+edit to the role bumps ``updated_at``, so other workers pick up the change
+on their next lookup; ``invalidate_role`` drops the entry in the current
+process straight away.
+"""
+import json
+import logging
+import threading
+from typing import Dict, FrozenSet, Optional, Tuple
+
+from flask import g, has_request_context
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+_compiled: Dict[int, Tuple[object, FrozenSet[str]]] = {}
+_lock = threading.Lock()
+
+
+def compile_permissions(raw: Optional[str]) -> FrozenSet[str]:
+    """Parse a role's JSON permission list into a frozenset"""
+    if not raw:
+        return frozenset()
+    try:
+        parsed = json.loads(raw)
+    except (TypeError, ValueError):
+        logger.warning("Ignoring malformed role permissions: %r", raw[:100])
+        return frozenset()
+    if not isinstance(parsed, list):
+        return frozenset()
+    return frozenset(str(permission) for permission in parsed)
+
+
+def role_permissions(role) -> FrozenSet[str]:
+    """Return the compiled permission set of ``role``.
+
+    The set is memoized on ``flask.g`` for the rest of the request, so
+    repeated checks are a dict lookup plus a set membership test.
+    """
+    if role is None:
+        return frozenset()
+
+    request_cache = None
+    if has_request_context():
+        request_cache = g.setdefault('role_permissions', {})
+        if role.id in request_cache:
+            return request_cache[role.id]
+
+    with _lock:
+        cached = _compiled.get(role.id)
+    hit = cached is not None and cached[0] == role.updated_at
+    metrics.record_cache('role_permissions', hit)
+    if hit:
+        permissions = cached[1]
+    else:
+        permissions = compile_permissions(role.permissions)
+        with _lock:
+            _compiled[role.id] = (role.updated_at, permissions)
+
+    if request_cache is not None:
+        request_cache[role.id] = permissions
+    return permissions
+
+
+def invalidate_role(role_id: int):
+    """Forget the compiled permissions of a role after it was edited"""
+    with _lock:
+        _compiled.pop(role_id, None)
+    if has_request_context():
+        g.get('role_permissions', {}).pop(role_id, None)
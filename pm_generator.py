@@ -0,0 +1,223 @@
+"""
+Batch generation of preventive maintenance work orders.
+
+``flask generate-pm-work-orders --horizon 7d`` creates the work orders (and
+their SOP checklist rows) for every active maintenance schedule due within
+the horizon:
+
+* schedules are found with an index scan on ``(is_active, next_due)`` and
+  processed in batches, locked with ``FOR UPDATE SKIP LOCKED`` on
+  PostgreSQL so two concurrent runs never pick the same schedule;
+* work orders are written with one multi-row ``INSERT ... RETURNING`` per
+  batch, checklist rows with a bulk insert, and ``next_due`` is advanced
+  for the whole batch with a single ``UPDATE ... CASE``;
+* every occurrence inside the horizon is generated and ``next_due`` moves
+  past the horizon in the same transaction, so re-running the job for the
+  same horizon finds nothing left to do;
+* work orders of team schedules are spread over the team's technicians by
+  open workload (see dispatcher.py).
+
+Missed occurrences (due before now) collapse into one overdue work order
+instead of a backlog of copies.
+"""
+import re
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import case, func, insert, select, update
+
+from extensions import db
+from models import Equipment, Location, MaintenanceSchedule, SOPChecklistItem, User, WorkOrder, WorkOrderChecklist
+from bulk_load import bulk_insert
+from work_order_numbers import work_order_numbers
+from recurrence import rule_for
+from dispatcher import dispatcher, DispatchJob
+
+_HORIZON = re.compile(r'^\s*(\d+)\s*([hdw]?)\s*$')
+_HORIZON_UNITS = {'h': 'hours', 'd': 'days', 'w': 'weeks', '': 'days'}
+
+
+def parse_horizon(value: str) -> timedelta:
+    """Parse ``12h``, ``7d`` or ``2w`` (a bare number means days)"""
+    match = _HORIZON.match(value or '')
+    if not match:
+        raise ValueError(f'Invalid horizon "{value}"; use e.g. 12h, 7d or 2w')
+    return timedelta(**{_HORIZON_UNITS[match.group(2)]: int(match.group(1))})
+
+
+class PMWorkOrderGenerator:
+    def __init__(self, horizon: timedelta, company_id: Optional[int] = None, batch_size: int = 500,
+                 dry_run: bool = False, now: Optional[datetime] = None):
+        self.now = now or datetime.utcnow()
+        self.until = self.now + horizon
+        self.company_id = company_id
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.stats = {'schedules': 0, 'work_orders': 0, 'checklist_items': 0, 'skipped': 0}
+        self._excluded_ids = set()
+        self._creators: Dict[int, Optional[int]] = {}
+
+    def run(self) -> Dict[str, int]:
+        while True:
+            schedules = self._next_batch()
+            if not schedules:
+                break
+            self._process(schedules)
+            if self.dry_run:
+                # Nothing is advanced, so leave these schedules out of the next batch
+                self._excluded_ids.update(schedule.id for schedule in schedules)
+                db.session.rollback()
+            else:
+                db.session.commit()
+        return self.stats
+
+    def _next_batch(self) -> List[MaintenanceSchedule]:
+        query = MaintenanceSchedule.query.filter(
+            MaintenanceSchedule.is_active == True,
+            MaintenanceSchedule.next_due != None,
+            MaintenanceSchedule.next_due <= self.until,
+        )
+        if self.company_id is not None:
+            query = query.filter(MaintenanceSchedule.company_id == self.company_id)
+        if self._excluded_ids:
+            query = query.filter(MaintenanceSchedule.id.notin_(self._excluded_ids))
+        query = query.order_by(MaintenanceSchedule.next_due, MaintenanceSchedule.id).limit(self.batch_size)
+        if not self.dry_run:
+            query = query.with_for_update(skip_locked=True)
+        return query.all()
+
+    def _process(self, schedules: List[MaintenanceSchedule]):
+        self._load_creators({schedule.company_id for schedule in schedules})
+        checklist_items = self._checklist_items({s.sop_id for s in schedules if s.sop_id})
+
+        planned = []  # (schedule, scheduled date)
+        next_due = {}
+        for schedule in schedules:
+            occurrences, following = self._occurrences(schedule)
+            if following is None or self._creators.get(schedule.company_id) is None:
+                # Invalid recurrence rule or no admin to own the work orders
+                self._excluded_ids.add(schedule.id)
+                self.stats['skipped'] += 1
+                continue
+            planned.extend((schedule, due) for due in occurrences)
+            next_due[schedule.id] = following
+            self.stats['schedules'] += 1
+
+        self.stats['work_orders'] += len(planned)
+        self.stats['checklist_items'] += sum(len(checklist_items.get(s.sop_id, ())) for s, _ in planned)
+        if self.dry_run or not planned:
+            return
+
+        numbers = {}
+        per_company = defaultdict(int)
+        for schedule, _ in planned:
+            per_company[schedule.company_id] += 1
+        for company_id, count in per_company.items():
+            numbers[company_id] = iter(work_order_numbers.generate_many(company_id, count))
+        technicians = self._assign(planned)
+
+        rows = []
+        for schedule, due in planned:
+            rows.append({
+                'company_id': schedule.company_id,
+                'work_order_number': next(numbers[schedule.company_id]),
+                'title': f"PM: {schedule.description}",
+                'description': f"Preventive maintenance task: {schedule.description}",
+                'priority': 'medium',
+                'status': 'open',
+                'type': 'preventive',
+                'equipment_id': schedule.equipment_id,
+                'assigned_technician_id': next(technicians[schedule.company_id]),
+                'assigned_team_id': schedule.assigned_team_id,
+                'created_by_id': self._creators[schedule.company_id],
+                'scheduled_date': due,
+                'due_date': due + timedelta(hours=2),
+                'estimated_duration': schedule.estimated_duration,
+                'created_at': self.now,
+                'updated_at': self.now,
+            })
+        work_order_ids = db.session.execute(
+            insert(WorkOrder.__table__).returning(WorkOrder.__table__.c.id, sort_by_parameter_order=True),
+            rows,
+        ).scalars().all()
+
+        bulk_insert(WorkOrderChecklist, (
+            {
+                'work_order_id': work_order_id,
+                'sop_checklist_item_id': item_id,
+                'company_id': schedule.company_id,
+                'is_completed': False,
+                'created_at': self.now,
+            }
+            for work_order_id, (schedule, _) in zip(work_order_ids, planned)
+            for item_id in checklist_items.get(schedule.sop_id, ())
+        ))
+
+        db.session.execute(
+            update(MaintenanceSchedule)
+            .where(MaintenanceSchedule.id.in_(next_due))
+            .values(next_due=case(next_due, value=MaintenanceSchedule.id), updated_at=self.now)
+            .execution_options(synchronize_session=False)
+        )
+
+    def _occurrences(self, schedule):
+        """Due dates to generate within the horizon and the next due date after them"""
+        rule = rule_for(schedule)
+        if rule is None:
+            return [], None
+        occurrences = list(rule.occurrences(schedule.next_due, schedule.next_due, self.until))
+        following = rule.next_after(occurrences[-1])
+        missed = [occurrence for occurrence in occurrences if occurrence < self.now]
+        if len(missed) > 1:
+            occurrences = [missed[0]] + [occurrence for occurrence in occurrences if occurrence >= self.now]
+        return occurrences, following
+
+    def _load_creators(self, company_ids):
+        """Work orders are created on behalf of the company's first admin"""
+        missing = [company_id for company_id in company_ids if company_id not in self._creators]
+        if not missing:
+            return
+        self._creators.update({company_id: None for company_id in missing})
+        self._creators.update(dict(db.session.execute(
+            select(User.company_id, func.min(User.id))
+            .where(User.company_id.in_(missing), User.role == 'admin', User.is_active == True)
+            .group_by(User.company_id)
+        ).all()))
+
+    @staticmethod
+    def _assign(planned):
+        """Per company, an iterator of technician ids in ``planned`` order; work orders of team
+        schedules go to the least loaded team member (see dispatcher.py), others stay unassigned"""
+        equipment_ids = {schedule.equipment_id for schedule, _ in planned if schedule.assigned_team_id}
+        locations = {}
+        if equipment_ids:
+            locations = {equipment_id: location for equipment_id, location in db.session.execute(
+                select(Equipment.id, Location)
+                .join(Location, Location.id == Equipment.location_id)
+                .where(Equipment.id.in_(equipment_ids))
+            ).all()}
+
+        jobs = defaultdict(list)
+        for schedule, _ in planned:
+            if schedule.assigned_team_id:
+                jobs[schedule.company_id].append(
+                    DispatchJob('medium', locations.get(schedule.equipment_id), schedule.assigned_team_id))
+            else:
+                jobs[schedule.company_id].append(None)
+        assignments = {}
+        for company_id, company_jobs in jobs.items():
+            planned_ids = iter(dispatcher.plan(company_id, [job for job in company_jobs if job is not None]))
+            assignments[company_id] = iter([next(planned_ids) if job is not None else None for job in company_jobs])
+        return assignments
+
+    @staticmethod
+    def _checklist_items(sop_ids) -> Dict[int, List[int]]:
+        items = defaultdict(list)
+        if sop_ids:
+            for item_id, sop_id in db.session.execute(
+                    select(SOPChecklistItem.id, SOPChecklistItem.sop_id)
+                    .where(SOPChecklistItem.sop_id.in_(sop_ids))
+                    .order_by(SOPChecklistItem.sop_id, SOPChecklistItem.order)):
+                items[sop_id].append(item_id)
+        return items
@@ -0,0 +1,237 @@
+"""
+Request profiler for the CMMS application.
+
+Profiles a sample of live requests with cProfile and stores each run as a
+``.prof`` file (loadable with pstats, snakeviz or flameprof to draw a flame
+graph).  A request is profiled when any of these applies:
+
+    * it carries a signed ``?__profile=<token>`` generated from the admin page
+      and is made by the admin it was generated for
+    * it is made by a user of a company that has sampling enabled, its
+      endpoint is in that company's route list (an empty list means every
+      route) and it falls inside the company's sample rate
+
+Sampling settings are per company, so one tenant's admin cannot profile the
+requests of other tenants.  They are kept in ``<PROFILE_DIR>/settings.json``
+(keyed by company id) so that every worker process picks up changes made
+from ``/admin/perf/profiles``.
+"""
+import os
+import io
+import re
+import json
+import time
+import uuid
+import pstats
+import random
+import logging
+import cProfile
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Any
+
+from flask import g, request
+from flask_login import current_user
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+
+logger = logging.getLogger(__name__)
+
+PROFILE_QUERY_ARG = '__profile'
+_FILENAME = re.compile(r'^(?P<ts>\d{8}T\d{6})_c(?P<company>\d+|x)_(?P<endpoint>[\w.-]+)_(?P<ms>\d+)ms_[0-9a-f]{6}\.prof$')
+
+
+class RequestProfiler:
+    """Samples requests into cProfile dumps"""
+
+    DEFAULT_SETTINGS = {'enabled': False, 'sample_rate': 1.0, 'routes': []}
+
+    def __init__(self, app=None):
+        self.profile_dir = None
+        self.max_files = 200
+        self.token_max_age = 3600
+        self._serializer = None
+        self._settings: Dict[str, Dict[str, Any]] = {}  # Company id (as a string) -> settings
+        self._settings_mtime = None
+        # Only one profiler may be active per interpreter on newer Pythons
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PROFILE_DIR', os.getenv('PROFILE_DIR', os.path.join(app.root_path, 'profiles')))
+        app.config.setdefault('PROFILE_MAX_FILES', int(os.getenv('PROFILE_MAX_FILES', 200)))
+        app.config.setdefault('PROFILE_TOKEN_MAX_AGE', int(os.getenv('PROFILE_TOKEN_MAX_AGE', 3600)))
+
+        self.profile_dir = app.config['PROFILE_DIR']
+        self.max_files = app.config['PROFILE_MAX_FILES']
+        self.token_max_age = app.config['PROFILE_TOKEN_MAX_AGE']
+        self._serializer = URLSafeTimedSerializer(app.config['SECRET_KEY'] or '', salt='request-profiler')
+        os.makedirs(self.profile_dir, exist_ok=True)
+        app.extensions['request_profiler'] = self
+
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+
+    # Settings -----------------------------------------------------------
+
+    @property
+    def _settings_path(self) -> str:
+        return os.path.join(self.profile_dir, 'settings.json')
+
+    def _all_settings(self) -> Dict[str, Dict[str, Any]]:
+        """Settings of every company, re-read whenever another process changed the file"""
+        try:
+            mtime = os.path.getmtime(self._settings_path)
+        except OSError:
+            return self._settings
+        if mtime != self._settings_mtime:
+            try:
+                with open(self._settings_path, encoding='utf-8') as settings_file:
+                    settings = json.load(settings_file)
+                if 'enabled' in settings:
+                    # Single global settings of older versions; they applied to every tenant, so drop them
+                    settings = {}
+                self._settings = {company: {**self.DEFAULT_SETTINGS, **company_settings}
+                                  for company, company_settings in settings.items()}
+                self._settings_mtime = mtime
+            except (OSError, ValueError, AttributeError) as e:
+                logger.warning(f"Could not read profiler settings: {str(e)}")
+        return self._settings
+
+    def get_settings(self, company_id: int) -> Dict[str, Any]:
+        """Sampling settings of one company"""
+        return dict(self._all_settings().get(str(company_id), self.DEFAULT_SETTINGS))
+
+    def save_settings(self, company_id: int, enabled: bool, sample_rate: float, routes: List[str]):
+        all_settings = dict(self._all_settings())
+        all_settings[str(company_id)] = {
+            'enabled': bool(enabled),
+            'sample_rate': max(0.0, min(100.0, float(sample_rate))),
+            'routes': sorted({route.strip() for route in routes if route.strip()}),
+        }
+        tmp_path = f'{self._settings_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as settings_file:
+            json.dump(all_settings, settings_file)
+        os.replace(tmp_path, self._settings_path)
+        self._settings = all_settings
+        self._settings_mtime = os.path.getmtime(self._settings_path)
+
+    # Tokens -------------------------------------------------------------
+
+    def generate_token(self, user_id: int, company_id: int) -> str:
+        return self._serializer.dumps({'u': user_id, 'c': company_id})
+
+    def _token_is_valid(self, token: str) -> bool:
+        """A token only profiles requests of the user (and company) it was generated for, so a leaked
+        URL cannot be used to flood the profile directory"""
+        try:
+            payload = self._serializer.loads(token, max_age=self.token_max_age)
+        except (BadSignature, SignatureExpired):
+            return False
+        if not isinstance(payload, dict) or not current_user.is_authenticated:
+            return False
+        return payload.get('u') == current_user.id and payload.get('c') == current_user.company_id
+
+    # Request hooks ------------------------------------------------------
+
+    def _should_profile(self) -> bool:
+        if request.endpoint in (None, 'static') or (request.endpoint or '').startswith('admin_profile'):
+            return False
+        token = request.args.get(PROFILE_QUERY_ARG)
+        if token:
+            return self._token_is_valid(token)
+        all_settings = self._all_settings()
+        # Only load the user when some company samples at all
+        if not any(settings['enabled'] for settings in all_settings.values()):
+            return False
+        if not current_user.is_authenticated:
+            return False
+        settings = all_settings.get(str(current_user.company_id))
+        if not settings or not settings['enabled']:
+            return False
+        if settings['routes'] and request.endpoint not in settings['routes']:
+            return False
+        return random.random() * 100 < settings['sample_rate']
+
+    def _before_request(self):
+        if not self._should_profile():
+            return
+        if not self._lock.acquire(blocking=False):
+            return
+        profile = cProfile.Profile()
+        g._profiler = profile
+        g._profiler_start = time.perf_counter()
+        profile.enable()
+
+    def _teardown_request(self, exc=None):
+        profile = g.pop('_profiler', None)
+        if profile is None:
+            return
+        try:
+            profile.disable()
+            duration_ms = int((time.perf_counter() - g.pop('_profiler_start')) * 1000)
+            user = g.get('_login_user')
+            company_id = getattr(user, 'company_id', None) if user is not None else None
+            self._write(profile, request.endpoint or 'unknown', company_id, duration_ms)
+        except Exception as e:
+            logger.warning(f"Could not store request profile: {str(e)}")
+        finally:
+            self._lock.release()
+
+    # Storage ------------------------------------------------------------
+
+    def _write(self, profile: cProfile.Profile, endpoint: str, company_id: Optional[int], duration_ms: int):
+        filename = '{ts}_c{company}_{endpoint}_{ms}ms_{suffix}.prof'.format(
+            ts=datetime.utcnow().strftime('%Y%m%dT%H%M%S'),
+            company=company_id if company_id is not None else 'x',
+            endpoint=re.sub(r'[^\w.-]', '_', endpoint),
+            ms=duration_ms,
+            suffix=uuid.uuid4().hex[:6],
+        )
+        profile.dump_stats(os.path.join(self.profile_dir, filename))
+        self._prune()
+
+    def _prune(self):
+        files = sorted(name for name in os.listdir(self.profile_dir) if _FILENAME.match(name))
+        excess = len(files) - self.max_files
+        for name in files[:max(excess, 0)]:
+            try:
+                os.remove(os.path.join(self.profile_dir, name))
+            except OSError:
+                pass
+
+    def list_profiles(self, company_id: Optional[int] = None) -> List[Dict]:
+        """Stored profiles, newest first, optionally limited to one company"""
+        profiles = []
+        for name in os.listdir(self.profile_dir):
+            match = _FILENAME.match(name)
+            if not match:
+                continue
+            company = None if match.group('company') == 'x' else int(match.group('company'))
+            if company_id is not None and company != company_id:
+                continue
+            profiles.append({
+                'filename': name,
+                'created_at': datetime.strptime(match.group('ts'), '%Y%m%dT%H%M%S'),
+                'company_id': company,
+                'endpoint': match.group('endpoint'),
+                'duration_ms': int(match.group('ms')),
+                'size': os.path.getsize(os.path.join(self.profile_dir, name)),
+            })
+        return sorted(profiles, key=lambda profile: profile['filename'], reverse=True)
+
+    def get_profile(self, filename: str, company_id: Optional[int] = None) -> Optional[Dict]:
+        for profile in self.list_profiles(company_id):
+            if profile['filename'] == filename:
+                return profile
+        return None
+
+    def format_stats(self, filename: str, sort_by: str = 'cumulative', limit: int = 60) -> str:
+        """pstats text report for a stored profile"""
+        output = io.StringIO()
+        stats = pstats.Stats(os.path.join(self.profile_dir, filename), stream=output)
+        stats.strip_dirs().sort_stats(sort_by).print_stats(limit)
+        return output.getvalue()
+
+
+request_profiler = RequestProfiler()
@@ -0,0 +1,368 @@
+"""
+Calendar recurrence rules for maintenance schedules.
+
+A schedule's rule is its ``frequency`` / ``frequency_value`` plus the JSON
+``recurrence_options`` column:
+
+* ``day_of_month``: 1-31 (clamped to short months) or -1 for the last day
+  (monthly and yearly schedules);
+* ``weekday`` (0 = Monday) with ``week_of_month`` 1-4 or -1 for "the nth /
+  last <weekday> of the month", e.g. the second Tuesday (monthly and
+  yearly);
+* ``month``: 1-12 for yearly schedules;
+* ``weekdays``: list of weekdays for weekly schedules, e.g. ``[0, 3]``;
+* ``business_days``: daily schedules count Monday-Friday only, other
+  schedules move a weekend date to the next business day (or the previous
+  one when that would leave the month);
+* ``anchor``: ``fixed`` schedules stay on their calendar whenever the work is
+  done, ``floating`` schedules restart the interval from the completion date
+  (until then their future occurrences are projected from ``next_due``).
+
+Missing day rules of fixed schedules are taken from ``next_due`` when the
+schedule is saved, so "monthly from the 31st" stays on the last day of every month
+instead of drifting to the 28th after February.
+
+``next_due`` always holds the next occurrence (the PM generator scans it
+through an index); everything else is computed on demand by lazy
+generators.  Rules are immutable and cached per distinct option set, and
+occurrences are found by date arithmetic rather than by stepping through
+history, so expanding 50k schedules over a 12 month window only costs the
+occurrences themselves.
+
+Runtime and condition based schedules would need meter or condition
+readings, which are not recorded yet; they are expanded with their
+frequency as a calendar fallback.
+"""
+import json
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+
+FREQUENCIES = ('daily', 'weekly', 'monthly', 'yearly')
+ANCHORS = ('fixed', 'floating')
+WEEKDAY_NAMES = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday')
+_ORDINALS = {1: 'first', 2: 'second', 3: 'third', 4: 'fourth', -1: 'last'}
+_DAYS_IN_MONTH = (31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+
+class RecurrenceError(ValueError):
+    """Invalid recurrence options"""
+
+
+def _days_in_month(year: int, month: int) -> int:
+    if month == 2 and year % 4 == 0 and (year % 100 != 0 or year % 400 == 0):
+        return 29
+    return _DAYS_IN_MONTH[month - 1]
+
+
+def _add_months(year: int, month: int, months: int) -> Tuple[int, int]:
+    index = year * 12 + month - 1 + months
+    return index // 12, index % 12 + 1
+
+
+class RecurrenceRule:
+    __slots__ = ('frequency', 'interval', 'day_of_month', 'weekday', 'week_of_month', 'month',
+                 'weekdays', 'business_days', 'anchor')
+
+    def __init__(self, frequency: str, interval: int = 1, day_of_month: Optional[int] = None,
+                 weekday: Optional[int] = None, week_of_month: Optional[int] = None, month: Optional[int] = None,
+                 weekdays: Iterable[int] = (), business_days: bool = False, anchor: str = 'fixed'):
+        if frequency not in FREQUENCIES:
+            raise RecurrenceError(f'Unknown frequency "{frequency}"')
+        if anchor not in ANCHORS:
+            raise RecurrenceError(f'Anchor must be one of: {", ".join(ANCHORS)}')
+        if day_of_month is not None and not (day_of_month == -1 or 1 <= day_of_month <= 31):
+            raise RecurrenceError('Day of month must be 1-31 or -1 for the last day')
+        if (weekday is None) != (week_of_month is None):
+            raise RecurrenceError('Weekday and week of month must be given together')
+        if weekday is not None and not 0 <= weekday <= 6:
+            raise RecurrenceError('Weekday must be 0 (Monday) to 6 (Sunday)')
+        if week_of_month is not None and week_of_month not in _ORDINALS:
+            raise RecurrenceError('Week of month must be 1-4 or -1 for the last week')
+        if month is not None and not 1 <= month <= 12:
+            raise RecurrenceError('Month must be 1-12')
+        weekdays = tuple(sorted(set(weekdays or ())))
+        if any(not 0 <= day <= 6 for day in weekdays):
+            raise RecurrenceError('Weekdays must be 0 (Monday) to 6 (Sunday)')
+        self.frequency = frequency
+        self.interval = max(1, int(interval or 1))
+        self.day_of_month = day_of_month
+        self.weekday = weekday
+        self.week_of_month = week_of_month
+        self.month = month
+        self.weekdays = weekdays
+        self.business_days = bool(business_days)
+        self.anchor = anchor
+
+    # -- construction ---------------------------------------------------------
+
+    @classmethod
+    def from_options(cls, frequency: str, interval: Optional[int], options: Optional[str]) -> 'RecurrenceRule':
+        """Rule for a frequency / interval / JSON options triple (cached: schedules share rules)"""
+        return _rule(frequency, interval or 1, options or '')
+
+    def options(self) -> Dict[str, Any]:
+        """The JSON-serialisable options that, with frequency and interval, recreate this rule"""
+        options = {}
+        if self.day_of_month is not None:
+            options['day_of_month'] = self.day_of_month
+        if self.weekday is not None:
+            options['weekday'] = self.weekday
+            options['week_of_month'] = self.week_of_month
+        if self.month is not None:
+            options['month'] = self.month
+        if self.weekdays:
+            options['weekdays'] = list(self.weekdays)
+        if self.business_days:
+            options['business_days'] = True
+        if self.anchor != 'fixed':
+            options['anchor'] = self.anchor
+        return options
+
+    def with_defaults(self, start: datetime) -> 'RecurrenceRule':
+        """Fill in the day (and month) a fixed rule repeats on from its first occurrence"""
+        if self.anchor == 'floating':
+            # The completion date decides the day
+            return self
+        values = {slot: getattr(self, slot) for slot in self.__slots__}
+        if self.frequency in ('monthly', 'yearly') and self.day_of_month is None and self.weekday is None:
+            values['day_of_month'] = start.day
+        if self.frequency == 'yearly' and self.month is None:
+            values['month'] = start.month
+        if self.frequency == 'weekly' and not self.weekdays:
+            values['weekdays'] = (start.weekday(),)
+        return RecurrenceRule(**values)
+
+    def describe(self) -> str:
+        """Human readable summary, e.g. "Every 2 months on the last Friday" """
+        unit = {'daily': 'business day' if self.business_days else 'day',
+                'weekly': 'week', 'monthly': 'month', 'yearly': 'year'}[self.frequency]
+        text = f'Every {unit}' if self.interval == 1 else f'Every {self.interval} {unit}s'
+        if self.weekdays:
+            text += ' on ' + ', '.join(WEEKDAY_NAMES[day] for day in self.weekdays)
+        if self.weekday is not None:
+            text += f' on the {_ORDINALS[self.week_of_month]} {WEEKDAY_NAMES[self.weekday]}'
+        elif self.day_of_month == -1:
+            text += ' on the last day'
+        elif self.day_of_month is not None:
+            text += f' on day {self.day_of_month}'
+        if self.month is not None:
+            text += f' of {date(2000, self.month, 1).strftime("%B")}'
+        if self.business_days and self.frequency != 'daily':
+            text += ' (business days)'
+        if self.anchor == 'floating':
+            text += ', counted from completion'
+        return text
+
+    # -- occurrences ----------------------------------------------------------
+
+    def first_on_or_after(self, moment: datetime) -> datetime:
+        """The first occurrence at or after ``moment``, which starts the series"""
+        if self.frequency == 'daily':
+            return self._roll_forward(moment) if self.business_days else moment
+        if self.frequency == 'weekly':
+            week_start = moment - timedelta(days=moment.weekday())
+            for day in self.weekdays or (moment.weekday(),):
+                candidate = week_start + timedelta(days=day)
+                if candidate >= moment:
+                    return candidate
+            return week_start + timedelta(weeks=1, days=(self.weekdays or (moment.weekday(),))[0])
+        year, month = moment.year, moment.month
+        if self.frequency == 'yearly' and self.month is not None:
+            if self.month < month:
+                year += 1
+            month = self.month
+        # Compare before rolling so a start on a weekend keeps its own month
+        candidate = self._in_month(year, month, moment, roll=False)
+        if candidate < moment:
+            year, month = _add_months(year, month, 12 if self.frequency == 'yearly' else 1)
+            candidate = self._in_month(year, month, moment, roll=False)
+        return self._roll_within_month(candidate) if self.business_days else candidate
+
+    def next_after(self, occurrence: datetime) -> datetime:
+        """The occurrence following ``occurrence`` (which must be on this rule)"""
+        if self.frequency == 'daily':
+            if self.business_days:
+                return self._add_business_days(occurrence, self.interval)
+            return occurrence + timedelta(days=self.interval)
+        if self.frequency == 'weekly':
+            weekdays = self.weekdays or (occurrence.weekday(),)
+            current = occurrence.weekday()
+            for day in weekdays:
+                if day > current:
+                    return occurrence + timedelta(days=day - current)
+            return occurrence + timedelta(weeks=self.interval, days=weekdays[0] - current)
+        months = self.interval * (12 if self.frequency == 'yearly' else 1)
+        # Business-day rolling never leaves the month, so the occurrence's month is its grid month
+        year, month = _add_months(occurrence.year, occurrence.month, months)
+        return self._in_month(year, month, occurrence)
+
+    def occurrences(self, start: datetime, window_start: datetime, window_end: datetime) -> Iterator[datetime]:
+        """Lazily yield the occurrences of the series starting at ``start`` inside the window (inclusive)"""
+        occurrence = self._skip(start, window_start)
+        while occurrence <= window_end:
+            if occurrence >= window_start:
+                yield occurrence
+            occurrence = self.next_after(occurrence)
+
+    def after_completion(self, occurrence: Optional[datetime], completed_at: datetime) -> datetime:
+        """``next_due`` once the occurrence due at ``occurrence`` has been done at ``completed_at``"""
+        if self.anchor == 'floating' or occurrence is None:
+            if occurrence is not None:
+                # Keep the schedule's time of day
+                completed_at = datetime.combine(completed_at.date(), occurrence.time())
+            return self.first_on_or_after(self._step(completed_at))
+        following = self.next_after(occurrence)
+        while following <= completed_at:
+            following = self.next_after(following)
+        return following
+
+    def _step(self, moment: datetime) -> datetime:
+        """``moment`` plus one interval, ignoring the day rules"""
+        if self.frequency == 'daily':
+            return self._add_business_days(moment, self.interval) if self.business_days \
+                else moment + timedelta(days=self.interval)
+        if self.frequency == 'weekly':
+            return moment + timedelta(weeks=self.interval)
+        year, month = _add_months(moment.year, moment.month,
+                                  self.interval * (12 if self.frequency == 'yearly' else 1))
+        return moment.replace(year=year, month=month, day=min(moment.day, _days_in_month(year, month)))
+
+    def _skip(self, start: datetime, window_start: datetime) -> datetime:
+        """Jump close to ``window_start`` by arithmetic instead of stepping through every occurrence"""
+        if window_start <= start:
+            return start
+        if self.frequency == 'daily' and not self.business_days:
+            steps = (window_start - start).days // self.interval
+            return start + timedelta(days=steps * self.interval)
+        if self.frequency == 'weekly':
+            weeks = ((window_start - start).days // 7 // self.interval - 1) * self.interval
+            return start + timedelta(weeks=weeks) if weeks > 0 else start
+        if self.frequency in ('monthly', 'yearly'):
+            period = self.interval * (12 if self.frequency == 'yearly' else 1)
+            months = (window_start.year - start.year) * 12 + window_start.month - start.month
+            periods = months // period - 1
+            if periods > 0:
+                year, month = _add_months(start.year, start.month, periods * period)
+                return self._in_month(year, month, start)
+        return start
+
+    def _in_month(self, year: int, month: int, time_of: datetime, roll: bool = True) -> datetime:
+        last = _days_in_month(year, month)
+        if self.weekday is not None:
+            if self.week_of_month == -1:
+                day = last - (date(year, month, last).weekday() - self.weekday) % 7
+            else:
+                day = 1 + (self.weekday - date(year, month, 1).weekday()) % 7 + 7 * (self.week_of_month - 1)
+        elif self.day_of_month == -1:
+            day = last
+        else:
+            day = min(self.day_of_month or time_of.day, last)
+        candidate = time_of.replace(year=year, month=month, day=day)
+        return self._roll_within_month(candidate) if self.business_days and roll else candidate
+
+    @staticmethod
+    def _roll_forward(moment: datetime) -> datetime:
+        weekday = moment.weekday()
+        return moment + timedelta(days=7 - weekday) if weekday >= 5 else moment
+
+    @classmethod
+    def _roll_within_month(cls, moment: datetime) -> datetime:
+        """Modified following: the next business day unless that is in the next month"""
+        rolled = cls._roll_forward(moment)
+        if rolled.month != moment.month:
+            rolled = moment - timedelta(days=moment.weekday() - 4)
+        return rolled
+
+    @classmethod
+    def _add_business_days(cls, moment: datetime, days: int) -> datetime:
+        moment = cls._roll_forward(moment)
+        weeks, days = divmod(days, 5)
+        moment += timedelta(weeks=weeks)
+        weekday = moment.weekday()
+        if weekday + days >= 5:
+            days += 2
+        return moment + timedelta(days=days)
+
+
+@lru_cache(maxsize=4096)
+def _rule(frequency: str, interval: int, options: str) -> RecurrenceRule:
+    try:
+        values = json.loads(options) if options else {}
+    except ValueError:
+        raise RecurrenceError('Recurrence options are not valid JSON')
+    if not isinstance(values, dict):
+        raise RecurrenceError('Recurrence options must be a JSON object')
+    known = set(RecurrenceRule.__slots__) - {'frequency', 'interval'}
+    return RecurrenceRule(frequency, interval, **{key: value for key, value in values.items() if key in known})
+
+
+def rule_for(schedule) -> Optional[RecurrenceRule]:
+    """The schedule's rule, or None when its frequency or options are invalid"""
+    try:
+        return RecurrenceRule.from_options(schedule.frequency, schedule.frequency_value,
+                                           getattr(schedule, 'recurrence_options', None))
+    except RecurrenceError:
+        return None
+
+
+REPEATS_ON = (
+    ('day', 'Same day of the month'),
+    ('last_day', 'Last day of the month'),
+    ('weekday', 'Same weekday of the month (e.g. 2nd Tuesday)'),
+    ('last_weekday', 'Last weekday of the month (e.g. last Friday)'),
+)
+
+
+def build_rule(frequency: str, interval: Optional[int], start: datetime, repeats_on: str = 'day',
+               business_days: bool = False, anchor: str = 'fixed') -> RecurrenceRule:
+    """Rule from the schedule form; ``repeats_on`` (see REPEATS_ON) is read off the first due date"""
+    options: Dict[str, Any] = {'business_days': business_days, 'anchor': anchor}
+    if frequency in ('monthly', 'yearly'):
+        if repeats_on == 'last_day':
+            options['day_of_month'] = -1
+        elif repeats_on in ('weekday', 'last_weekday'):
+            week = (start.day - 1) // 7 + 1
+            options['weekday'] = start.weekday()
+            options['week_of_month'] = -1 if repeats_on == 'last_weekday' or week > 4 else week
+    return RecurrenceRule(frequency, interval or 1, **options)
+
+
+def repeats_on(rule: RecurrenceRule) -> str:
+    """The REPEATS_ON choice matching ``rule``"""
+    if rule.weekday is not None:
+        return 'last_weekday' if rule.week_of_month == -1 else 'weekday'
+    return 'last_day' if rule.day_of_month == -1 else 'day'
+
+
+def apply_rule(schedule, rule: RecurrenceRule, start: datetime):
+    """Store ``rule`` on the schedule and set ``next_due`` to its first occurrence from ``start``"""
+    rule = rule.with_defaults(start)
+    schedule.frequency = rule.frequency
+    schedule.frequency_value = rule.interval
+    schedule.recurrence_options = json.dumps(rule.options()) if rule.options() else None
+    schedule.next_due = rule.first_on_or_after(start)
+
+
+def complete_schedule(schedule, completed_at: Optional[datetime] = None):
+    """Record that the due maintenance was done and advance ``next_due``"""
+    completed_at = completed_at or datetime.utcnow()
+    schedule.last_performed = completed_at
+    rule = rule_for(schedule)
+    if rule is not None:
+        schedule.next_due = rule.after_completion(schedule.next_due, completed_at)
+
+
+def expand(schedules: Iterable[Tuple[int, str, Optional[int], Optional[str], datetime]],
+           window_start: datetime, window_end: datetime) -> Iterator[Tuple[int, datetime]]:
+    """Yield ``(schedule_id, occurrence)`` for ``(id, frequency, frequency_value, recurrence_options,
+    next_due)`` rows, e.g. straight from a column query, skipping rows with invalid rules"""
+    for schedule_id, frequency, interval, options, next_due in schedules:
+        if next_due is None:
+            continue
+        try:
+            rule = RecurrenceRule.from_options(frequency, interval, options)
+        except RecurrenceError:
+            continue
+        for occurrence in rule.occurrences(next_due, window_start, window_end):
+            yield schedule_id, occurrence
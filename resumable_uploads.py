@@ -0,0 +1,244 @@
+"""
+Resumable, chunked media uploads (a subset of the tus 1.0 protocol).
+
+A client creates an upload with its total size and metadata, then sends the
+bytes in ``PATCH`` requests that each carry the offset they start at.  When
+the connection drops, ``HEAD`` tells the client how many bytes the server
+already has and it carries on from there instead of starting over.  A
+complete upload is finalized into the work order's (or comment's) media
+through the media store, like any other upload.
+
+Every chunk is streamed from the request straight onto the end of a file in
+``RESUMABLE_UPLOAD_DIR``, so an upload never sits in worker memory, and the
+size of that file is the offset -- there is no other state to get out of
+sync.  Next to it a small JSON file records the owner, size and metadata.
+Uploads untouched for ``RESUMABLE_UPLOAD_EXPIRY_HOURS`` are removed.
+
+Supported tus extensions: ``creation`` and ``termination``.
+"""
+import base64
+import json
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Dict, Optional
+
+from werkzeug.exceptions import ClientDisconnected
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows: concurrent PATCHes are then not detected
+    fcntl = None
+
+TUS_VERSION = '1.0.0'
+TUS_EXTENSIONS = 'creation,termination'
+CHUNK_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    """A request that violates the protocol; ``status`` is the HTTP status to answer with"""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+def parse_metadata(header: Optional[str]) -> Dict[str, str]:
+    """tus ``Upload-Metadata``: comma-separated ``key base64(value)`` pairs"""
+    metadata = {}
+    for pair in (header or '').split(','):
+        pair = pair.strip()
+        if not pair:
+            continue
+        key, _, value = pair.partition(' ')
+        try:
+            metadata[key] = base64.b64decode(value.strip(), validate=True).decode('utf-8') if value else ''
+        except (ValueError, UnicodeDecodeError):
+            raise UploadError(f'Invalid Upload-Metadata value for "{key}"')
+    return metadata
+
+
+class Upload:
+    def __init__(self, store: 'ResumableUploadStore', upload_id: str, info: dict):
+        self.store = store
+        self.id = upload_id
+        self.info = info
+
+    @property
+    def data_path(self) -> str:
+        return os.path.join(self.store.directory, f'{self.id}.part')
+
+    @property
+    def info_path(self) -> str:
+        return os.path.join(self.store.directory, f'{self.id}.json')
+
+    @property
+    def length(self) -> int:
+        return self.info['length']
+
+    @property
+    def metadata(self) -> Dict[str, str]:
+        return self.info['metadata']
+
+    @property
+    def offset(self) -> int:
+        try:
+            return os.path.getsize(self.data_path)
+        except OSError:
+            return 0
+
+    @property
+    def complete(self) -> bool:
+        return self.offset == self.length
+
+
+class ResumableUploadStore:
+    def __init__(self, app=None):
+        self.directory = None
+        self.max_size = 512 * 1024 * 1024
+        self.expiry = 24 * 3600
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RESUMABLE_UPLOAD_DIR',
+                              os.getenv('RESUMABLE_UPLOAD_DIR', os.path.join(app.instance_path, 'resumable_uploads')))
+        app.config.setdefault('RESUMABLE_UPLOAD_MAX_SIZE', int(os.getenv('RESUMABLE_UPLOAD_MAX_SIZE', str(512 * 1024 * 1024))))
+        app.config.setdefault('RESUMABLE_UPLOAD_EXPIRY_HOURS', float(os.getenv('RESUMABLE_UPLOAD_EXPIRY_HOURS', '24')))
+        self.directory = app.config['RESUMABLE_UPLOAD_DIR']
+        self.max_size = int(app.config['RESUMABLE_UPLOAD_MAX_SIZE'])
+        self.expiry = float(app.config['RESUMABLE_UPLOAD_EXPIRY_HOURS']) * 3600
+        app.extensions['resumable_uploads'] = self
+
+    # -- lifecycle ----------------------------------------------------------
+
+    def create(self, user, length: int, metadata: Dict[str, str]) -> Upload:
+        if length < 0:
+            raise UploadError('Upload-Length must not be negative')
+        if length > self.max_size:
+            raise UploadError(f'Upload exceeds the maximum size of {self.max_size} bytes', 413)
+        os.makedirs(self.directory, exist_ok=True)
+        self.sweep()
+        upload = Upload(self, uuid.uuid4().hex, {
+            'user_id': user.id,
+            'company_id': user.company_id,
+            'length': length,
+            'metadata': metadata,
+            'created_at': datetime.utcnow().isoformat(),
+        })
+        open(upload.data_path, 'wb').close()
+        self._write_info(upload)
+        return upload
+
+    def get(self, upload_id: str, user) -> Upload:
+        """The upload, if it exists and belongs to ``user``"""
+        if not upload_id.isalnum():
+            raise UploadError('Upload not found', 404)
+        try:
+            with open(os.path.join(self.directory, f'{upload_id}.json')) as info_file:
+                info = json.load(info_file)
+        except (OSError, ValueError):
+            raise UploadError('Upload not found', 404)
+        if info.get('user_id') != user.id or info.get('company_id') != user.company_id:
+            raise UploadError('Upload not found', 404)
+        return Upload(self, upload_id, info)
+
+    def append(self, upload: Upload, offset: int, stream, content_length: Optional[int] = None) -> int:
+        """Write the request body onto the upload at ``offset``; returns the new offset.
+
+        Whatever arrived before a dropped connection is kept, so the client can
+        resume from the offset ``HEAD`` reports.
+        """
+        with self._locked(upload) as data_file:
+            current = os.fstat(data_file.fileno()).st_size
+            if offset != current:
+                raise UploadError(f'Upload-Offset {offset} does not match the current offset {current}', 409)
+            remaining = upload.length - current
+            if content_length is not None and content_length > remaining:
+                raise UploadError('Chunk goes past Upload-Length', 413)
+            try:
+                while remaining > 0:
+                    chunk = stream.read(min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    data_file.write(chunk)
+                    remaining -= len(chunk)
+            except ClientDisconnected:
+                pass
+            finally:
+                data_file.flush()
+                os.fsync(data_file.fileno())
+            if remaining == 0 and stream.read(1):
+                raise UploadError('Chunk goes past Upload-Length', 413)
+            return os.fstat(data_file.fileno()).st_size
+
+    def finalize(self, upload: Upload, store: Callable[[str, str], str]) -> str:
+        """Hand a complete upload to ``store(data_path, filename)``, which moves it into place and
+        returns the stored path"""
+        if not upload.complete:
+            raise UploadError(f'Upload is incomplete ({upload.offset} of {upload.length} bytes)', 409)
+        with self._locked(upload):
+            path = store(upload.data_path, upload.metadata.get('filename') or 'upload')
+        self._remove(upload)
+        return path
+
+    def delete(self, upload: Upload):
+        with self._locked(upload):
+            self._remove(upload)
+
+    def sweep(self):
+        """Remove uploads that have not received data for longer than the expiry"""
+        cutoff = time.time() - self.expiry
+        try:
+            entries = list(os.scandir(self.directory))
+        except OSError:
+            return
+        for entry in entries:
+            if entry.name.endswith('.json'):
+                data_path = entry.path[:-len('.json')] + '.part'
+                try:
+                    touched = max(entry.stat().st_mtime, os.path.getmtime(data_path) if os.path.exists(data_path) else 0)
+                    if touched < cutoff:
+                        os.remove(entry.path)
+                        if os.path.exists(data_path):
+                            os.remove(data_path)
+                except OSError:
+                    continue
+
+    # -- helpers ------------------------------------------------------------
+
+    def _write_info(self, upload: Upload):
+        temporary = f'{upload.info_path}.tmp'
+        with open(temporary, 'w') as info_file:
+            json.dump(upload.info, info_file)
+        os.replace(temporary, upload.info_path)
+
+    @staticmethod
+    def _remove(upload: Upload):
+        for path in (upload.data_path, upload.info_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    @contextmanager
+    def _locked(self, upload: Upload):
+        """The upload's data file opened for appending, locked against concurrent requests"""
+        try:
+            data_file = os.fdopen(os.open(upload.data_path, os.O_WRONLY | os.O_APPEND), 'ab')
+        except OSError:
+            raise UploadError('Upload not found', 404)
+        try:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(data_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    raise UploadError('Another request is writing to this upload', 423)
+            yield data_file
+        finally:
+            data_file.close()
+
+
+resumable_uploads = ResumableUploadStore()
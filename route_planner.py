@@ -0,0 +1,269 @@
+"""
+Daily route planning for technicians.
+
+``plan_day`` orders a technician's open work orders for a day into a walking
+/ driving route.  Each stop's coordinates come from the work order's
+location, or the location of its equipment; stops without coordinates are
+listed after the route, most urgent first.
+
+The route starts at the technician's current position (when the device
+sends one) or home location, and is an open path -- it does not return.  It
+minimises
+
+    cost = route_km + ROUTE_URGENCY_WEIGHT * weighted mean arrival_km
+
+where each stop's weight is its priority (low 1 ... urgent 5) scaled up to
+3x as its due time approaches (overdue stops count 3x).  The second term
+pulls urgent and nearly due stops forward without ignoring geography;
+``ROUTE_URGENCY_WEIGHT = 0`` plans the shortest path.
+
+The heuristic is an urgency-weighted nearest-neighbour tour improved with
+2-opt.  Prefix sums of the weights and arrival distances make every 2-opt
+move an O(1) evaluation, so 200 stops plan in a fraction of a second.
+"""
+import math
+from datetime import date, datetime, timedelta
+from typing import List, Optional, Tuple
+
+from flask import current_app
+from sqlalchemy import and_, or_, select
+from sqlalchemy.orm import aliased
+
+from extensions import db
+from models import Equipment, Location, WorkOrder
+from visibility import assigned_work_orders_filter
+from dispatcher import PRIORITY_WEIGHTS
+
+ROUTE_STATUSES = ('open', 'in_progress')
+EARTH_RADIUS_KM = 6371.0
+DUE_SOON_HOURS = 24
+MAX_PASSES = 50
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def urgency(priority: Optional[str], due_date: Optional[datetime], now: datetime) -> float:
+    """Priority weight, times 1-3 as the due date gets within a day (3 when overdue)"""
+    weight = PRIORITY_WEIGHTS.get(priority or 'medium', PRIORITY_WEIGHTS['medium'])
+    if due_date is None:
+        return float(weight)
+    hours = (due_date - now).total_seconds() / 3600
+    if hours <= 0:
+        return weight * 3.0
+    return weight * (1 + 2 * max(0.0, 1 - hours / DUE_SOON_HOURS))
+
+
+class Stop:
+    """A work order to visit"""
+
+    def __init__(self, work_order_id: int, latitude: Optional[float], longitude: Optional[float],
+                 weight: float = 1.0, **details):
+        self.work_order_id = work_order_id
+        self.latitude = latitude
+        self.longitude = longitude
+        self.weight = weight
+        self.details = details
+        self.leg_km: Optional[float] = None
+
+    @property
+    def located(self) -> bool:
+        return self.latitude is not None and self.longitude is not None
+
+    def to_dict(self, sequence: Optional[int] = None) -> dict:
+        return {
+            'sequence': sequence,
+            'work_order_id': self.work_order_id,
+            'latitude': self.latitude,
+            'longitude': self.longitude,
+            'leg_km': round(self.leg_km, 3) if self.leg_km is not None else None,
+            'urgency': round(self.weight, 2),
+            **self.details,
+        }
+
+
+class Route:
+    def __init__(self, stops: List[Stop], unlocated: List[Stop], start: Optional[Tuple[float, float]]):
+        self.stops = stops
+        self.unlocated = unlocated
+        self.start = start
+        self.total_km = sum(stop.leg_km or 0.0 for stop in stops)
+
+    @property
+    def work_order_ids(self) -> List[int]:
+        return [stop.work_order_id for stop in self.stops + self.unlocated]
+
+    def to_dict(self) -> dict:
+        return {
+            'start': {'latitude': self.start[0], 'longitude': self.start[1]} if self.start else None,
+            'total_km': round(self.total_km, 3),
+            'stops': [stop.to_dict(sequence) for sequence, stop in enumerate(self.stops, 1)],
+            'unlocated': [stop.to_dict() for stop in self.unlocated],
+        }
+
+
+def _distance_matrix(points: List[Tuple[float, float]], start: Optional[Tuple[float, float]]) -> List[List[float]]:
+    """Node 0 is the start; without one it is a virtual node 0 km from every stop"""
+    nodes = [start] + points
+    size = len(nodes)
+    matrix = [[0.0] * size for _ in range(size)]
+    for i in range(size):
+        if nodes[i] is None:
+            continue
+        lat1, lon1 = nodes[i]
+        row = matrix[i]
+        for j in range(i + 1, size):
+            row[j] = matrix[j][i] = haversine_km(lat1, lon1, *nodes[j])
+    return matrix
+
+
+def _nearest_neighbour(dist: List[List[float]], weights: List[float]) -> List[int]:
+    """Greedy tour from node 0, preferring close and urgent stops (distance / urgency)"""
+    remaining = set(range(1, len(dist)))
+    tour = [0]
+    while remaining:
+        row = dist[tour[-1]]
+        nxt = min(remaining, key=lambda j: (row[j] / weights[j], -weights[j], j))
+        remaining.remove(nxt)
+        tour.append(nxt)
+    return tour
+
+
+def _two_opt(tour: List[int], dist: List[List[float]], weights: List[float], urgency_weight: float) -> List[int]:
+    """Improve the open path ``tour`` (fixed at node 0) with segment reversals.
+
+    Reversing positions a..b changes the arrival distance of the stops inside
+    the segment and shifts every later stop by the same amount, so with prefix
+    sums of weights (``W``) and weighted arrivals (``WA``) each candidate move
+    is priced in constant time.
+    """
+    last = len(tour) - 1
+    if last < 2:
+        return tour
+    scale = urgency_weight / (sum(weights) or 1.0)
+
+    def prefix_sums():
+        arrival = [0.0] * (last + 1)
+        w_sum = [0.0] * (last + 2)
+        wa_sum = [0.0] * (last + 2)
+        for k in range(1, last + 1):
+            arrival[k] = arrival[k - 1] + dist[tour[k - 1]][tour[k]]
+        for k in range(last + 1):
+            w = weights[tour[k]]
+            w_sum[k + 1] = w_sum[k] + w
+            wa_sum[k + 1] = wa_sum[k] + w * arrival[k]
+        return arrival, w_sum, wa_sum
+
+    arrival, w_sum, wa_sum = prefix_sums()
+    for _ in range(MAX_PASSES):
+        improved = False
+        for a in range(1, last):
+            p_node = tour[a - 1]
+            p_row = dist[p_node]
+            a_node = tour[a]
+            old_pa = p_row[a_node]
+            arrival_p = arrival[a - 1]
+            for b in range(a + 1, last + 1):
+                b_node = tour[b]
+                if b < last:
+                    n_node = tour[b + 1]
+                    delta = p_row[b_node] + dist[a_node][n_node] - old_pa - dist[b_node][n_node]
+                else:
+                    delta = p_row[b_node] - old_pa
+                inside_w = w_sum[b + 1] - w_sum[a]
+                inside_wa = wa_sum[b + 1] - wa_sum[a]
+                latency = ((arrival_p + p_row[b_node] + arrival[b]) * inside_w - 2 * inside_wa
+                           + delta * (w_sum[last + 1] - w_sum[b + 1]))
+                if delta + scale * latency < -1e-9:
+                    tour[a:b + 1] = tour[a:b + 1][::-1]
+                    arrival, w_sum, wa_sum = prefix_sums()
+                    a_node = tour[a]
+                    old_pa = p_row[a_node]
+                    improved = True
+        if not improved:
+            break
+    return tour
+
+
+def plan_route(stops: List[Stop], start: Optional[Tuple[float, float]] = None,
+               urgency_weight: float = 1.0) -> Route:
+    """Order ``stops`` from ``start`` (latitude, longitude); see the module docstring"""
+    located = [stop for stop in stops if stop.located]
+    unlocated = sorted((stop for stop in stops if not stop.located), key=lambda stop: (-stop.weight, stop.work_order_id))
+    if not located:
+        return Route([], unlocated, start)
+
+    dist = _distance_matrix([(stop.latitude, stop.longitude) for stop in located], start)
+    weights = [0.0] + [max(stop.weight, 0.01) for stop in located]
+    tour = _two_opt(_nearest_neighbour(dist, weights), dist, weights, urgency_weight)
+
+    ordered = []
+    for previous, node in zip(tour, tour[1:]):
+        stop = located[node - 1]
+        stop.leg_km = dist[previous][node] if previous or start is not None else 0.0
+        ordered.append(stop)
+    return Route(ordered, unlocated, start)
+
+
+def day_stops(user, day: date, now: Optional[datetime] = None) -> List[Stop]:
+    """``user``'s open and in-progress work orders for ``day``: scheduled on or before it, or
+    unscheduled and due on or before it (or undated)"""
+    now = now or datetime.now()
+    day_end = datetime(day.year, day.month, day.day) + timedelta(days=1)
+    wo_location = aliased(Location)
+    equipment_location = aliased(Location)
+    rows = db.session.execute(
+        select(WorkOrder.id, WorkOrder.work_order_number, WorkOrder.title, WorkOrder.priority, WorkOrder.status,
+               WorkOrder.due_date, WorkOrder.scheduled_date, Equipment.name.label('equipment_name'),
+               wo_location.name.label('wo_location_name'), wo_location.latitude.label('wo_latitude'),
+               wo_location.longitude.label('wo_longitude'), equipment_location.name.label('equipment_location_name'),
+               equipment_location.latitude.label('equipment_latitude'),
+               equipment_location.longitude.label('equipment_longitude'))
+        .outerjoin(Equipment, Equipment.id == WorkOrder.equipment_id)
+        .outerjoin(wo_location, wo_location.id == WorkOrder.location_id)
+        .outerjoin(equipment_location, equipment_location.id == Equipment.location_id)
+        .where(WorkOrder.company_id == user.company_id,
+               assigned_work_orders_filter(user),
+               WorkOrder.status.in_(ROUTE_STATUSES),
+               or_(WorkOrder.scheduled_date < day_end,
+                   and_(WorkOrder.scheduled_date == None,
+                        or_(WorkOrder.due_date == None, WorkOrder.due_date < day_end))))
+    ).all()
+
+    stops = []
+    for row in rows:
+        if row.wo_latitude is not None and row.wo_longitude is not None:
+            latitude, longitude, location_name = row.wo_latitude, row.wo_longitude, row.wo_location_name
+        else:
+            latitude, longitude = row.equipment_latitude, row.equipment_longitude
+            location_name = row.wo_location_name or row.equipment_location_name
+        stops.append(Stop(
+            row.id, latitude, longitude, urgency(row.priority, row.due_date, now),
+            work_order_number=row.work_order_number, title=row.title, priority=row.priority, status=row.status,
+            due_date=row.due_date.isoformat() if row.due_date else None,
+            equipment_name=row.equipment_name, location_name=location_name,
+        ))
+    return stops
+
+
+def home_position(user) -> Optional[Tuple[float, float]]:
+    """Coordinates of the technician's home location, if it has any"""
+    if not user.location_id:
+        return None
+    row = db.session.execute(
+        select(Location.latitude, Location.longitude).where(Location.id == user.location_id)
+    ).first()
+    if row is None or row.latitude is None or row.longitude is None:
+        return None
+    return row.latitude, row.longitude
+
+
+def plan_day(user, day: Optional[date] = None, start: Optional[Tuple[float, float]] = None) -> Route:
+    """Route through ``user``'s work orders for ``day`` (default today), from ``start`` or their home location"""
+    day = day or date.today()
+    start = start or home_position(user)
+    urgency_weight = float(current_app.config.get('ROUTE_URGENCY_WEIGHT', 1.0))
+    return plan_route(day_stops(user, day), start, urgency_weight)
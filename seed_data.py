@@ -0,0 +1,469 @@
+"""
+Synthetic tenant generator for the CMMS application.
+
+Builds complete companies (roles, users, teams, locations, equipment,
+inventory, work orders, comments, maintenance schedules and notification
+logs) with realistic distributions of statuses, priorities, durations, due
+dates, team memberships and media references.
+
+Rows are generated lazily and written in large batches (see bulk_load.py):
+PostgreSQL uses ``COPY ... FROM STDIN``, other databases a multi-row
+``INSERT`` executemany, so millions of work orders can be seeded in minutes.  Used by the
+``flask seed`` command and the benchmark suite.
+"""
+import random
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Any
+
+from sqlalchemy import select
+from werkzeug.security import generate_password_hash
+
+from models import (db, Company, Role, User, Team, user_teams, Location, Equipment, Inventory,
+                    WorkOrder, WorkOrderComment, WorkOrderMedia, MaintenanceSchedule, NotificationLog)
+from work_order_numbers import work_order_numbers, format_work_order_number
+from bulk_load import bulk_insert
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SCALE = {
+    'technicians': 20,
+    'teams': 4,
+    'locations': 10,
+    'equipment': 500,
+    'inventory': 200,
+    'work_orders': 5000,
+    'comments': 10000,
+    'schedules': 300,
+    'notifications': 5000,
+}
+
+SEED_PASSWORD = 'password123'
+
+
+class ScaleError(ValueError):
+    """A scale that cannot be generated; ``option`` is the setting to change"""
+
+    def __init__(self, message: str, option: str):
+        super().__init__(message)
+        self.option = option
+
+
+def resolve_scale(scale: Optional[Dict[str, Optional[int]]] = None) -> Dict[str, int]:
+    """``scale`` on top of ``DEFAULT_SCALE``, checked before anything is written"""
+    scale = {**DEFAULT_SCALE, **{key: value for key, value in (scale or {}).items() if value is not None}}
+    for key, value in scale.items():
+        if value < 0:
+            raise ScaleError(f'{key} cannot be negative', key)
+    if scale['equipment'] < 1 and (scale['work_orders'] > 0 or scale['schedules'] > 0):
+        raise ScaleError('at least 1 equipment is needed for work orders and maintenance schedules', 'equipment')
+    if scale['teams'] < 1 and scale['technicians'] > 0:
+        raise ScaleError('at least 1 team is needed for technicians', 'teams')
+    return scale
+
+OPEN_STATUSES = [('open', 60), ('in_progress', 40)]
+CLOSED_STATUSES = [('completed', 92), ('cancelled', 8)]
+OPEN_SHARE = 0.2
+WORK_ORDER_PRIORITIES = [('low', 20), ('medium', 45), ('high', 25), ('urgent', 10)]
+WORK_ORDER_TYPES = [('corrective', 55), ('preventive', 35), ('emergency', 10)]
+EQUIPMENT_STATUSES = [('operational', 80), ('maintenance', 12), ('offline', 5), ('out_of_service', 3)]
+CRITICALITIES = [('low', 25), ('medium', 45), ('high', 22), ('critical', 8)]
+FREQUENCIES = [('daily', 5), ('weekly', 30), ('monthly', 45), ('yearly', 20)]
+NOTIFICATION_STATUSES = [('delivered', 70), ('sent', 20), ('pending', 5), ('failed', 5)]
+CATEGORIES = ['Pumps', 'Motors', 'HVAC', 'Compressors', 'Conveyors', 'Electrical', 'Boilers', 'Valves']
+MANUFACTURERS = ['Acme', 'Globex', 'Initech', 'Umbrella', 'Stark', 'Wayne']
+TASKS = ['Inspect', 'Lubricate', 'Replace filter on', 'Calibrate', 'Repair leak on', 'Clean', 'Tighten belts on',
+         'Check vibration of', 'Replace bearings on', 'Test safety interlock on']
+COMMENTS = ['Started work', 'Waiting for parts', 'Parts arrived, resuming', 'Issue found during inspection',
+            'Completed, monitoring', 'Needs follow-up by electrician', 'Photo attached']
+
+# Typical hours until due by priority, and median duration in minutes by type
+DUE_HOURS = {'urgent': 8, 'high': 48, 'medium': 7 * 24, 'low': 14 * 24}
+DURATION_MINUTES = {'preventive': 60, 'corrective': 120, 'emergency': 180}
+MEDIA_MIME_TYPES = {'jpg': 'image/jpeg', 'mp4': 'video/mp4', 'webm': 'audio/webm'}
+
+
+class WeightedChoice:
+    """Fast repeated weighted sampling with precomputed cumulative weights"""
+
+    def __init__(self, rng: random.Random, weighted):
+        self.rng = rng
+        self.values, weights = zip(*weighted)
+        total = 0
+        self.cum_weights = []
+        for weight in weights:
+            total += weight
+            self.cum_weights.append(total)
+
+    def __call__(self):
+        return self.rng.choices(self.values, cum_weights=self.cum_weights)[0]
+
+
+class TenantSeeder:
+    """Generates one synthetic company per call to ``seed_company``"""
+
+    def __init__(self, batch_size: int = 5000, seed: Optional[int] = None):
+        self.batch_size = batch_size
+        self.random = random.Random(seed)
+        self.now = datetime.utcnow().replace(microsecond=0)
+        self._password_hash = None
+        rng = self.random
+        self.priority = WeightedChoice(rng, WORK_ORDER_PRIORITIES)
+        self.work_order_type = WeightedChoice(rng, WORK_ORDER_TYPES)
+        self.open_status = WeightedChoice(rng, OPEN_STATUSES)
+        self.closed_status = WeightedChoice(rng, CLOSED_STATUSES)
+        self.equipment_status = WeightedChoice(rng, EQUIPMENT_STATUSES)
+        self.criticality = WeightedChoice(rng, CRITICALITIES)
+        self.frequency = WeightedChoice(rng, FREQUENCIES)
+        self.notification_status = WeightedChoice(rng, NOTIFICATION_STATUSES)
+
+    # Bulk writing -------------------------------------------------------
+
+    def _bulk_insert(self, model, rows: Iterable[Dict[str, Any]]) -> int:
+        """Write rows in batches; every row of one call must have the same keys"""
+        return bulk_insert(model, rows, self.batch_size)
+
+    def _ids(self, column, company_id: int) -> List[int]:
+        table = column.class_
+        return list(db.session.execute(
+            select(column).where(table.company_id == company_id).order_by(column)
+        ).scalars())
+
+    def _skewed_weights(self, count: int) -> List[float]:
+        """Pareto-like cumulative weights so a few technicians carry most of the work"""
+        total = 0.0
+        cum_weights = []
+        for _ in range(count):
+            total += self.random.paretovariate(1.5)
+            cum_weights.append(total)
+        return cum_weights
+
+    # Company ------------------------------------------------------------
+
+    def seed_company(self, name: str, scale: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+        """Create a company at the given scale and return the ids of its key rows"""
+        from app import (create_default_roles_for_company, create_default_departments_for_company,
+                         create_default_categories_for_company)
+
+        scale = resolve_scale(scale)
+        if self._password_hash is None:
+            self._password_hash = generate_password_hash(SEED_PASSWORD)
+
+        company = Company(name=name)
+        db.session.add(company)
+        db.session.commit()
+        company_id = company.id
+        create_default_roles_for_company(company_id)
+        create_default_departments_for_company(company_id)
+        create_default_categories_for_company(company_id)
+        roles = {role.name: role.id for role in Role.query.filter_by(company_id=company_id)}
+
+        user_ids = self._seed_users(company_id, roles, scale['technicians'])
+        technician_ids = user_ids['technicians']
+        team_ids = self._seed_teams(company_id, technician_ids, scale['teams'])
+        location_ids = self._seed_locations(company_id, name, scale['locations'])
+        equipment_ids = self._seed_equipment(company_id, user_ids['admin'], location_ids, scale['equipment'])
+        self._seed_inventory(company_id, scale['inventory'])
+        db.session.commit()
+
+        work_order_ids = self._seed_work_orders(company_id, user_ids['admin'], technician_ids, team_ids,
+                                                equipment_ids, location_ids, scale['work_orders'])
+        db.session.commit()
+        self._seed_comments(company_id, technician_ids, work_order_ids, scale['comments'])
+        schedule_ids = self._seed_schedules(company_id, equipment_ids, team_ids, scale['schedules'])
+        self._seed_notifications(company_id, technician_ids, work_order_ids, schedule_ids, scale['notifications'])
+        db.session.commit()
+
+        return {
+            'company_id': company_id,
+            'admin_id': user_ids['admin'],
+            'manager_id': user_ids['manager'],
+            'technician_ids': technician_ids,
+            'team_ids': team_ids,
+            'equipment_ids': equipment_ids,
+            'work_order_ids': work_order_ids,
+        }
+
+    def _seed_users(self, company_id: int, roles: Dict[str, int], technicians: int) -> Dict[str, Any]:
+        def user_row(username, first_name, last_name, role):
+            return {
+                'company_id': company_id,
+                'username': username,
+                'email': f'{username}@example.com',
+                'password_hash': self._password_hash,
+                'first_name': first_name,
+                'last_name': last_name,
+                'role': role,
+                'role_id': roles.get(role),
+                'department': 'Maintenance',
+                'is_active': self.random.random() > 0.03 if role == 'technician' else True,
+                'created_at': self.now,
+                'updated_at': self.now,
+            }
+
+        rows = [
+            user_row(f'c{company_id}.admin', 'Admin', f'Company {company_id}', 'admin'),
+            user_row(f'c{company_id}.manager', 'Manager', f'Company {company_id}', 'manager'),
+        ]
+        rows += [user_row(f'c{company_id}.tech{i}', 'Tech', str(i), 'technician') for i in range(1, technicians + 1)]
+        self._bulk_insert(User, rows)
+
+        users = db.session.execute(
+            select(User.id, User.role).where(User.company_id == company_id).order_by(User.id)
+        ).all()
+        return {
+            'admin': next(user_id for user_id, role in users if role == 'admin'),
+            'manager': next(user_id for user_id, role in users if role == 'manager'),
+            'technicians': [user_id for user_id, role in users if role == 'technician'],
+        }
+
+    def _seed_teams(self, company_id: int, technician_ids: List[int], teams: int) -> List[int]:
+        if not teams:
+            return []
+        self._bulk_insert(Team, [{
+            'company_id': company_id,
+            'name': f'Team {i}',
+            'description': f'Maintenance crew {i}',
+            'is_active': True,
+            'created_at': self.now,
+            'updated_at': self.now,
+        } for i in range(1, teams + 1)])
+        team_ids = self._ids(Team.id, company_id)
+
+        # Every technician has a home team; about a third also cover a second one
+        memberships = set()
+        for index, technician_id in enumerate(technician_ids):
+            memberships.add((technician_id, team_ids[index % len(team_ids)]))
+            if self.random.random() < 0.3:
+                memberships.add((technician_id, self.random.choice(team_ids)))
+        self._bulk_insert(user_teams, [{'user_id': user_id, 'team_id': team_id} for user_id, team_id in memberships])
+        return team_ids
+
+    def _seed_locations(self, company_id: int, company_name: str, locations: int) -> List[int]:
+        # Sites cluster around a few metro areas
+        centers = [(self.random.uniform(30.0, 45.0), self.random.uniform(-120.0, -75.0))
+                   for _ in range(max(1, locations // 10))]
+        rows = []
+        for i in range(1, locations + 1):
+            latitude, longitude = self.random.choice(centers)
+            rows.append({
+                'company_id': company_id,
+                'name': f'{company_name} Site {i}',
+                'city': f'City {i % 7}',
+                'country': 'USA',
+                'latitude': round(latitude + self.random.gauss(0, 0.2), 6),
+                'longitude': round(longitude + self.random.gauss(0, 0.2), 6),
+                'is_active': True,
+                'created_at': self.now,
+                'updated_at': self.now,
+            })
+        self._bulk_insert(Location, rows)
+        return self._ids(Location.id, company_id)
+
+    def _seed_equipment(self, company_id: int, admin_id: int, location_ids: List[int], equipment: int) -> List[int]:
+        def rows():
+            for i in range(1, equipment + 1):
+                category = self.random.choice(CATEGORIES)
+                location_id = self.random.choice(location_ids) if location_ids else None
+                yield {
+                    'company_id': company_id,
+                    'name': f'{category.rstrip("s")} {i}',
+                    'equipment_id': f'C{company_id}-EQ-{i:06d}',
+                    'category': category,
+                    'manufacturer': self.random.choice(MANUFACTURERS),
+                    'model': f'M-{self.random.randint(100, 999)}',
+                    'serial_number': f'SN{company_id:03d}{i:08d}',
+                    'location': f'Site {location_id}' if location_id else None,
+                    'location_id': location_id,
+                    'department': 'Production',
+                    'status': self.equipment_status(),
+                    'criticality': self.criticality(),
+                    'created_at': self.now - timedelta(days=self.random.randint(30, 1500)),
+                    'updated_at': self.now,
+                    'created_by_id': admin_id,
+                }
+        self._bulk_insert(Equipment, rows())
+        return self._ids(Equipment.id, company_id)
+
+    def _seed_inventory(self, company_id: int, inventory: int):
+        def rows():
+            for i in range(1, inventory + 1):
+                minimum = self.random.randint(0, 20)
+                yield {
+                    'company_id': company_id,
+                    'part_number': f'C{company_id}-P-{i:06d}',
+                    'name': f'Spare part {i}',
+                    'category': self.random.choice(CATEGORIES),
+                    'manufacturer': self.random.choice(MANUFACTURERS),
+                    'unit_cost': round(self.random.lognormvariate(3, 1.2), 2),
+                    'currency': 'USD',
+                    # About one in ten parts is below its minimum stock
+                    'current_stock': self.random.randint(0, minimum) if self.random.random() < 0.1
+                    else self.random.randint(minimum, minimum + 200),
+                    'minimum_stock': minimum,
+                    'unit_of_measure': 'pieces',
+                    'is_active': True,
+                    'created_at': self.now,
+                    'updated_at': self.now,
+                }
+        self._bulk_insert(Inventory, rows())
+
+    def _seed_media(self, company_id: int, owner_type: str, owners, media):
+        """``work_order_media`` rows for ``(owner_id, uploaded_by_id, created_at)`` owners; ``media`` is
+        ``(kind, extension, probability)``, each owner getting 1-3 files of a kind with that probability"""
+        def rows():
+            for owner_id, uploaded_by_id, created_at in owners:
+                for kind, extension, probability in media:
+                    if self.random.random() >= probability:
+                        continue
+                    for _ in range(self.random.randint(1, 3)):
+                        yield {
+                            'company_id': company_id,
+                            'owner_type': owner_type,
+                            'owner_id': owner_id,
+                            'kind': kind,
+                            'path': f'uploads/{kind}s/seed_{self.random.getrandbits(48):012x}.{extension}',
+                            'size': self.random.randint(50_000, 5_000_000),
+                            'mime_type': MEDIA_MIME_TYPES[extension],
+                            'uploaded_by_id': uploaded_by_id,
+                            'created_at': created_at,
+                        }
+        self._bulk_insert(WorkOrderMedia, rows())
+
+    def _seed_work_orders(self, company_id: int, admin_id: int, technician_ids: List[int], team_ids: List[int],
+                          equipment_ids: List[int], location_ids: List[int], work_orders: int) -> List[int]:
+        technician_weights = self._skewed_weights(len(technician_ids))
+        year_minutes = 365 * 24 * 60
+
+        first_number = work_order_numbers.reserve(company_id, work_orders, connection=db.session.connection())
+
+        def rows():
+            for i in range(1, work_orders + 1):
+                is_open = self.random.random() < OPEN_SHARE
+                status = self.open_status() if is_open else self.closed_status()
+                # Open work is recent; closed work is spread over the last year
+                age_minutes = self.random.randint(0, 30 * 24 * 60) if is_open else self.random.randint(0, year_minutes)
+                created_at = self.now - timedelta(minutes=age_minutes)
+                priority = self.priority()
+                work_order_type = self.work_order_type()
+                estimated = max(15, int(round(DURATION_MINUTES[work_order_type] * self.random.lognormvariate(0, 0.4), -1)))
+                scheduled_date = created_at + timedelta(hours=self.random.uniform(0, DUE_HOURS[priority] / 2))
+                due_date = created_at + timedelta(hours=DUE_HOURS[priority] * self.random.uniform(0.8, 1.5))
+
+                row = {
+                    'company_id': company_id,
+                    'work_order_number': format_work_order_number(company_id, first_number + i - 1),
+                    'title': f'{self.random.choice(TASKS)} {self.random.choice(CATEGORIES).lower().rstrip("s")}',
+                    'description': 'Generated work order',
+                    'priority': priority,
+                    'status': status,
+                    'type': work_order_type,
+                    'equipment_id': self.random.choice(equipment_ids),
+                    'location_id': self.random.choice(location_ids) if location_ids and self.random.random() < 0.5 else None,
+                    'assigned_technician_id': None,
+                    'assigned_team_id': None,
+                    'created_by_id': admin_id,
+                    'scheduled_date': scheduled_date,
+                    'due_date': due_date,
+                    'estimated_duration': estimated,
+                    'actual_duration': None,
+                    'actual_start_time': None,
+                    'actual_end_time': None,
+                    'completion_notes': None,
+                    'created_at': created_at,
+                    'updated_at': created_at,
+                }
+                assignment = self.random.random()
+                if assignment < 0.7 and technician_ids:
+                    row['assigned_technician_id'] = self.random.choices(technician_ids, cum_weights=technician_weights)[0]
+                elif assignment < 0.92 and team_ids:
+                    row['assigned_team_id'] = self.random.choice(team_ids)
+
+                if status in ('in_progress', 'completed'):
+                    row['actual_start_time'] = scheduled_date + timedelta(minutes=self.random.randint(0, 240))
+                    row['updated_at'] = row['actual_start_time']
+                if status == 'completed':
+                    actual = max(5, int(estimated * self.random.lognormvariate(0.05, 0.35)))
+                    row['actual_duration'] = actual
+                    row['actual_end_time'] = row['actual_start_time'] + timedelta(minutes=actual)
+                    row['updated_at'] = row['actual_end_time']
+                    row['completion_notes'] = 'Completed as planned' if self.random.random() < 0.8 else 'Completed with follow-up required'
+                yield row
+
+        self._bulk_insert(WorkOrder, rows())
+        # Completion photos, videos and voice notes
+        completed = db.session.execute(
+            select(WorkOrder.id, WorkOrder.assigned_technician_id, WorkOrder.actual_end_time)
+            .where(WorkOrder.company_id == company_id, WorkOrder.status == 'completed')
+        ).all()
+        self._seed_media(company_id, 'work_order', completed,
+                         (('image', 'jpg', 0.35), ('video', 'mp4', 0.05), ('audio', 'webm', 0.1)))
+        return self._ids(WorkOrder.id, company_id)
+
+    def _seed_comments(self, company_id: int, technician_ids: List[int], work_order_ids: List[int], comments: int):
+        if not technician_ids or not work_order_ids:
+            return
+
+        def rows():
+            for _ in range(comments):
+                yield {
+                    'work_order_id': self.random.choice(work_order_ids),
+                    'user_id': self.random.choice(technician_ids),
+                    'company_id': company_id,
+                    'comment': self.random.choice(COMMENTS),
+                    'created_at': self.now - timedelta(minutes=self.random.randint(0, 365 * 24 * 60)),
+                }
+        self._bulk_insert(WorkOrderComment, rows())
+        comments = db.session.execute(
+            select(WorkOrderComment.id, WorkOrderComment.user_id, WorkOrderComment.created_at)
+            .where(WorkOrderComment.company_id == company_id)
+        ).all()
+        self._seed_media(company_id, 'comment', comments, (('image', 'jpg', 0.1), ('audio', 'webm', 0.05)))
+
+    def _seed_schedules(self, company_id: int, equipment_ids: List[int], team_ids: List[int], schedules: int) -> List[int]:
+        def rows():
+            for _ in range(schedules):
+                frequency = self.frequency()
+                yield {
+                    'company_id': company_id,
+                    'equipment_id': self.random.choice(equipment_ids),
+                    'schedule_type': 'calendar',
+                    'frequency': frequency,
+                    'frequency_value': self.random.choice([1, 1, 1, 2, 3]) if frequency != 'daily' else 1,
+                    'description': f'{self.random.choice(TASKS)} equipment',
+                    'estimated_duration': self.random.choice([30, 60, 120]),
+                    'is_active': self.random.random() > 0.05,
+                    'last_performed': self.now - timedelta(days=self.random.randint(1, 60)),
+                    'next_due': self.now + timedelta(days=self.random.randint(-7, 60)),
+                    'assigned_team_id': self.random.choice(team_ids) if team_ids else None,
+                    'created_at': self.now,
+                    'updated_at': self.now,
+                }
+        self._bulk_insert(MaintenanceSchedule, rows())
+        return self._ids(MaintenanceSchedule.id, company_id)
+
+    def _seed_notifications(self, company_id: int, technician_ids: List[int], work_order_ids: List[int],
+                            schedule_ids: List[int], notifications: int):
+        if not technician_ids:
+            return
+
+        def rows():
+            for _ in range(notifications):
+                created_at = self.now - timedelta(minutes=self.random.randint(0, 90 * 24 * 60))
+                status = self.notification_status()
+                is_schedule = schedule_ids and self.random.random() < 0.1
+                yield {
+                    'company_id': company_id,
+                    'notification_type': 'whatsapp' if self.random.random() < 0.6 else 'email',
+                    'recipient_id': self.random.choice(technician_ids),
+                    'subject': 'Maintenance due' if is_schedule else 'Work order assigned',
+                    'content': 'Generated notification',
+                    'status': status,
+                    'error_message': 'Recipient unreachable' if status == 'failed' else None,
+                    'work_order_id': None if is_schedule or not work_order_ids else self.random.choice(work_order_ids),
+                    'maintenance_schedule_id': self.random.choice(schedule_ids) if is_schedule else None,
+                    'sent_at': created_at if status != 'pending' else None,
+                    'delivered_at': created_at + timedelta(seconds=self.random.randint(1, 120)) if status == 'delivered' else None,
+                    'created_at': created_at,
+                }
+        self._bulk_insert(NotificationLog, rows())
@@ -0,0 +1,259 @@
+"""
+Slow query log for the CMMS application.
+
+Every SQL statement that takes longer than ``SLOW_QUERY_THRESHOLD_MS`` is
+written as one JSON line to a rotating log file, together with the route and
+company that issued it and an automatically captured ``EXPLAIN`` plan.  The
+entries are browsable from the admin-only ``/admin/perf/slow-queries`` page.
+
+Configuration (environment variables, mirrored into ``app.config``):
+
+    SLOW_QUERY_THRESHOLD_MS      threshold in milliseconds, 0 disables (default 500)
+    SLOW_QUERY_EXPLAIN           capture an EXPLAIN plan for slow SELECTs (default true)
+    SLOW_QUERY_EXPLAIN_ANALYZE   use EXPLAIN ANALYZE on PostgreSQL (default false)
+    SLOW_QUERY_LOG_PATH          log file location (default logs/slow_queries.log)
+"""
+import os
+import re
+import json
+import time
+import logging
+from collections import deque
+from datetime import datetime, date
+from decimal import Decimal
+from logging.handlers import RotatingFileHandler
+from typing import Dict, List, Optional, Any
+
+import sqlalchemy
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+from extensions import db
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r'\s+')
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER = re.compile(r'%\(\w+\)s|%s|\?')
+_PLACEHOLDER_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+
+
+def _env_flag(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def normalize_sql(statement: str) -> str:
+    """Collapse whitespace and replace literals/placeholders so equal queries group together"""
+    sql = _WHITESPACE.sub(' ', statement).strip()
+    sql = _STRING_LITERAL.sub('?', sql)
+    sql = _NUMBER_LITERAL.sub('?', sql)
+    sql = _PLACEHOLDER.sub('?', sql)
+    return _PLACEHOLDER_LIST.sub('(?, ...)', sql)
+
+
+def redact_value(value: Any) -> Any:
+    """Keep values that describe the query shape (ids, limits, dates) and hide free text"""
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, str):
+        return f'<str:{len(value)}>'
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f'<bytes:{len(value)}>'
+    return f'<{type(value).__name__}>'
+
+
+def redact_parameters(parameters: Any) -> Any:
+    if isinstance(parameters, dict):
+        return {key: redact_value(value) for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [redact_value(value) for value in parameters]
+    return redact_value(parameters)
+
+
+def _loaded_attribute(obj: Any, name: str) -> Any:
+    """Read an already-loaded attribute without triggering a refresh query"""
+    state = sqlalchemy.inspect(obj, raiseerr=False)
+    if state is None:
+        return getattr(obj, name, None)
+    return state.dict.get(name)
+
+
+class SlowQueryLog:
+    """Times every statement on the application engine and records the slow ones"""
+
+    def __init__(self, app=None):
+        self.threshold_ms = 0
+        self.explain = True
+        self.explain_analyze = False
+        self.log_path = None
+        self._file_logger = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SLOW_QUERY_THRESHOLD_MS', float(os.getenv('SLOW_QUERY_THRESHOLD_MS', 500)))
+        app.config.setdefault('SLOW_QUERY_EXPLAIN', _env_flag('SLOW_QUERY_EXPLAIN', True))
+        app.config.setdefault('SLOW_QUERY_EXPLAIN_ANALYZE', _env_flag('SLOW_QUERY_EXPLAIN_ANALYZE', False))
+        app.config.setdefault('SLOW_QUERY_LOG_PATH', os.getenv(
+            'SLOW_QUERY_LOG_PATH', os.path.join(app.root_path, 'logs', 'slow_queries.log')))
+        app.config.setdefault('SLOW_QUERY_LOG_MAX_BYTES', 5 * 1024 * 1024)
+        app.config.setdefault('SLOW_QUERY_LOG_BACKUP_COUNT', 5)
+
+        self.threshold_ms = app.config['SLOW_QUERY_THRESHOLD_MS']
+        self.explain = app.config['SLOW_QUERY_EXPLAIN']
+        self.explain_analyze = app.config['SLOW_QUERY_EXPLAIN_ANALYZE']
+        self.log_path = app.config['SLOW_QUERY_LOG_PATH']
+        app.extensions['slow_query_log'] = self
+
+        if not self.threshold_ms:
+            logger.info("Slow query log disabled (SLOW_QUERY_THRESHOLD_MS=0)")
+            return
+
+        os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+        handler = RotatingFileHandler(
+            self.log_path,
+            maxBytes=app.config['SLOW_QUERY_LOG_MAX_BYTES'],
+            backupCount=app.config['SLOW_QUERY_LOG_BACKUP_COUNT'],
+            encoding='utf-8',
+        )
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        self._file_logger = logging.getLogger('cmms.slow_queries')
+        self._file_logger.setLevel(logging.INFO)
+        self._file_logger.propagate = False
+        self._file_logger.handlers = [handler]
+
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(db.engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('slow_query_start', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('slow_query_start')
+        if not starts:
+            return
+        duration_ms = (time.perf_counter() - starts.pop()) * 1000
+        if duration_ms < self.threshold_ms:
+            return
+        try:
+            self._record(conn, cursor, statement, parameters, executemany, duration_ms)
+        except Exception as e:
+            logger.warning(f"Could not record slow query: {str(e)}")
+
+    def _record(self, conn, cursor, statement, parameters, executemany, duration_ms):
+        entry = {
+            'timestamp': datetime.utcnow().isoformat(timespec='seconds'),
+            'duration_ms': round(duration_ms, 2),
+            'sql': normalize_sql(statement),
+            'parameters': None if executemany else redact_parameters(parameters),
+            'executemany': bool(executemany),
+            'route': None,
+            'method': None,
+            'path': None,
+            'company_id': None,
+            'user_id': None,
+            'plan': None,
+        }
+        if has_request_context():
+            entry['route'] = request.endpoint
+            entry['method'] = request.method
+            entry['path'] = request.path
+            user = g.get('_login_user')
+            if user is not None:
+                entry['company_id'] = _loaded_attribute(user, 'company_id')
+                entry['user_id'] = _loaded_attribute(user, 'id')
+
+        if self.explain and not executemany and statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+            entry['plan'] = self._explain(conn, cursor, statement, parameters)
+
+        self._file_logger.info(json.dumps(entry, default=str))
+
+    def _explain(self, conn, cursor, statement, parameters) -> Optional[str]:
+        """Run EXPLAIN on the raw DBAPI connection so it bypasses the engine events"""
+        dialect = conn.dialect.name
+        if dialect == 'postgresql':
+            prefix = 'EXPLAIN (ANALYZE, BUFFERS) ' if self.explain_analyze else 'EXPLAIN '
+        elif dialect == 'sqlite':
+            prefix = 'EXPLAIN QUERY PLAN '
+        else:
+            prefix = 'EXPLAIN '
+
+        raw = cursor.connection.cursor()
+        try:
+            # A failed EXPLAIN must not abort the transaction the request is using
+            if dialect == 'postgresql':
+                raw.execute('SAVEPOINT slow_query_explain')
+            try:
+                raw.execute(prefix + statement, parameters)
+                rows = raw.fetchall()
+            except Exception as e:
+                if dialect == 'postgresql':
+                    raw.execute('ROLLBACK TO SAVEPOINT slow_query_explain')
+                return f'EXPLAIN failed: {str(e)}'
+            if dialect == 'postgresql':
+                raw.execute('RELEASE SAVEPOINT slow_query_explain')
+        finally:
+            raw.close()
+
+        if dialect == 'sqlite':
+            return '\n'.join(str(row[-1]) for row in rows)
+        return '\n'.join(' '.join(str(column) for column in row) for row in rows)
+
+    def read_entries(self, limit: int = 500, company_id: Optional[int] = None,
+                     route: Optional[str] = None) -> List[Dict]:
+        """Return the most recent entries (newest first), optionally scoped to a company/route"""
+        if not self.log_path:
+            return []
+        entries = deque(maxlen=limit)
+        paths = [f'{self.log_path}.1', self.log_path]
+        for path in paths:
+            if not os.path.exists(path):
+                continue
+            with open(path, encoding='utf-8') as log_file:
+                for line in log_file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if company_id is not None and entry.get('company_id') != company_id:
+                        continue
+                    if route and entry.get('route') != route:
+                        continue
+                    entries.append(entry)
+        return list(reversed(entries))
+
+    @staticmethod
+    def summarize(entries: List[Dict]) -> List[Dict]:
+        """Group entries by normalized SQL and route, slowest total time first"""
+        groups = {}
+        for entry in entries:
+            key = (entry.get('sql'), entry.get('route'))
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = {
+                    'sql': entry.get('sql'),
+                    'route': entry.get('route'),
+                    'count': 0,
+                    'total_ms': 0.0,
+                    'max_ms': 0.0,
+                    'last_seen': entry.get('timestamp'),
+                }
+            group['count'] += 1
+            group['total_ms'] += entry.get('duration_ms') or 0
+            group['max_ms'] = max(group['max_ms'], entry.get('duration_ms') or 0)
+        for group in groups.values():
+            group['avg_ms'] = round(group['total_ms'] / group['count'], 2)
+            group['total_ms'] = round(group['total_ms'], 2)
+        return sorted(groups.values(), key=lambda group: group['total_ms'], reverse=True)
+
+
+slow_query_log = SlowQueryLog()
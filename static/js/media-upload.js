@@ -8,6 +8,11 @@ class MediaUploadManager {
         this.offlineQueue = [];
         this.isOnline = navigator.onLine;
         this.maxFileSize = 50 * 1024 * 1024; // 50MB
+        // Larger files go through the resumable upload API in chunks (see resumable_uploads.py)
+        this.resumableThreshold = 5 * 1024 * 1024; // 5MB
+        this.maxResumableSize = 512 * 1024 * 1024; // 512MB (RESUMABLE_UPLOAD_MAX_SIZE)
+        this.chunkSize = 5 * 1024 * 1024; // 5MB per PATCH
+        this.maxChunkRetries = 5;
         this.supportedImageTypes = ['image/jpeg', 'image/png', 'image/webp', 'image/gif'];
         this.supportedVideoTypes = ['video/mp4', 'video/webm', 'video/ogg'];
         this.supportedAudioTypes = ['audio/mp3', 'audio/wav', 'audio/ogg', 'audio/m4a'];
@@ -45,8 +50,9 @@ class MediaUploadManager {
     async validateAndCompressFile(file, type) {
         return new Promise((resolve, reject) => {
             // Check file size
-            if (file.size > this.maxFileSize) {
-                reject(new Error(`File size exceeds ${this.maxFileSize / (1024 * 1024)}MB limit`));
+            const sizeLimit = type === 'image' ? this.maxFileSize : this.maxResumableSize;
+            if (file.size > sizeLimit) {
+                reject(new Error(`File size exceeds ${sizeLimit / (1024 * 1024)}MB limit`));
                 return;
             }
 
@@ -131,7 +137,7 @@ class MediaUploadManager {
     }
 
     // Upload with progress tracking
-    async uploadFile(file, type, workOrderId, commentId = null) {
+    async uploadFile(file, type, workOrderId, commentId = null, onProgress = null) {
         const validatedFile = await this.validateAndCompressFile(file, type);
         
         if (!this.isOnline) {
@@ -140,14 +146,24 @@ class MediaUploadManager {
             return { success: true, offline: true, message: 'File saved for offline upload' };
         }
 
+        if (validatedFile.size > this.resumableThreshold) {
+            try {
+                const result = await this.uploadResumable(validatedFile, type, workOrderId, commentId, onProgress);
+                this.showNotification(`${type} uploaded successfully!`, 'success');
+                return result;
+            } catch (error) {
+                // Unless the upload expired, the bytes already sent stay on the server; the next attempt resumes from there
+                console.error('Resumable upload failed:', error);
+                this.showNotification(error.expired ? 'Upload expired on the server. Please upload the file again.'
+                                                    : 'Upload interrupted. It will resume where it stopped.', 'warning');
+                return { success: false, message: error.message };
+            }
+        }
+
         const formData = new FormData();
         formData.append('media_type', type);
-        
-        if (commentId) {
-            formData.append('images', validatedFile);
-        } else {
-            formData.append('images', validatedFile);
-        }
+        const fieldNames = { image: 'images', video: 'videos', audio: 'voice_notes' };
+        formData.append(fieldNames[type] || 'images', validatedFile);
 
         const endpoint = commentId 
             ? `/api/work-orders/${workOrderId}/comments/${commentId}/upload-media`
@@ -176,6 +192,116 @@ class MediaUploadManager {
         }
     }
 
+    // Resumable upload (tus 1.0): create, PATCH chunks at the server's offset, finalize.
+    // The upload URL is remembered per file, so a page reload or a dropped connection
+    // continues from the last byte the server stored instead of starting over.
+    async uploadResumable(file, type, workOrderId, commentId = null, onProgress = null) {
+        const key = `resumableUpload:${workOrderId}:${commentId || ''}:${file.name}:${file.size}:${file.lastModified}`;
+        let uploadUrl = localStorage.getItem(key);
+        // Throws while the network is down, keeping the stored URL for the next attempt
+        let offset = uploadUrl ? await this.resumableOffset(uploadUrl) : null;
+
+        if (offset === null) {
+            const metadata = { filename: file.name, media_type: type, work_order_id: workOrderId };
+            if (commentId) {
+                metadata.comment_id = commentId;
+            }
+            const response = await fetch('/api/uploads', {
+                method: 'POST',
+                headers: {
+                    'Tus-Resumable': '1.0.0',
+                    'Upload-Length': String(file.size),
+                    'Upload-Metadata': Object.entries(metadata)
+                        .map(([name, value]) => `${name} ${btoa(unescape(encodeURIComponent(String(value))))}`)
+                        .join(',')
+                }
+            });
+            if (response.status !== 201) {
+                const result = await response.json().catch(() => ({}));
+                throw new Error(result.message || `Upload could not be created (${response.status})`);
+            }
+            uploadUrl = response.headers.get('Location');
+            localStorage.setItem(key, uploadUrl);
+            offset = 0;
+        }
+
+        let failures = 0;
+        while (offset < file.size) {
+            if (onProgress) {
+                onProgress(offset, file.size);
+            }
+            try {
+                const response = await fetch(uploadUrl, {
+                    method: 'PATCH',
+                    headers: {
+                        'Tus-Resumable': '1.0.0',
+                        'Content-Type': 'application/offset+octet-stream',
+                        'Upload-Offset': String(offset)
+                    },
+                    body: file.slice(offset, offset + this.chunkSize)
+                });
+                if (response.status === 404 || response.status === 410) {
+                    localStorage.removeItem(key);
+                    throw this.uploadExpiredError();
+                }
+                if (response.status !== 204) {
+                    throw new Error(`Chunk rejected (${response.status})`);
+                }
+                offset = parseInt(response.headers.get('Upload-Offset'), 10);
+                failures = 0;
+            } catch (error) {
+                if (error.expired || ++failures > this.maxChunkRetries) {
+                    throw error;
+                }
+                // Back off, then ask the server how much it has before sending again
+                await new Promise(resolve => setTimeout(resolve, Math.min(30000, 1000 * 2 ** failures)));
+                try {
+                    const serverOffset = await this.resumableOffset(uploadUrl);
+                    if (serverOffset === null) {
+                        localStorage.removeItem(key);
+                        throw this.uploadExpiredError();
+                    }
+                    offset = serverOffset;
+                } catch (offsetError) {
+                    if (offsetError.expired) {
+                        throw offsetError;
+                    }
+                    // Still unreachable: keep the upload and retry after the next back-off
+                }
+            }
+        }
+        if (onProgress) {
+            onProgress(file.size, file.size);
+        }
+
+        const response = await fetch(`${uploadUrl}/finalize`, { method: 'POST' });
+        const result = await response.json();
+        if (!result.success) {
+            throw new Error(result.message);
+        }
+        localStorage.removeItem(key);
+        return result;
+    }
+
+    // Bytes the server already has for an upload, or null when it no longer exists (404/410).
+    // Network errors and other statuses throw: the upload may still be there.
+    async resumableOffset(uploadUrl) {
+        const response = await fetch(uploadUrl, { method: 'HEAD', headers: { 'Tus-Resumable': '1.0.0' } });
+        if (response.status === 404 || response.status === 410) {
+            return null;
+        }
+        if (!response.ok) {
+            throw new Error(`Upload status check failed (${response.status})`);
+        }
+        return parseInt(response.headers.get('Upload-Offset'), 10);
+    }
+
+    uploadExpiredError() {
+        const error = new Error('Upload expired on the server');
+        error.expired = true;
+        return error;
+    }
+
     // Offline queue management
     addToOfflineQueue(file, type, workOrderId, commentId = null) {
         const queueItem = {
@@ -0,0 +1,180 @@
+"""
+Thumbnails and previews of uploaded photos.
+
+Pages used to embed every photo at full resolution -- a few megabytes per
+phone picture, on a mobile connection.  For each photo this module renders
+smaller derivatives:
+
+* ``thumb`` -- at most 320 px on the long side, for grids and lists;
+* ``medium`` -- at most 1280 px, for the full-screen preview.
+
+They are encoded as WebP (``THUMBNAIL_FORMAT=jpeg`` for JPEG), with the EXIF
+orientation applied, so a photo taken in portrait is not shown sideways.
+Derivatives of stored blobs are named after their content, as
+``static/uploads/thumbs/<size>/ab/cd/<sha256>.webp``, so they never go stale
+and are never rendered twice.
+
+Rendering is CPU bound, so ``enqueue`` hands it to a process pool of
+``THUMBNAIL_WORKERS`` processes (0 renders in the calling process) and
+returns at once; uploads do not wait for it.  Until a derivative exists,
+``derivative`` returns the original path, so pages keep working -- and it
+enqueues the missing derivative, which backfills photos uploaded before
+this existed.  ``flask generate-thumbnails`` renders them all up front.
+Derivatives are removed with their blob (see media_store.py).
+"""
+import atexit
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+from media_store import media_store
+
+SIZES = {'thumb': 320, 'medium': 1280}
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.webp'}
+FORMATS = {'webp': ('WEBP', 'webp'), 'jpeg': ('JPEG', 'jpg')}
+
+
+def render_derivatives(source: str, targets: List[Tuple[str, int]], image_format: str, quality: int):
+    """Write a copy of the image at ``source`` no larger than ``max_px`` to each ``(destination, max_px)``.
+
+    Runs in a worker process, so it only gets plain paths and numbers.
+    """
+    with Image.open(source) as image:
+        largest = max(max_px for _, max_px in targets)
+        image.draft('RGB', (largest, largest))  # JPEG: decode straight at a reduced scale
+        image = ImageOps.exif_transpose(image)
+        has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+        mode = 'RGBA' if has_alpha and image_format == 'WEBP' else 'RGB'
+        if image.mode != mode:
+            image = image.convert(mode)
+        # Largest first: each size is scaled down from the previous one
+        for destination, max_px in sorted(targets, key=lambda target: -target[1]):
+            image.thumbnail((max_px, max_px), Image.LANCZOS)
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            temporary = f'{destination}.{os.getpid()}.tmp'
+            image.save(temporary, image_format, quality=quality)
+            os.replace(temporary, destination)
+
+
+class Thumbnailer:
+    def __init__(self, app=None):
+        self.prefix = 'uploads/thumbs'
+        self.sizes: Dict[str, int] = dict(SIZES)
+        self.image_format, self.extension = FORMATS['webp']
+        self.quality = 80
+        self.workers = 2
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._failed = set()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('THUMBNAIL_PREFIX', os.getenv('THUMBNAIL_PREFIX', 'uploads/thumbs'))
+        app.config.setdefault('THUMBNAIL_SIZES', dict(SIZES))
+        app.config.setdefault('THUMBNAIL_FORMAT', os.getenv('THUMBNAIL_FORMAT', 'webp'))
+        app.config.setdefault('THUMBNAIL_QUALITY', int(os.getenv('THUMBNAIL_QUALITY', '80')))
+        app.config.setdefault('THUMBNAIL_WORKERS', int(os.getenv('THUMBNAIL_WORKERS', '2')))
+        self.prefix = app.config['THUMBNAIL_PREFIX'].strip('/')
+        self.sizes = dict(app.config['THUMBNAIL_SIZES'])
+        self.image_format, self.extension = FORMATS[app.config['THUMBNAIL_FORMAT'].lower()]
+        self.quality = int(app.config['THUMBNAIL_QUALITY'])
+        self.workers = int(app.config['THUMBNAIL_WORKERS'])
+        media_store.unlink_listeners.append(self.remove)
+        atexit.register(self.shutdown)
+        app.extensions['thumbnails'] = self
+
+    # -- paths ----------------------------------------------------------------
+
+    def is_image(self, path: Optional[str]) -> bool:
+        return bool(path) and os.path.splitext(path)[1].lower() in IMAGE_EXTENSIONS
+
+    def derivative_path(self, path: str, size: str) -> str:
+        """Path (relative to ``static/``) of the ``size`` derivative of the image at ``path``"""
+        if media_store.is_blob(path):
+            path = path[len(media_store.prefix) + 1:]
+        return f'{self.prefix}/{size}/{os.path.splitext(path)[0]}.{self.extension}'
+
+    def derivative(self, path: Optional[str], size: str) -> Optional[str]:
+        """The ``size`` derivative of ``path`` if it has been rendered, otherwise ``path`` itself"""
+        if not self.is_image(path) or size not in self.sizes:
+            return path
+        derivative_path = self.derivative_path(path, size)
+        if os.path.exists(media_store.absolute(derivative_path)):
+            return derivative_path
+        self.enqueue([path])
+        return path
+
+    # -- rendering ------------------------------------------------------------
+
+    def enqueue(self, paths: Iterable[str]) -> List[Future]:
+        """Render the missing derivatives of the images among ``paths`` in the background"""
+        futures = []
+        for path in paths:
+            if not self.is_image(path):
+                continue
+            targets = [(media_store.absolute(self.derivative_path(path, size)), max_px)
+                       for size, max_px in self.sizes.items()]
+            targets = [target for target in targets if not os.path.exists(target[0])]
+            with self._lock:
+                if not targets or path in self._pending or path in self._failed:
+                    continue
+                self._pending.add(path)
+            future = self._submit(media_store.absolute(path), targets)
+            future.add_done_callback(lambda done, path=path: self._finished(path, done))
+            futures.append(future)
+        return futures
+
+    def _submit(self, source: str, targets: List[Tuple[str, int]]) -> Future:
+        args = (source, targets, self.image_format, self.quality)
+        if self.workers > 0:
+            try:
+                return self._pool().submit(render_derivatives, *args)
+            except RuntimeError:  # Shut down (interpreter exit)
+                pass
+        future = Future()
+        try:
+            future.set_result(render_derivatives(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def _pool(self) -> ProcessPoolExecutor:
+        # Started on first use, not at import, so CLI commands and forking servers do not pay for it
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def _finished(self, path: str, future: Future):
+        with self._lock:
+            self._pending.discard(path)
+            error = None if future.cancelled() else future.exception()
+            if error is not None:
+                # Not retried until restart: a file Pillow cannot read stays unreadable
+                self._failed.add(path)
+        if error is not None:
+            print(f"Error generating thumbnails for {path}: {error}")
+
+    def remove(self, path: str):
+        """Delete the derivatives of ``path`` (its file was deleted)"""
+        for size in self.sizes:
+            try:
+                os.remove(media_store.absolute(self.derivative_path(path, size)))
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                print(f"Error deleting thumbnail of {path}: {e}")
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+thumbnails = Thumbnailer()
@@ -0,0 +1,159 @@
+"""
+Streaming ingestion of multipart file uploads.
+
+Werkzeug's default form parser spools each uploaded file into memory (up to
+500 KB) or an anonymous temporary file, and ``save_uploaded_file`` used to
+seek to its end to measure it and then copy it to its destination -- every
+byte was written to disk twice, and oversized files were only rejected
+after the whole body had been received.
+
+``IngestRequest`` hands the parser an ``IngestedFile`` for every file part
+instead.  The parser writes the body into it chunk by chunk as it reads the
+request, and each chunk is
+
+* counted against ``UPLOAD_MAX_FILE_SIZE`` -- the request is aborted with
+  ``413 Request Entity Too Large`` as soon as a file goes over, before the
+  rest of it is read;
+* fed into a SHA-256 (``IngestedFile.sha256``);
+* written straight to a staging file in ``UPLOAD_STAGING_DIR``, fsynced every
+  ``UPLOAD_FSYNC_BYTES`` rather than per chunk.
+
+``IngestedFile.commit`` moves the staging file into place with a rename, so
+the upload is never copied.  Staging files that are not committed are
+removed when the request ends.  Keep ``UPLOAD_STAGING_DIR`` on the same
+filesystem as ``static/uploads`` (the default, under the instance folder,
+usually is); across filesystems ``commit`` falls back to a copy.
+"""
+import hashlib
+import os
+import shutil
+import time
+import uuid
+from typing import Optional
+
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+STALE_AFTER = 3600  # Staging files older than this are leftovers of crashed workers
+
+
+class IngestedFile:
+    """Write-through staging file for one uploaded file; reads and seeks go to the file"""
+
+    def __init__(self, path: str, limit: Optional[int], fsync_bytes: int):
+        self.path = path
+        self.limit = limit
+        self.fsync_bytes = fsync_bytes
+        self.size = 0
+        self._hash = hashlib.sha256()
+        self._unsynced = 0
+        self._file = open(path, 'w+b')
+
+    def write(self, data: bytes) -> int:
+        self.size += len(data)
+        if self.limit is not None and self.size > self.limit:
+            raise RequestEntityTooLarge(f'File exceeds the maximum upload size of {self.limit // (1024 * 1024)}MB')
+        self._hash.update(data)
+        self._file.write(data)
+        self._unsynced += len(data)
+        if self._unsynced >= self.fsync_bytes:
+            self._sync()
+        return len(data)
+
+    @property
+    def sha256(self) -> str:
+        return self._hash.hexdigest()
+
+    def commit(self, destination: str):
+        """Move the complete upload to ``destination``"""
+        self._sync()
+        self._file.close()
+        try:
+            os.replace(self.path, destination)
+        except OSError:
+            shutil.move(self.path, destination)  # Staging directory on another filesystem
+        self.path = None
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+        if self.path is not None:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            self.path = None
+
+    def _sync(self):
+        if self._unsynced:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._unsynced = 0
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+
+class IngestRequest(Request):
+    """Request whose multipart file parts are streamed through ``upload_ingest``"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        ingested = upload_ingest.open(content_length)
+        self.__dict__.setdefault('_ingested_files', []).append(ingested)
+        return ingested
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            # Also covers files whose parsing was aborted, which never reached ``self.files``
+            for ingested in self.__dict__.pop('_ingested_files', ()):
+                ingested.close()
+
+
+class UploadIngest:
+    def __init__(self, app=None):
+        self.directory = None
+        self.max_file_size = 50 * 1024 * 1024
+        self.fsync_bytes = 8 * 1024 * 1024
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('UPLOAD_STAGING_DIR',
+                              os.getenv('UPLOAD_STAGING_DIR', os.path.join(app.instance_path, 'upload_staging')))
+        app.config.setdefault('UPLOAD_MAX_FILE_SIZE', int(os.getenv('UPLOAD_MAX_FILE_SIZE', str(50 * 1024 * 1024))))
+        app.config.setdefault('UPLOAD_FSYNC_BYTES', int(os.getenv('UPLOAD_FSYNC_BYTES', str(8 * 1024 * 1024))))
+        self.directory = app.config['UPLOAD_STAGING_DIR']
+        self.max_file_size = int(app.config['UPLOAD_MAX_FILE_SIZE'])
+        self.fsync_bytes = max(1, int(app.config['UPLOAD_FSYNC_BYTES']))
+        app.request_class = IngestRequest
+        app.extensions['upload_ingest'] = self
+        self.sweep()
+
+    def open(self, content_length: Optional[int] = None) -> IngestedFile:
+        """A new staging file; fails right away when the part announces a size over the limit"""
+        if content_length is not None and content_length > self.max_file_size:
+            raise RequestEntityTooLarge(f'File exceeds the maximum upload size of {self.max_file_size // (1024 * 1024)}MB')
+        os.makedirs(self.directory, exist_ok=True)
+        return IngestedFile(os.path.join(self.directory, f'{uuid.uuid4().hex}.part'), self.max_file_size, self.fsync_bytes)
+
+    def sweep(self):
+        """Remove staging files left behind by workers that died mid-request"""
+        cutoff = time.time() - STALE_AFTER
+        try:
+            entries = list(os.scandir(self.directory))
+        except OSError:
+            return
+        for entry in entries:
+            try:
+                if entry.name.endswith('.part') and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except OSError:
+                continue
+
+
+upload_ingest = UploadIngest()
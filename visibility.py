@@ -0,0 +1,53 @@
+"""
+Work order visibility for technicians.
+
+A technician sees the work orders assigned to them directly or to one of
+their teams.  The SQL predicate is built from the request's ``Identity``
+(see identity.py), so it never triggers a lazy load of ``user.teams``, and it
+is shaped to match the ``(company_id, assigned_technician_id, status)`` and
+``(company_id, assigned_team_id, status)`` indexes on ``work_orders``: the
+database answers "my open tasks" with one index scan per branch of the OR,
+however many teams the technician belongs to.
+"""
+from typing import FrozenSet, Optional, Tuple
+
+from flask_login import current_user
+from sqlalchemy import false, or_
+
+from identity import current_identity, team_ids_for
+from models import WorkOrder, MaintenanceSchedule
+
+
+def _principal(user=None) -> Tuple[int, FrozenSet[int]]:
+    if user is None:
+        user = current_user
+    identity = current_identity()
+    if identity is not None and identity.user_id == user.id:
+        return identity.user_id, identity.team_ids
+    return user.id, frozenset(team_ids_for(user))
+
+
+def assigned_work_orders_filter(user=None):
+    """SQL predicate for work orders assigned to ``user`` (default: current user) or their teams"""
+    user_id, team_ids = _principal(user)
+    if not team_ids:
+        return WorkOrder.assigned_technician_id == user_id
+    return or_(WorkOrder.assigned_technician_id == user_id,
+               WorkOrder.assigned_team_id.in_(sorted(team_ids)))
+
+
+def assigned_schedules_filter(user=None):
+    """SQL predicate for maintenance schedules assigned to one of ``user``'s teams"""
+    _, team_ids = _principal(user)
+    if not team_ids:
+        return false()
+    return MaintenanceSchedule.assigned_team_id.in_(sorted(team_ids))
+
+
+def is_assigned(work_order, user=None) -> bool:
+    """Python counterpart of ``assigned_work_orders_filter`` for an already loaded work order"""
+    user_id, team_ids = _principal(user)
+    if getattr(user if user is not None else current_user, 'company_id', None) != work_order.company_id:
+        return False
+    return (work_order.assigned_technician_id == user_id or
+            (work_order.assigned_team_id is not None and work_order.assigned_team_id in team_ids))
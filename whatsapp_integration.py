@@ -6,8 +6,10 @@ from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Any
 from flask import current_app
 from deep_translator import GoogleTranslator
+from metrics import metrics
 from models import db, WhatsAppUser, WhatsAppMessage, WhatsAppTemplate, NotificationLog, WorkOrder, User, Equipment, MaintenanceSchedule, EmergencyBroadcast
-import uuid
+from recurrence import complete_schedule
+from media_store import media_store
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -83,7 +85,9 @@ class WhatsAppIntegration:
             else:
                 return {'success': False, 'error': 'Unsupported message type'}
             
-            response = requests.post(url, headers=headers, json=payload)
+            with metrics.track_outbound('whatsapp') as call:
+                response = requests.post(url, headers=headers, json=payload)
+                call.failed = response.status_code != 200
             response_data = response.json()
             
             if response.status_code == 200:
@@ -121,7 +125,9 @@ class WhatsAppIntegration:
                 }
             }
             
-            response = requests.post(url, headers=headers, json=payload)
+            with metrics.track_outbound('whatsapp') as call:
+                response = requests.post(url, headers=headers, json=payload)
+                call.failed = response.status_code != 200
             response_data = response.json()
             
             if response.status_code == 200:
@@ -602,16 +608,8 @@ Need more help? Contact your supervisor."""
         if not schedule:
             return
         
-        schedule.last_performed = datetime.now()
-        # Calculate next due date
-        if schedule.frequency == 'daily':
-            schedule.next_due = datetime.now() + timedelta(days=schedule.frequency_value)
-        elif schedule.frequency == 'weekly':
-            schedule.next_due = datetime.now() + timedelta(weeks=schedule.frequency_value)
-        elif schedule.frequency == 'monthly':
-            schedule.next_due = datetime.now() + timedelta(days=30 * schedule.frequency_value)
-        elif schedule.frequency == 'yearly':
-            schedule.next_due = datetime.now() + timedelta(days=365 * schedule.frequency_value)
+        # Next due date follows the schedule's recurrence rule
+        complete_schedule(schedule, datetime.now())
         
         db.session.commit()
         
@@ -649,15 +647,8 @@ Need more help? Contact your supervisor."""
             if media_response.status_code != 200:
                 return None
             
-            # Save to local storage
-            filename = f"whatsapp_media_{uuid.uuid4()}.jpg"  # Assuming image for now
-            filepath = os.path.join('static', 'uploads', 'whatsapp', filename)
-            os.makedirs(os.path.dirname(filepath), exist_ok=True)
-            
-            with open(filepath, 'wb') as f:
-                f.write(media_response.content)
-            
-            return f"uploads/whatsapp/{filename}"
+            # Save to the media store; a re-sent photo is stored once
+            return media_store.store_bytes(media_response.content, 'whatsapp_media.jpg')  # Assuming image for now
             
         except Exception as e:
             logger.error(f"Error downloading media: {str(e)}")
@@ -2,7 +2,7 @@ import json
 import logging
 from datetime import datetime
 from typing import List, Dict
-from models import db, WhatsAppUser, NotificationLog, WorkOrder, MaintenanceSchedule, EmergencyBroadcast
+from models import db, User, WhatsAppUser, NotificationLog, WorkOrder, MaintenanceSchedule, EmergencyBroadcast
 from whatsapp_integration import whatsapp
 
 logger = logging.getLogger(__name__)
@@ -61,6 +61,37 @@ class WhatsAppNotifications:
         
         return result['success']
     
+    @staticmethod
+    def notify_bulk_assignment(technician, assigned_count: int) -> bool:
+        """Send one summary WhatsApp notification for a bulk work order assignment"""
+        if assigned_count <= 0:
+            return False
+        
+        whatsapp_user = WhatsAppUser.query.filter_by(user_id=technician.id).first()
+        if not whatsapp_user or not whatsapp_user.is_verified:
+            return False
+        
+        message = f"🔧 {assigned_count} work orders have been assigned to you.\n\nOpen the mobile app to see your updated task list."
+        translated_message = whatsapp.translate_message(message, whatsapp_user.preferred_language)
+        
+        result = whatsapp.send_message(whatsapp_user.whatsapp_number, translated_message)
+        
+        # Log the notification
+        notification = NotificationLog(
+            company_id=technician.company_id,
+            notification_type='whatsapp',
+            recipient_id=technician.id,
+            recipient_whatsapp_id=whatsapp_user.id,
+            subject='Work Orders Assigned',
+            content=translated_message,
+            status='sent' if result['success'] else 'failed',
+            error_message=result.get('error')
+        )
+        db.session.add(notification)
+        db.session.commit()
+        
+        return result['success']
+    
     @staticmethod
     def notify_priority_escalation(work_order: WorkOrder, old_priority: str) -> bool:
         """Send WhatsApp notification for priority escalation"""
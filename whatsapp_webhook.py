@@ -1,12 +1,12 @@
 import json
 import logging
-import uuid
-import os
 import requests
 from datetime import datetime
 from typing import Dict, Any
 from models import db, WhatsAppUser, WhatsAppMessage, WorkOrder, MaintenanceSchedule
 from whatsapp_integration import whatsapp
+from recurrence import complete_schedule
+from media_store import media_store
 
 logger = logging.getLogger(__name__)
 
@@ -268,17 +268,8 @@ Need more help? Contact your supervisor."""
         if not schedule:
             return
         
-        schedule.last_performed = datetime.now()
-        # Calculate next due date
-        from datetime import timedelta
-        if schedule.frequency == 'daily':
-            schedule.next_due = datetime.now() + timedelta(days=schedule.frequency_value)
-        elif schedule.frequency == 'weekly':
-            schedule.next_due = datetime.now() + timedelta(weeks=schedule.frequency_value)
-        elif schedule.frequency == 'monthly':
-            schedule.next_due = datetime.now() + timedelta(days=30 * schedule.frequency_value)
-        elif schedule.frequency == 'yearly':
-            schedule.next_due = datetime.now() + timedelta(days=365 * schedule.frequency_value)
+        # Next due date follows the schedule's recurrence rule
+        complete_schedule(schedule, datetime.now())
         
         db.session.commit()
         
@@ -344,15 +335,8 @@ Need more help? Contact your supervisor."""
             if media_response.status_code != 200:
                 return None
             
-            # Save to local storage
-            filename = f"whatsapp_media_{uuid.uuid4()}.jpg"  # Assuming image for now
-            filepath = os.path.join('static', 'uploads', 'whatsapp', filename)
-            os.makedirs(os.path.dirname(filepath), exist_ok=True)
-            
-            with open(filepath, 'wb') as f:
-                media_response.content
-            
-            return f"uploads/whatsapp/{filename}"
+            # Save to the media store; a re-sent photo is stored once
+            return media_store.store_bytes(media_response.content, 'whatsapp_media.jpg')  # Assuming image for now
             
         except Exception as e:
             logger.error(f"Error downloading media: {str(e)}")
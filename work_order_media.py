@@ -0,0 +1,108 @@
+"""
+Photos, videos and voice notes of work orders and comments.
+
+Each file is one ``work_order_media`` row (owner type and id, kind, path,
+size, MIME type, uploader), indexed by ``(owner_type, owner_id, kind)``.
+Adding media is an insert, so a work order with hundreds of photos no
+longer rewrites a growing comma-separated column on every upload, and
+readers get lists (``WorkOrder.image_paths`` ...) instead of splitting
+text.  List pages load the media of all their rows with one query
+(``selectinload(WorkOrder.media)`` or ``media_by_owner``).
+
+Every row holds one reference to its file in the media store (see
+media_store.py); ``detach_all`` drops them together with the rows.  Rows
+are not tied to their owner by a foreign key, so whatever deletes work
+orders or comments must detach their media first; ``detach_orphans``
+cleans up after code that did not.
+"""
+import mimetypes
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import delete, exists, select
+
+from extensions import db
+from models import MediaBlob, WorkOrder, WorkOrderComment, WorkOrderMedia
+from media_store import media_store
+from thumbnails import thumbnails
+
+# Upload form field / legacy column -> kind
+FIELD_KINDS = {'images': 'image', 'videos': 'video', 'voice_notes': 'audio'}
+
+
+def guess_mime_type(kind: str, path: str) -> Optional[str]:
+    """MIME type of a media file; ``.webm``/``.mp4`` voice notes are audio, not video"""
+    mime_type = mimetypes.guess_type(path)[0]
+    if kind == 'audio' and mime_type and mime_type.startswith('video/'):
+        return 'audio/' + mime_type.split('/', 1)[1]
+    return mime_type
+
+
+def attach_media(owner, kind: str, paths: Iterable[str], uploaded_by_id: Optional[int] = None) -> List[WorkOrderMedia]:
+    """Add stored ``paths`` of ``kind`` (image, video, audio) to a work order or comment"""
+    paths = [path for path in paths if path]
+    if not paths:
+        return []
+    if owner.id is None:
+        db.session.flush()
+    sizes = dict(db.session.execute(
+        select(MediaBlob.path, MediaBlob.size).where(MediaBlob.path.in_(set(paths)))
+    ).all())
+    rows = [WorkOrderMedia(company_id=owner.company_id, owner_type=owner.media_owner_type, owner_id=owner.id,
+                           kind=kind, path=path, size=sizes.get(path), mime_type=guess_mime_type(kind, path),
+                           uploaded_by_id=uploaded_by_id)
+            for path in paths]
+    db.session.add_all(rows)
+    if kind == 'image':
+        thumbnails.enqueue(paths)
+    # ``owner.media`` is read-only; reload it on next access
+    db.session.expire(owner, ['media'])
+    return rows
+
+
+def media_by_owner(owner_type: str, owner_ids: Iterable[int]) -> Dict[int, Dict[str, List[str]]]:
+    """``{owner_id: {kind: [paths]}}`` for many owners in one query"""
+    owner_ids = list(owner_ids)
+    result: Dict[int, Dict[str, List[str]]] = {}
+    if not owner_ids:
+        return result
+    for owner_id, kind, path in db.session.execute(
+            select(WorkOrderMedia.owner_id, WorkOrderMedia.kind, WorkOrderMedia.path)
+            .where(WorkOrderMedia.owner_type == owner_type, WorkOrderMedia.owner_id.in_(owner_ids))
+            .order_by(WorkOrderMedia.id)):
+        result.setdefault(owner_id, {}).setdefault(kind, []).append(path)
+    return result
+
+
+def detach_all(owner_type: str, owner_ids: Iterable[int]) -> List[str]:
+    """Delete the media rows of the owners and release their files; returns the paths
+    that are not in the media store (files from before it, to delete directly)"""
+    owner_ids = list(owner_ids)
+    if not owner_ids:
+        return []
+    owned = (WorkOrderMedia.owner_type == owner_type, WorkOrderMedia.owner_id.in_(owner_ids))
+    paths = list(db.session.execute(select(WorkOrderMedia.path).where(*owned)).scalars())
+    db.session.execute(delete(WorkOrderMedia).where(*owned))
+    return media_store.release(paths)
+
+
+def detach_work_orders(work_order_ids: Iterable[int]) -> List[str]:
+    """``detach_all`` for work orders and all their comments"""
+    work_order_ids = list(work_order_ids)
+    if not work_order_ids:
+        return []
+    comment_ids = list(db.session.execute(
+        select(WorkOrderComment.id).where(WorkOrderComment.work_order_id.in_(work_order_ids))
+    ).scalars())
+    return detach_all('work_order', work_order_ids) + detach_all('comment', comment_ids)
+
+
+def detach_orphans() -> List[str]:
+    """Detach media rows whose work order or comment no longer exists; returns legacy paths like ``detach_all``"""
+    legacy_paths = []
+    for owner_type, owner in (('work_order', WorkOrder), ('comment', WorkOrderComment)):
+        owner_ids = list(db.session.execute(
+            select(WorkOrderMedia.owner_id).distinct()
+            .where(WorkOrderMedia.owner_type == owner_type, ~exists().where(owner.id == WorkOrderMedia.owner_id))
+        ).scalars())
+        legacy_paths += detach_all(owner_type, owner_ids)
+    return legacy_paths